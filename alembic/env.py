@@ -5,7 +5,7 @@ from alembic import context
 import asyncio
 
 from bot.models.base import Base  # Базовый класс
-from bot.models.models import User, Context, Category, Expense, Income
+from bot.models.models import User, Context, Category, Operation
 from bot.config import settings  # настройки
 from sqlalchemy.ext.asyncio import async_engine_from_config
 
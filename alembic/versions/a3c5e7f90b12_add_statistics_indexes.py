@@ -0,0 +1,57 @@
+"""Add statistics indexes
+
+Revision ID: a3c5e7f90b12
+Revises: 54194f90a22e
+Create Date: 2026-10-18 10:12:41.503118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3c5e7f90b12'
+down_revision: Union[str, Sequence[str], None] = '54194f90a22e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CREATE INDEX CONCURRENTLY нельзя выполнять внутри транзакции
+    with op.get_context().autocommit_block():
+        for table in ('expenses', 'incomes'):
+            op.create_index(
+                f'ix_{table}_context_id_user_id_created_at',
+                table,
+                ['context_id', 'user_id', 'created_at'],
+                unique=False,
+                postgresql_include=['amount', 'category_id'],
+                postgresql_concurrently=True,
+            )
+        op.create_index(
+            'ix_categories_context_id_lower_title',
+            'categories',
+            ['context_id', sa.text('lower(title)')],
+            unique=False,
+            postgresql_where=sa.text('NOT is_deleted'),
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_categories_context_id_lower_title',
+            table_name='categories',
+            postgresql_concurrently=True,
+        )
+        for table in ('incomes', 'expenses'):
+            op.drop_index(
+                f'ix_{table}_context_id_user_id_created_at',
+                table_name=table,
+                postgresql_concurrently=True,
+            )
@@ -0,0 +1,32 @@
+"""Add compact confirmations setting to contexts
+
+Revision ID: a7c9e1b3d5f6
+Revises: f6b8d0a2c4e5
+Create Date: 2026-10-18 19:12:47.215093
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7c9e1b3d5f6'
+down_revision: Union[str, Sequence[str], None] = 'f6b8d0a2c4e5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Константное значение по умолчанию не требует перезаписи таблицы
+    op.add_column(
+        'contexts',
+        sa.Column('compact_confirmations', sa.Boolean(), server_default=sa.text('false'), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('contexts', 'compact_confirmations')
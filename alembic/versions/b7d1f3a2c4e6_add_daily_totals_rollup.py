@@ -0,0 +1,53 @@
+"""Add daily_totals rollup
+
+Revision ID: b7d1f3a2c4e6
+Revises: a3c5e7f90b12
+Create Date: 2026-10-18 11:40:03.215894
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7d1f3a2c4e6'
+down_revision: Union[str, Sequence[str], None] = 'a3c5e7f90b12'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('daily_totals',
+    sa.Column('context_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('category_id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(), nullable=False),
+    sa.Column('total', sa.Numeric(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['category_id'], ['categories.id'], ),
+    sa.ForeignKeyConstraint(['context_id'], ['contexts.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('context_id', 'user_id', 'day', 'category_id', 'kind')
+    )
+    # Заполнение агрегата из существующей истории
+    op.execute(
+        """
+        INSERT INTO daily_totals (context_id, user_id, day, category_id, kind, total, count)
+        SELECT context_id, user_id, created_at::date, category_id, 'income', sum(amount), count(*)
+        FROM incomes
+        GROUP BY context_id, user_id, created_at::date, category_id
+        UNION ALL
+        SELECT context_id, user_id, created_at::date, category_id, 'expense', sum(amount), count(*)
+        FROM expenses
+        GROUP BY context_id, user_id, created_at::date, category_id
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('daily_totals')
@@ -0,0 +1,153 @@
+"""Partition expenses and incomes by month of created_at
+
+Revision ID: b8d0f2a4c6e7
+Revises: a7c9e1b3d5f6
+Create Date: 2026-10-18 20:03:55.601284
+
+"""
+from datetime import date
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b8d0f2a4c6e7'
+down_revision: Union[str, Sequence[str], None] = 'a7c9e1b3d5f6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = ('expenses', 'incomes')
+# Строк за одну транзакцию переноса
+BATCH_SIZE = 50000
+# Секции создаются с запасом на столько месяцев вперед (дальше — python manage.py partitions maintain)
+MONTHS_AHEAD = 3
+
+
+def _add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _create_partitioned(table: str, first_month: date, last_month: date) -> None:
+    new = f'{table}_partitioned'
+    # LIKE сохраняет типы, NOT NULL и значение по умолчанию id из последовательности старой таблицы
+    op.execute(f'CREATE TABLE {new} (LIKE {table} INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)')
+    # Ключ секционированной таблицы обязан включать created_at
+    op.execute(f'ALTER TABLE {new} ADD CONSTRAINT {new}_pkey PRIMARY KEY (id, created_at)')
+    for column, target in (('user_id', 'users'), ('context_id', 'contexts'), ('category_id', 'categories')):
+        op.execute(
+            f'ALTER TABLE {new} ADD CONSTRAINT {new}_{column}_fkey '
+            f'FOREIGN KEY ({column}) REFERENCES {target} (id)'
+        )
+    op.execute(
+        f'CREATE INDEX ix_{new}_context_id_user_id_created_at_id '
+        f'ON {new} (context_id, user_id, created_at, id) INCLUDE (amount, category_id)'
+    )
+    # Строки вне созданных месяцев (например, импорт старой выписки) попадают сюда,
+    # а manage.py partitions maintain выносит их в месячные секции
+    op.execute(f'CREATE TABLE {table}_default PARTITION OF {new} DEFAULT')
+    month = first_month
+    while month <= last_month:
+        upper = _add_months(month, 1)
+        op.execute(
+            f"CREATE TABLE {table}_y{month.year}m{month.month:02d} PARTITION OF {new} "
+            f"FOR VALUES FROM ('{month}') TO ('{upper}')"
+        )
+        month = upper
+
+
+def _create_sync_trigger(table: str) -> None:
+    # Пока строки переносятся пачками, изменения старой таблицы повторяются в новой
+    new = f'{table}_partitioned'
+    op.execute(f"""
+        CREATE FUNCTION {table}_sync_partitioned() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                DELETE FROM {new} WHERE id = OLD.id AND created_at = OLD.created_at;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                INSERT INTO {new} VALUES (NEW.*) ON CONFLICT DO NOTHING;
+            END IF;
+            RETURN NULL;
+        END
+        $$
+    """)
+    op.execute(
+        f'CREATE TRIGGER {table}_sync_partitioned AFTER INSERT OR UPDATE OR DELETE ON {table} '
+        f'FOR EACH ROW EXECUTE FUNCTION {table}_sync_partitioned()'
+    )
+
+
+def _copy_in_batches(table: str) -> None:
+    bind = op.get_bind()
+    low, high = bind.execute(sa.text(f'SELECT min(id), max(id) FROM {table}')).one()
+    if low is None:
+        return
+    # Каждая пачка — отдельная короткая транзакция. FOR SHARE не дает удалить или изменить
+    # строку, пока она копируется: триггер применит изменение уже после переноса
+    for start in range(low, high + 1, BATCH_SIZE):
+        bind.execute(
+            sa.text(
+                f'INSERT INTO {table}_partitioned SELECT * FROM '
+                f'(SELECT * FROM {table} WHERE id >= :start AND id < :end FOR SHARE) AS batch '
+                f'ON CONFLICT DO NOTHING'
+            ),
+            {'start': start, 'end': start + BATCH_SIZE},
+        )
+
+
+def _swap(table: str) -> None:
+    new = f'{table}_partitioned'
+    op.execute(f'LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE')
+    op.execute(f'DROP TRIGGER {table}_sync_partitioned ON {table}')
+    op.execute(f'DROP FUNCTION {table}_sync_partitioned()')
+    op.execute(f'ALTER TABLE {table} RENAME TO {table}_unpartitioned')
+    op.execute(f'ALTER TABLE {new} RENAME TO {table}')
+    # Последовательность id остается прежней и переходит к новой таблице
+    op.execute(f'ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id')
+    op.execute(f'DROP TABLE {table}_unpartitioned')
+    op.execute(f'ALTER TABLE {table} RENAME CONSTRAINT {new}_pkey TO {table}_pkey')
+    for column in ('user_id', 'context_id', 'category_id'):
+        op.execute(f'ALTER TABLE {table} RENAME CONSTRAINT {new}_{column}_fkey TO {table}_{column}_fkey')
+    op.execute(
+        f'ALTER INDEX ix_{new}_context_id_user_id_created_at_id '
+        f'RENAME TO ix_{table}_context_id_user_id_created_at_id'
+    )
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    today = date.today().replace(day=1)
+    with op.get_context().autocommit_block():
+        for table in TABLES:
+            first = bind.execute(sa.text(f"SELECT date_trunc('month', min(created_at))::date FROM {table}")).scalar()
+            _create_partitioned(table, first or today, _add_months(today, MONTHS_AHEAD))
+            _create_sync_trigger(table)
+            _copy_in_batches(table)
+    # Подмена таблиц — одна короткая транзакция: строки уже перенесены
+    for table in TABLES:
+        _swap(table)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Обратное преобразование переносит строки одной транзакцией (без работы бота)
+    for table in TABLES:
+        op.execute(f'CREATE TABLE {table}_unpartitioned (LIKE {table} INCLUDING DEFAULTS)')
+        op.execute(f'INSERT INTO {table}_unpartitioned SELECT * FROM {table}')
+        op.execute(f'ALTER SEQUENCE {table}_id_seq OWNED BY {table}_unpartitioned.id')
+        op.execute(f'DROP TABLE {table}')
+        op.execute(f'ALTER TABLE {table}_unpartitioned RENAME TO {table}')
+        op.execute(f'ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY (id)')
+        for column, target in (('user_id', 'users'), ('context_id', 'contexts'), ('category_id', 'categories')):
+            op.execute(
+                f'ALTER TABLE {table} ADD CONSTRAINT {table}_{column}_fkey '
+                f'FOREIGN KEY ({column}) REFERENCES {target} (id)'
+            )
+        op.execute(
+            f'CREATE INDEX ix_{table}_context_id_user_id_created_at_id '
+            f'ON {table} (context_id, user_id, created_at, id) INCLUDE (amount, category_id)'
+        )
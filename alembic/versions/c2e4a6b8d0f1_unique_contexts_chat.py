@@ -0,0 +1,70 @@
+"""Unique (context_id, context_type) on contexts
+
+Revision ID: c2e4a6b8d0f1
+Revises: b7d1f3a2c4e6
+Create Date: 2026-10-18 13:05:27.640192
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c2e4a6b8d0f1'
+down_revision: Union[str, Sequence[str], None] = 'b7d1f3a2c4e6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Дубликаты контекстов, созданные гонкой SELECT/INSERT, сливаются в контекст с наименьшим id
+    op.execute(
+        """
+        CREATE TEMPORARY TABLE context_duplicates ON COMMIT DROP AS
+        SELECT id, min(id) OVER (PARTITION BY context_id, context_type) AS keep_id
+        FROM contexts
+        """
+    )
+    op.execute("DELETE FROM context_duplicates WHERE id = keep_id")
+    for table in ('categories', 'expenses', 'incomes'):
+        op.execute(
+            f"""
+            UPDATE {table} t SET context_id = d.keep_id
+            FROM context_duplicates d WHERE t.context_id = d.id
+            """
+        )
+    # Дневные агрегаты затронутых контекстов пересчитываются из операций
+    op.execute(
+        """
+        DELETE FROM daily_totals
+        WHERE context_id IN (SELECT id FROM context_duplicates UNION SELECT keep_id FROM context_duplicates)
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO daily_totals (context_id, user_id, day, category_id, kind, total, count)
+        SELECT context_id, user_id, created_at::date, category_id, 'income', sum(amount), count(*)
+        FROM incomes WHERE context_id IN (SELECT keep_id FROM context_duplicates)
+        GROUP BY context_id, user_id, created_at::date, category_id
+        UNION ALL
+        SELECT context_id, user_id, created_at::date, category_id, 'expense', sum(amount), count(*)
+        FROM expenses WHERE context_id IN (SELECT keep_id FROM context_duplicates)
+        GROUP BY context_id, user_id, created_at::date, category_id
+        """
+    )
+    op.execute("DELETE FROM contexts WHERE id IN (SELECT id FROM context_duplicates)")
+
+    op.create_unique_constraint(
+        'uq_contexts_context_id_context_type', 'contexts', ['context_id', 'context_type']
+    )
+    # Уникальный индекс начинается с context_id, отдельный индекс больше не нужен
+    op.drop_index(op.f('ix_contexts_context_id'), table_name='contexts')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.create_index(op.f('ix_contexts_context_id'), 'contexts', ['context_id'], unique=False)
+    op.drop_constraint('uq_contexts_context_id_context_type', 'contexts', type_='unique')
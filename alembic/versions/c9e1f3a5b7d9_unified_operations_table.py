@@ -0,0 +1,175 @@
+"""Merge expenses and incomes into one operations table
+
+Revision ID: c9e1f3a5b7d9
+Revises: b8d0f2a4c6e7
+Create Date: 2026-10-18 21:26:14.508917
+
+"""
+from datetime import date
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c9e1f3a5b7d9'
+down_revision: Union[str, Sequence[str], None] = 'b8d0f2a4c6e7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+SOURCES = (('expenses', 'expense'), ('incomes', 'income'))
+COLUMNS = 'user_id, context_id, category_id, amount, created_at'
+# Строк за одну транзакцию переноса
+BATCH_SIZE = 50000
+# Секции создаются с запасом на столько месяцев вперед (дальше — python manage.py partitions maintain)
+MONTHS_AHEAD = 3
+
+
+def _add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _create_partitions(table: str, source: str) -> None:
+    # Месячные секции от первого месяца данных source до MONTHS_AHEAD месяцев вперед
+    bind = op.get_bind()
+    today = date.today().replace(day=1)
+    first = bind.execute(sa.text(f"SELECT date_trunc('month', min(created_at))::date FROM {source}")).scalar()
+    op.execute(f'CREATE TABLE {table}_default PARTITION OF {table} DEFAULT')
+    month = first or today
+    while month <= _add_months(today, MONTHS_AHEAD):
+        upper = _add_months(month, 1)
+        op.execute(
+            f"CREATE TABLE {table}_y{month.year}m{month.month:02d} PARTITION OF {table} "
+            f"FOR VALUES FROM ('{month}') TO ('{upper}')"
+        )
+        month = upper
+
+
+def _id_expression(table: str, row: str, income_offset: tuple[int, int]) -> str:
+    # id расходов сохраняются (кнопки удаления в отправленных сообщениях продолжают работать),
+    # старые id доходов сдвигаются за все уже выданные id обеих таблиц
+    if table == 'expenses':
+        return f'{row}.id'
+    last_income_id, offset = income_offset
+    return f'CASE WHEN {row}.id <= {last_income_id} THEN {row}.id + {offset} ELSE {row}.id END'
+
+
+def _create_sync_trigger(table: str, kind: str, income_offset: tuple[int, int]) -> None:
+    # Пока строки переносятся пачками, изменения старых таблиц повторяются в operations
+    op.execute(f"""
+        CREATE FUNCTION {table}_sync_operations() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                DELETE FROM operations
+                WHERE id = {_id_expression(table, 'OLD', income_offset)} AND created_at = OLD.created_at;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                INSERT INTO operations (id, kind, {COLUMNS})
+                VALUES ({_id_expression(table, 'NEW', income_offset)}, '{kind}', NEW.user_id, NEW.context_id,
+                        NEW.category_id, NEW.amount, NEW.created_at)
+                ON CONFLICT DO NOTHING;
+            END IF;
+            RETURN NULL;
+        END
+        $$
+    """)
+    op.execute(
+        f'CREATE TRIGGER {table}_sync_operations AFTER INSERT OR UPDATE OR DELETE ON {table} '
+        f'FOR EACH ROW EXECUTE FUNCTION {table}_sync_operations()'
+    )
+
+
+def _copy_in_batches(table: str, kind: str, income_offset: tuple[int, int]) -> None:
+    bind = op.get_bind()
+    low, high = bind.execute(sa.text(f'SELECT min(id), max(id) FROM {table}')).one()
+    if low is None:
+        return
+    # Каждая пачка — отдельная короткая транзакция. FOR SHARE не дает удалить или изменить
+    # строку, пока она копируется: триггер применит изменение уже после переноса
+    for start in range(low, high + 1, BATCH_SIZE):
+        bind.execute(
+            sa.text(
+                f"INSERT INTO operations (id, kind, {COLUMNS}) "
+                f"SELECT {_id_expression(table, 'batch', income_offset)}, '{kind}', {COLUMNS} FROM "
+                f"(SELECT * FROM {table} WHERE id >= :start AND id < :end FOR SHARE) AS batch "
+                f"ON CONFLICT DO NOTHING"
+            ),
+            {'start': start, 'end': start + BATCH_SIZE},
+        )
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    op.execute("CREATE TYPE operation_kind AS ENUM ('income', 'expense')")
+    # Новая таблица берет последовательность id расходов, она становится общей
+    op.execute('CREATE TABLE operations (LIKE expenses INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)')
+    op.execute('ALTER TABLE operations ADD COLUMN kind operation_kind NOT NULL')
+    op.execute('ALTER TABLE operations ADD CONSTRAINT operations_pkey PRIMARY KEY (id, created_at)')
+    for column, target in (('user_id', 'users'), ('context_id', 'contexts'), ('category_id', 'categories')):
+        op.execute(
+            f'ALTER TABLE operations ADD CONSTRAINT operations_{column}_fkey '
+            f'FOREIGN KEY ({column}) REFERENCES {target} (id)'
+        )
+    op.execute(
+        'CREATE INDEX ix_operations_context_id_user_id_created_at_id '
+        'ON operations (context_id, user_id, created_at, id) INCLUDE (kind, amount, category_id)'
+    )
+    _create_partitions('operations', '(SELECT created_at FROM expenses UNION ALL SELECT created_at FROM incomes) AS ops')
+
+    # С этого момента новые доходы получают id из общей последовательности, а старые id доходов
+    # переносятся со сдвигом за все выданные id: пересечений нет, а кнопки удаления старых доходов
+    # указывают на пустой диапазон, а не на чужую операцию
+    op.execute('LOCK TABLE expenses, incomes IN EXCLUSIVE MODE')
+    last_expense_id = bind.execute(sa.text('SELECT last_value FROM expenses_id_seq')).scalar()
+    last_income_id = bind.execute(sa.text('SELECT last_value FROM incomes_id_seq')).scalar()
+    offset = last_expense_id + last_income_id
+    bind.execute(sa.text("SELECT setval('expenses_id_seq', :value)"), {'value': offset + last_income_id})
+    op.execute("ALTER TABLE incomes ALTER COLUMN id SET DEFAULT nextval('expenses_id_seq')")
+    income_offset = (last_income_id, offset)
+    for table, kind in SOURCES:
+        _create_sync_trigger(table, kind, income_offset)
+
+    # Блок фиксирует подготовку и переносит строки пачками без долгих блокировок
+    with op.get_context().autocommit_block():
+        for table, kind in SOURCES:
+            _copy_in_batches(table, kind, income_offset)
+
+    # Подмена — одна короткая транзакция: строки уже перенесены
+    op.execute('LOCK TABLE expenses, incomes IN ACCESS EXCLUSIVE MODE')
+    for table, _ in SOURCES:
+        op.execute(f'DROP TRIGGER {table}_sync_operations ON {table}')
+        op.execute(f'DROP FUNCTION {table}_sync_operations()')
+    op.execute('ALTER SEQUENCE expenses_id_seq OWNED BY operations.id')
+    op.execute('ALTER SEQUENCE expenses_id_seq RENAME TO operations_id_seq')
+    op.execute('DROP TABLE expenses')
+    op.execute('DROP TABLE incomes')
+    op.execute('ALTER TABLE daily_totals ALTER COLUMN kind TYPE operation_kind USING kind::operation_kind')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Обратное преобразование переносит строки одной транзакцией (без работы бота)
+    op.execute('ALTER TABLE daily_totals ALTER COLUMN kind TYPE varchar USING kind::text')
+    for table, kind in SOURCES:
+        op.execute(f'CREATE TABLE {table} (LIKE operations INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)')
+        op.execute(f'ALTER TABLE {table} DROP COLUMN kind')
+        op.execute(f'CREATE SEQUENCE {table}_id_seq OWNED BY {table}.id')
+        op.execute(f"ALTER TABLE {table} ALTER COLUMN id SET DEFAULT nextval('{table}_id_seq')")
+        op.execute(f'ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY (id, created_at)')
+        for column, target in (('user_id', 'users'), ('context_id', 'contexts'), ('category_id', 'categories')):
+            op.execute(
+                f'ALTER TABLE {table} ADD CONSTRAINT {table}_{column}_fkey '
+                f'FOREIGN KEY ({column}) REFERENCES {target} (id)'
+            )
+        op.execute(
+            f'CREATE INDEX ix_{table}_context_id_user_id_created_at_id '
+            f'ON {table} (context_id, user_id, created_at, id) INCLUDE (amount, category_id)'
+        )
+        _create_partitions(table, f"operations WHERE kind = '{kind}'")
+        op.execute(f"INSERT INTO {table} (id, {COLUMNS}) SELECT id, {COLUMNS} FROM operations WHERE kind = '{kind}'")
+        op.execute(f"SELECT setval('{table}_id_seq', (SELECT coalesce(max(id), 0) + 1 FROM operations), false)")
+    op.execute('DROP TABLE operations')
+    op.execute('DROP TYPE operation_kind')
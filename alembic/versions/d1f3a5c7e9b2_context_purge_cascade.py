@@ -0,0 +1,73 @@
+"""Background context purge: purging flag, cascading foreign keys and their indexes
+
+Revision ID: d1f3a5c7e9b2
+Revises: c9e1f3a5b7d9
+Create Date: 2026-10-18 22:41:09.376512
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd1f3a5c7e9b2'
+down_revision: Union[str, Sequence[str], None] = 'c9e1f3a5b7d9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Ссылки, которые удаляются вместе с контекстом или категорией
+CASCADE_KEYS = (
+    ('categories', 'context_id', 'contexts'),
+    ('daily_totals', 'context_id', 'contexts'),
+    ('daily_totals', 'category_id', 'categories'),
+    ('operations', 'context_id', 'contexts'),
+    ('operations', 'category_id', 'categories'),
+)
+
+
+def _replace_foreign_keys(ondelete: str, validate_later: bool) -> None:
+    for table, column, target in CASCADE_KEYS:
+        name = f'{table}_{column}_fkey'
+        # NOT VALID не проверяет строки под блокировкой; секционированные таблицы его не поддерживают
+        not_valid = ' NOT VALID' if validate_later and table != 'operations' else ''
+        op.execute(
+            f'ALTER TABLE {table} DROP CONSTRAINT {name}, '
+            f'ADD CONSTRAINT {name} FOREIGN KEY ({column}) REFERENCES {target} (id) ON DELETE {ondelete}{not_valid}'
+        )
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Константное значение по умолчанию не требует перезаписи таблицы
+    op.add_column('contexts', sa.Column('purging', sa.Boolean(), server_default=sa.text('false'), nullable=False))
+    _replace_foreign_keys('CASCADE', validate_later=True)
+
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        for table, column, _ in CASCADE_KEYS:
+            if table != 'operations':
+                op.execute(f'ALTER TABLE {table} VALIDATE CONSTRAINT {table}_{column}_fkey')
+        # Удаление категории проверяет ссылки на нее по индексу, а не просмотром таблиц
+        op.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_daily_totals_category_id ON daily_totals (category_id)')
+        # Индекс секционированной таблицы: пустой родительский индекс и индексы секций,
+        # построенные без блокировки записи; новые секции получают его при ATTACH PARTITION
+        op.execute('CREATE INDEX IF NOT EXISTS ix_operations_category_id ON ONLY operations (category_id)')
+        partitions = bind.execute(sa.text(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE parent.relname = 'operations'"
+        )).scalars().all()
+        for partition in partitions:
+            op.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {partition}_category_id_idx ON {partition} (category_id)')
+            op.execute(f'ALTER INDEX ix_operations_category_id ATTACH PARTITION {partition}_category_id_idx')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_operations_category_id', table_name='operations')
+    op.drop_index('ix_daily_totals_category_id', table_name='daily_totals')
+    _replace_foreign_keys('NO ACTION', validate_later=False)
+    op.drop_column('contexts', 'purging')
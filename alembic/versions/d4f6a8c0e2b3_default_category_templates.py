@@ -0,0 +1,124 @@
+"""Shared default category templates
+
+Revision ID: d4f6a8c0e2b3
+Revises: c2e4a6b8d0f1
+Create Date: 2026-10-18 14:20:11.508317
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd4f6a8c0e2b3'
+down_revision: Union[str, Sequence[str], None] = 'c2e4a6b8d0f1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+DEFAULT_CATEGORIES = [
+    "аванс", "авто", "алкоголь", "аптека", "бензин", "больницы", "дом", "зарплата", "ипотека", "кафе",
+    "коммунальные", "красота", "кредит", "образование", "одежда", "питомцы", "подарки",
+    "продукты", "прочее", "путешествия", "развлечения", "сигареты", "спорт", "транспорт",
+    "участок", "хобби", "хозтовары", "электроника"
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.alter_column('categories', 'context_id', existing_type=sa.BigInteger(), nullable=True)
+
+    # Шаблонные категории: одна строка на название для всех чатов
+    categories = sa.table(
+        'categories',
+        sa.column('title', sa.String()),
+        sa.column('context_id', sa.Integer()),
+        sa.column('is_default', sa.Boolean()),
+        sa.column('is_deleted', sa.Boolean()),
+    )
+    op.bulk_insert(
+        categories,
+        [{'title': title, 'context_id': None, 'is_default': True, 'is_deleted': False} for title in DEFAULT_CATEGORIES],
+    )
+
+    # Живые копии стандартных категорий заменяются шаблоном, если в контексте
+    # нет других строк с тем же названием. Удаленные копии остаются как переопределения.
+    op.execute(
+        """
+        CREATE TEMPORARY TABLE category_templates ON COMMIT DROP AS
+        SELECT c.id, t.id AS template_id
+        FROM categories c
+        JOIN categories t ON t.context_id IS NULL AND t.title = c.title
+        WHERE c.context_id IS NOT NULL AND c.is_default AND NOT c.is_deleted
+          AND NOT EXISTS (
+              SELECT 1 FROM categories o
+              WHERE o.context_id = c.context_id AND o.id <> c.id AND lower(o.title) = lower(c.title)
+          )
+        """
+    )
+    for table in ('expenses', 'incomes'):
+        op.execute(
+            f"""
+            UPDATE {table} t SET category_id = m.template_id
+            FROM category_templates m WHERE t.category_id = m.id
+            """
+        )
+    op.execute(
+        """
+        UPDATE daily_totals t SET category_id = m.template_id
+        FROM category_templates m WHERE t.category_id = m.id
+        """
+    )
+    op.execute("DELETE FROM categories WHERE id IN (SELECT id FROM category_templates)")
+
+    # Индекс без условия по is_deleted: удаленные переопределения тоже должны находиться
+    op.drop_index('ix_categories_context_id_lower_title', table_name='categories')
+    op.create_index(
+        'ix_categories_context_id_lower_title',
+        'categories',
+        ['context_id', sa.text('lower(title)')],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_categories_context_id_lower_title', table_name='categories')
+    op.create_index(
+        'ix_categories_context_id_lower_title',
+        'categories',
+        ['context_id', sa.text('lower(title)')],
+        unique=False,
+        postgresql_where=sa.text('NOT is_deleted'),
+    )
+
+    # Каждому контексту возвращаются собственные копии шаблонных категорий
+    op.execute(
+        """
+        CREATE TEMPORARY TABLE category_templates ON COMMIT DROP AS
+        SELECT t.id AS template_id, x.id AS context_id, t.title
+        FROM categories t CROSS JOIN contexts x
+        WHERE t.context_id IS NULL
+          AND NOT EXISTS (
+              SELECT 1 FROM categories o
+              WHERE o.context_id = x.id AND lower(o.title) = lower(t.title)
+          )
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO categories (title, context_id, is_default, is_deleted)
+        SELECT title, context_id, true, false FROM category_templates
+        """
+    )
+    for table in ('expenses', 'incomes', 'daily_totals'):
+        op.execute(
+            f"""
+            UPDATE {table} t SET category_id = c.id
+            FROM categories tpl JOIN categories c ON c.title = tpl.title AND c.context_id IS NOT NULL
+            WHERE tpl.context_id IS NULL AND t.category_id = tpl.id AND c.context_id = t.context_id
+            """
+        )
+    op.execute("DELETE FROM categories WHERE context_id IS NULL")
+    op.alter_column('categories', 'context_id', existing_type=sa.BigInteger(), nullable=False)
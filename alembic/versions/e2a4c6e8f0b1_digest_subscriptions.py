@@ -0,0 +1,34 @@
+"""Add digest_subscriptions for scheduled digests
+
+Revision ID: e2a4c6e8f0b1
+Revises: d1f3a5c7e9b2
+Create Date: 2026-10-18 23:52:37.140286
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2a4c6e8f0b1'
+down_revision: Union[str, Sequence[str], None] = 'd1f3a5c7e9b2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('digest_subscriptions',
+    sa.Column('context_id', sa.Integer(), nullable=False),
+    sa.Column('period', sa.String(), nullable=False),
+    sa.Column('last_sent_on', sa.Date(), nullable=True),
+    sa.ForeignKeyConstraint(['context_id'], ['contexts.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('context_id', 'period')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('digest_subscriptions')
@@ -0,0 +1,51 @@
+"""Add budgets and budget_spending counters
+
+Revision ID: f3b5d7f9a1c2
+Revises: e2a4c6e8f0b1
+Create Date: 2026-10-19 00:38:52.617043
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3b5d7f9a1c2'
+down_revision: Union[str, Sequence[str], None] = 'e2a4c6e8f0b1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('budgets',
+    sa.Column('context_id', sa.Integer(), nullable=False),
+    sa.Column('category_id', sa.Integer(), nullable=False),
+    sa.Column('period', sa.String(), nullable=False),
+    sa.Column('amount', sa.Numeric(), nullable=False),
+    sa.ForeignKeyConstraint(['category_id'], ['categories.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['context_id'], ['contexts.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('context_id', 'category_id')
+    )
+    op.create_index('ix_budgets_category_id', 'budgets', ['category_id'], unique=False)
+    op.create_table('budget_spending',
+    sa.Column('context_id', sa.Integer(), nullable=False),
+    sa.Column('category_id', sa.Integer(), nullable=False),
+    sa.Column('period', sa.String(), nullable=False),
+    sa.Column('period_start', sa.Date(), nullable=False),
+    sa.Column('total', sa.Numeric(), nullable=False),
+    sa.ForeignKeyConstraint(['category_id'], ['categories.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['context_id'], ['contexts.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('context_id', 'category_id', 'period', 'period_start')
+    )
+    op.create_index('ix_budget_spending_category_id', 'budget_spending', ['category_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_budget_spending_category_id', table_name='budget_spending')
+    op.drop_table('budget_spending')
+    op.drop_index('ix_budgets_category_id', table_name='budgets')
+    op.drop_table('budgets')
@@ -0,0 +1,57 @@
+"""Add id to operations statistics index for keyset pagination
+
+Revision ID: f6b8d0a2c4e5
+Revises: e5a7c9b1d3f4
+Create Date: 2026-10-18 16:41:09.384512
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f6b8d0a2c4e5'
+down_revision: Union[str, Sequence[str], None] = 'e5a7c9b1d3f4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Новый индекс строится до удаления старого, чтобы статистика не оставалась без индекса
+    with op.get_context().autocommit_block():
+        for table in ('expenses', 'incomes'):
+            op.create_index(
+                f'ix_{table}_context_id_user_id_created_at_id',
+                table,
+                ['context_id', 'user_id', 'created_at', 'id'],
+                unique=False,
+                postgresql_include=['amount', 'category_id'],
+                postgresql_concurrently=True,
+            )
+            op.drop_index(
+                f'ix_{table}_context_id_user_id_created_at',
+                table_name=table,
+                postgresql_concurrently=True,
+            )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        for table in ('incomes', 'expenses'):
+            op.create_index(
+                f'ix_{table}_context_id_user_id_created_at',
+                table,
+                ['context_id', 'user_id', 'created_at'],
+                unique=False,
+                postgresql_include=['amount', 'category_id'],
+                postgresql_concurrently=True,
+            )
+            op.drop_index(
+                f'ix_{table}_context_id_user_id_created_at_id',
+                table_name=table,
+                postgresql_concurrently=True,
+            )
@@ -0,0 +1,42 @@
+"""
+Защита от запуска бенчмарков на рабочей базе: бенчмарки пересоздают все таблицы.
+"""
+from sqlalchemy import text
+
+# Пустая таблица-метка базы, созданной бенчмарком; Base.metadata.drop_all ее не удаляет
+SCRATCH_MARKER = "benchmark_scratch"
+FORCE_FLAG = "--i-know-this-drops-data"
+
+
+def add_force_argument(parser):
+    parser.add_argument(
+        FORCE_FLAG, dest="force", action="store_true",
+        help="Пересоздать таблицы, даже если база похожа на рабочую (все данные будут удалены)",
+    )
+
+
+async def ensure_scratch_database(conn, force: bool):
+    """
+    Отказывается работать с базой, похожей на рабочую: с таблицей alembic_version
+    (к ней применялись миграции) или с непустой operations. База, которую уже
+    пересоздавал бенчмарк, помечена таблицей benchmark_scratch и проверку проходит.
+    """
+    tables = set((await conn.execute(text(
+        "SELECT table_name FROM information_schema.tables WHERE table_schema = current_schema()"
+    ))).scalars())
+    if force or SCRATCH_MARKER in tables:
+        return
+    reasons = []
+    if "alembic_version" in tables:
+        reasons.append("к ней применялись миграции (есть таблица alembic_version)")
+    if "operations" in tables and (await conn.execute(text("SELECT EXISTS (SELECT 1 FROM operations)"))).scalar():
+        reasons.append("в таблице operations есть данные")
+    if reasons:
+        raise SystemExit(
+            f"База похожа на рабочую: {'; '.join(reasons)}. Бенчмарк удалит все таблицы. "
+            f"Укажите отдельную тестовую базу или запустите с {FORCE_FLAG}."
+        )
+
+
+async def mark_scratch_database(conn):
+    await conn.execute(text(f"CREATE TABLE IF NOT EXISTS {SCRATCH_MARKER} ()"))
@@ -9,6 +9,83 @@ class Settings(BaseSettings):
     database_url: str
     lang: str = "ru"
 
+    # Пул соединений с базой (на процесс)
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+
+    # Количество процессов-воркеров для supervisor.py (0 — по числу ядер)
+    shard_workers: int = 0
+    shard_queue_size: int = 1000
+
+    # Кэш пользователей, контекстов и категорий для горячего пути записи операций
+    resolver_cache_size: int = 10000
+    resolver_cache_ttl: int = 600
+
+    # Пакетная запись расходов/доходов
+    ingest_batch_size: int = 100
+    ingest_max_latency_ms: int = 5
+    ingest_queue_size: int = 1000
+
+    # Webhook вместо long polling: включается, если задан webhook_base_url
+    webhook_base_url: str | None = None   # Публичный адрес, например https://bot.example.com
+    webhook_path: str = "/webhook"
+    webhook_secret: str | None = None     # Проверяется в заголовке X-Telegram-Bot-Api-Secret-Token
+    webhook_host: str = "0.0.0.0"
+    webhook_port: int = 8080
+
+    # Выгрузка /export: строк за один проход курсора и размер временного файла в памяти
+    export_chunk_size: int = 1000
+    export_spool_size: int = 1024 * 1024
+
+    # Импорт выписок /import: максимум строк в одном файле
+    import_max_rows: int = 200_000
+
+    # Диаграммы /statchart: процессы отрисовки, максимум задач в очереди и кэш готовых PNG
+    chart_workers: int = 2
+    chart_max_pending: int = 8
+    chart_cache_size: int = 1000
+    chart_cache_ttl: int = 3600
+
+    # Кэш результатов /statcat (сбрасывается при изменении данных)
+    statcat_cache_size: int = 10000
+    statcat_cache_ttl: int = 3600
+
+    # Ограничения исходящих сообщений Telegram: всего в секунду, в группу и в личный чат
+    # в секунду, запас корзины чата и число повторов после TelegramRetryAfter
+    api_global_rate: float = 30
+    api_group_rate: float = 20 / 60
+    api_private_rate: float = 1
+    api_chat_burst: int = 3
+    api_max_retries: int = 5
+
+    # Максимум операций (строк) в одном сообщении
+    batch_max_lines: int = 50
+
+    # Сводки подтверждений (/compact): сколько секунд дописывать в одно сообщение,
+    # как часто его править и сколько операций в нем помещается
+    confirmation_window: float = 60
+    confirmation_flush_delay: float = 3
+    confirmation_max_entries: int = 20
+
+    # Секции operations (python manage.py partitions maintain): на сколько месяцев вперед
+    # создавать секции и сколько месяцев хранить (None — хранить все)
+    partition_months_ahead: int = 3
+    partition_retention_months: int | None = None
+
+    # Очистка контекста (/clearcontext): строк в одной транзакции и как часто обновлять сообщение о ходе
+    purge_batch_size: int = 5000
+    purge_progress_interval: float = 5
+
+    # Сводки по расписанию (/digest): с какого часа рассылать, как часто проверять,
+    # сколько чатов забирать одним запросом и сколько сообщений отправлять одновременно
+    digest_hour: int = 9
+    digest_check_interval: float = 60
+    digest_batch_size: int = 1000
+    digest_concurrency: int = 50
+
+    # Telegram id пользователей, которым доступна служебная команда /cachestats
+    admin_ids: list[int] = []
+
     model_config = ConfigDict(env_file=".env", extra="ignore")
 
 settings = Settings()
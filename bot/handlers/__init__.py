@@ -1,6 +1,8 @@
 from .base_commands import router as base_commands_router
 from .categories import router as categories_router
+from .export import router as export_router
 from .finance import router as finance_router
+from .importer import router as importer_router
 from .menu import router as menu_router
 from .statistics import router as stat_router
 
@@ -9,5 +11,7 @@ all_handlers = [
     menu_router,
     categories_router,
     stat_router,
+    export_router,
+    importer_router,
     finance_router,
 ]
\ No newline at end of file
@@ -1,25 +1,28 @@
 from aiogram import Router
 from aiogram.filters import Command
 from aiogram.types import Message
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from bot.config import settings
 from bot.handlers.categories import get_context
 from bot.keyboards.menu import menu_inline_keyboard, submenu_inline_keyboard
-from bot.services.db import AsyncSessionLocal
+from bot.middlewares import outgoing_limiter
+from bot.services.charts import chart_cache
+from bot.services.stats import statcat_cache
 from bot.services.utils import get_or_create_user, get_user_display
 from bot.utils.logger import logger
 
 router = Router()
 
 @router.message(Command("start"))
-async def start_handler(message: Message):
+async def start_handler(message: Message, session: AsyncSession):
     """
     Обрабатывает команду /start.
     Регистрирует пользователя в базе данных и отправляет приветственное сообщение.
     """
     logger.info(f"/start от пользователя {message.from_user.id} в чате {message.chat.id}")
-    async with AsyncSessionLocal() as session:
-        await get_or_create_user(session, message.from_user)
-        await get_context(session, message.chat)
+    await get_or_create_user(session, message.from_user)
+    await get_context(session, message.chat)
 
     user_display = get_user_display(message.from_user)
 
@@ -58,11 +61,19 @@ async def commands_handler(message: Message):
         "\n"
         "<code>сумма категория</code> — добавить расход, например: <b>1000 кафе</b>\n"
         "\n"
+        "Несколько операций можно записать одним сообщением — по одной на строке\n"
+        "\n"
         "/menu — вызвать меню\n"
         "\n"
         "/statcat day | week | month | ДД.ММ.ГГГГ | ДД.ММ.ГГГГ - ДД.ММ.ГГГГ — показать статистику доходов/расходов по категориям за день, неделю, месяц, дату, период\n"
         "\n"
-        "/statdetail day — показать детализацию доходов/расходов с начала дня\n"
+        "/statdetail day | week | month | ДД.ММ.ГГГГ | ДД.ММ.ГГГГ - ДД.ММ.ГГГГ — показать детализацию доходов/расходов за период постранично\n"
+        "\n"
+        "/statchart day | week | month | ДД.ММ.ГГГГ | ДД.ММ.ГГГГ - ДД.ММ.ГГГГ — диаграммы расходов по категориям\n"
+        "\n"
+        "/export [период] [csv | xlsx] — выгрузить операции в файл (без периода — за все время)\n"
+        "\n"
+        "/import — загрузить операции из CSV-выписки (файл с подписью /import)\n"
         "\n"
         "/categories — Показать список доступных категорий\n"
         "\n"
@@ -72,6 +83,12 @@ async def commands_handler(message: Message):
         "\n"
         "/clearcontext — удалить все категории и историю доходов/расходов <b>(только для админов в группе)</b>\n"
         "\n"
+        "/compact on | off — собирать подтверждения операций в одно сообщение <b>(в группе — только для админов)</b>\n"
+        "\n"
+        "/budget категория сумма [month | week] — лимит расходов категории на месяц или неделю, без аргументов — список бюджетов <b>(в группе менять — только админам)</b>\n"
+        "\n"
+        "/digest day | week | off — присылать сводку по категориям за вчера или за прошлую неделю <b>(в группе — только для админов)</b>\n"
+        "\n"
         "/commands — показать это сообщение\n"
         "\n"
         "/help — помощь\n"
@@ -89,4 +106,24 @@ async def help_handler(message: Message):
         "\n"
         "| <a href='https://github.com/bazzzdev/budget_bot'>GitHub</a> |"
     )
-    await message.answer(text, reply_markup=menu_inline_keyboard())
\ No newline at end of file
+    await message.answer(text, reply_markup=menu_inline_keyboard())
+
+@router.message(Command("cachestats"))
+async def cachestats_handler(message: Message):
+    """
+    Служебная команда /cachestats: попадания и промахи кэшей статистики в этом процессе
+    и число исходящих сообщений, ожидающих отправки.
+    Доступна только пользователям из settings.admin_ids.
+    """
+    if message.from_user.id not in settings.admin_ids:
+        return
+
+    lines = []
+    for name, cache in (("/statcat", statcat_cache), ("/statchart", chart_cache)):
+        stats = cache.stats()
+        lines.append(
+            f"{name}: попаданий {stats['hits']}, промахов {stats['misses']}, "
+            f"доля попаданий {stats['hit_rate']:.0%}, записей {stats['size']}"
+        )
+    lines.append(f"Исходящих сообщений в очереди: {outgoing_limiter.queue_depth}")
+    await message.answer("\n".join(lines))
@@ -1,19 +1,43 @@
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
 from aiogram import Router, types
 from aiogram.enums import ChatType
-from aiogram.filters import Command
-from sqlalchemy import text
+from aiogram.filters import Command, CommandObject
+from sqlalchemy import Date, delete, func, literal
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from sqlalchemy.orm import aliased
 
 from bot.keyboards.menu import menu_inline_keyboard
-from bot.models.models import Context, Category
-from bot.services.db import get_async_session
-from bot.services.utils import get_context, is_admin
+from bot.models.models import Budget, BudgetSpending, Context, Category, DailyTotal
+from bot.services.budgets import (
+    BUDGET_PERIODS,
+    MOSCOW_TZ,
+    PERIOD_TEXT,
+    budget_tracker,
+    next_period_start,
+    period_start,
+)
+from bot.services.cache import resolver_cache, stats_generations
+from bot.services.db import after_commit
+from bot.services.purge import PURGE_REJECTED, context_purger, purge_progress
+from bot.services.utils import (
+    find_category,
+    get_context,
+    is_admin,
+    override_default_category,
+    resolve_category,
+    resolve_context,
+    visible_categories,
+)
 from bot.utils.logger import logger
 
 router = Router()
 
 @router.message(Command("add"))
-async def add_category_handler(message: types.Message):
+async def add_category_handler(message: types.Message, session: AsyncSession):
     """
     Добавляет новую категорию в текущий групповой чат.
     Доступно только администраторам групп.
@@ -38,33 +62,28 @@ async def add_category_handler(message: types.Message):
         await message.reply("Укажите название категории, например:\n/add кафе", reply_markup=menu_inline_keyboard())
         return
 
-    async with get_async_session() as session:
-        context = await get_context(session, message.chat)
-        # Проверка на существование категории
-        result = await session.execute(
-            select(Category).where(
-                Category.context_id == context.id,
-                Category.title.ilike(args),
-            )
-        )
-        existing = result.scalars().first()
-        if existing:
-            if existing.is_deleted:
-                existing.is_deleted = False
-                await session.commit()
-                await message.reply(f"Категория '{args}' восстановлена!", reply_markup=menu_inline_keyboard())
-            else:
-                await message.reply(f"Категория '{args}' уже существует.", reply_markup=menu_inline_keyboard())
-            return
+    context = await get_context(session, message.chat)
+    # Проверка на существование категории (в том числе шаблонной)
+    existing = await find_category(session, args, context)
+    if existing:
+        if existing.is_deleted:
+            existing.is_deleted = False
+            after_commit(session, lambda: resolver_cache.invalidate_categories(context.id))
+            # Статистика считается только по неудаленным категориям
+            after_commit(session, lambda: stats_generations.bump(context.id))
+            await message.reply(f"Категория '{args}' восстановлена!", reply_markup=menu_inline_keyboard())
+        else:
+            await message.reply(f"Категория '{args}' уже существует.", reply_markup=menu_inline_keyboard())
+        return
 
-        # Создание новой категории
-        category = Category(title=args, context_id=context.id, is_default=False, is_deleted=False)
-        session.add(category)
-        await session.commit()
-        await message.reply(f"Категория '{args}' успешно добавлена!", reply_markup=menu_inline_keyboard())
+    # Создание новой категории
+    category = Category(title=args, context_id=context.id, is_default=False, is_deleted=False)
+    session.add(category)
+    after_commit(session, lambda: resolver_cache.invalidate_categories(context.id))
+    await message.reply(f"Категория '{args}' успешно добавлена!", reply_markup=menu_inline_keyboard())
 
 @router.message(Command("del"))
-async def delete_category_handler(message: types.Message):
+async def delete_category_handler(message: types.Message, session: AsyncSession):
     """
     Логически удаляет категорию в текущем групповом чате.
     Доступно только администраторам групп.
@@ -89,60 +108,56 @@ async def delete_category_handler(message: types.Message):
         await message.reply("Укажите название категории, например:\n/del кафе", reply_markup=menu_inline_keyboard())
         return
 
-    async with get_async_session() as session:
-        context = await get_context(session, message.chat)
-        # Поиск категории
-        result = await session.execute(
-            select(Category).where(
-                Category.context_id == context.id,
-                Category.title.ilike(args),
-                Category.is_deleted == False,
-            )
-        )
-        category = result.scalars().first()
-        if not category:
-            await message.reply(f"Категория '{args}' не найдена.", reply_markup=menu_inline_keyboard())
-            return
+    context = await get_context(session, message.chat)
+    # Поиск категории
+    category = await find_category(session, args, context)
+    if not category or category.is_deleted:
+        await message.reply(f"Категория '{args}' не найдена.", reply_markup=menu_inline_keyboard())
+        return
+
+    if category.context_id is None:
+        # Шаблонная категория общая для всех чатов — удаляем ее копию в этом контексте
+        category = await override_default_category(session, category, context.id)
 
-        # Логическое удаление категории
-        category.is_deleted = True
-        await session.commit()
-        await message.reply(f"Категория '{args}' успешно удалена.", reply_markup=menu_inline_keyboard())
+    # Логическое удаление категории
+    category.is_deleted = True
+    after_commit(session, lambda: resolver_cache.invalidate_categories(context.id))
+    # Статистика считается только по неудаленным категориям
+    after_commit(session, lambda: stats_generations.bump(context.id))
+    await message.reply(f"Категория '{args}' успешно удалена.", reply_markup=menu_inline_keyboard())
 
 @router.message(Command("categories"))
-async def list_categories_handler(message: types.Message):
+async def list_categories_handler(message: types.Message, session: AsyncSession):
     """
     Показывает список всех доступных категорий для текущего чата.
     """
-    async with get_async_session() as session:
-        context = await get_context(session, message.chat)
-        # Получение списка категорий
-        result = await session.execute(
-            select(Category.title)
-            .where(
-                Category.context_id == context.id,
-                Category.is_deleted == False
-            )
-            .order_by(Category.title)
-        )
-        categories = result.scalars().all()
+    context = await get_context(session, message.chat)
+    # Получение списка категорий: шаблонные, перекрытые собственными категориями чата
+    categories = visible_categories(context.id)
+    result = await session.execute(
+        select(categories.c.title)
+        .where(categories.c.is_deleted == False)
+        .order_by(categories.c.title)
+    )
+    categories = result.scalars().all()
 
-        if not categories:
-            await message.reply("В этом чате нет доступных категорий.", reply_markup=menu_inline_keyboard())
-            return
+    if not categories:
+        await message.reply("В этом чате нет доступных категорий.", reply_markup=menu_inline_keyboard())
+        return
 
-        text = (
-            "Доступные категории:\n"
-            "- - - - - - - - - -\n"
-            + "\n".join(f"• {cat}" for cat in categories)
-            + "\n- - - - - - - - - -\n"
-        )
-        await message.reply(text, reply_markup=menu_inline_keyboard())
+    text = (
+        "Доступные категории:\n"
+        "- - - - - - - - - -\n"
+        + "\n".join(f"• {cat}" for cat in categories)
+        + "\n- - - - - - - - - -\n"
+    )
+    await message.reply(text, reply_markup=menu_inline_keyboard())
 
 @router.message(Command("clearcontext"))
-async def clear_context_handler(message: types.Message):
+async def clear_context_handler(message: types.Message, session: AsyncSession):
     """
     Полностью очищает контекст чата: удаляет все категории, расходы, доходы и сам контекст.
+    Удаление идет в фоне (ContextPurger), ход очистки показывается в ответном сообщении.
     Доступно только администраторам групп.
     """
     # Проверка типа чата
@@ -156,35 +171,196 @@ async def clear_context_handler(message: types.Message):
         await message.reply("Очищать контекст могут только администраторы.", reply_markup=menu_inline_keyboard())
         return
 
-    async with get_async_session() as session:
-        # Поиск контекста чата
-        result = await session.execute(
-            select(Context).where(
-                Context.context_id == message.chat.id,
-                Context.context_type == message.chat.type
-            )
+    # Поиск контекста чата
+    result = await session.execute(
+        select(Context).where(
+            Context.context_id == message.chat.id,
+            Context.context_type == message.chat.type
+        )
+    )
+    context = result.scalars().first()
+    if not context:
+        await message.reply("Контекст для этого чата не найден.", reply_markup=menu_inline_keyboard())
+        return
+
+    if context_purger.is_running(context.id):
+        await message.reply("Контекст уже очищается.", reply_markup=menu_inline_keyboard())
+        return
+
+    # Пометка сразу закрывает контекст для новых операций; сами строки удаляются в фоне порциями
+    context.purging = True
+    await session.commit()
+    resolver_cache.invalidate_context(message.chat.id, message.chat.type)
+    progress = await message.reply(purge_progress(0))
+    context_purger.start(message.bot, context.id, message.chat.id, message.chat.type, progress.message_id)
+
+@router.message(Command("compact"))
+async def compact_confirmations_handler(message: types.Message, command: CommandObject, session: AsyncSession):
+    """
+    Включает или выключает сводки подтверждений: операции, добавленные за короткое время,
+    собираются в одно сообщение с кнопками удаления вместо отдельного сообщения на каждую.
+    В группах доступно только администраторам.
+    """
+    mode = (command.args or "").strip().lower()
+    if mode not in ("on", "off"):
+        await message.reply(
+            "Используйте /compact on, чтобы собирать подтверждения операций в одно сообщение, "
+            "или /compact off, чтобы отвечать на каждую операцию отдельно.",
+            reply_markup=menu_inline_keyboard()
         )
-        context = result.scalars().first()
-        if not context:
-            await message.reply("Контекст для этого чата не найден.", reply_markup=menu_inline_keyboard())
+        return
+
+    if message.chat.type in [ChatType.GROUP, ChatType.SUPERGROUP] and not await is_admin(message):
+        await message.reply("Менять этот режим могут только администраторы.", reply_markup=menu_inline_keyboard())
+        return
+
+    context = await get_context(session, message.chat)
+    context.compact_confirmations = mode == "on"
+    # Настройка хранится в кэше контекстов вместе с его id
+    after_commit(session, lambda: resolver_cache.invalidate_context(message.chat.id, message.chat.type))
+    await message.reply(
+        "Подтверждения операций будут собираться в одно сообщение."
+        if mode == "on" else "На каждую операцию будет отдельное подтверждение.",
+        reply_markup=menu_inline_keyboard()
+    )
+
+BUDGET_USAGE = (
+    "Используйте /budget категория сумма [month | week], чтобы задать лимит расходов категории "
+    "на месяц (по умолчанию) или неделю, например: /budget кафе 10000\n"
+    "/budget категория 0 — снять лимит, /budget — показать бюджеты."
+)
+
+@router.message(Command("budget"))
+async def budget_handler(message: types.Message, command: CommandObject, session: AsyncSession):
+    """
+    Задает лимит расходов категории на месяц или неделю, снимает его (сумма 0)
+    или показывает бюджеты чата с расходами за текущий период (без аргументов).
+    Расходы за уже начавшийся период считаются один раз, при установке лимита;
+    дальше счетчик обновляется при каждой записи операции.
+    Операции, записанные параллельно с установкой, не теряются: бюджет сразу регистрируется
+    в памяти (записи начинают прибавлять к счетчику), а счетчик считается одним запросом —
+    к сумме из дневного агрегата добавляется то, что записи успели прибавить к строке
+    счетчика после начала запроса.
+    В группах менять бюджеты могут только администраторы.
+    """
+    context = await resolve_context(session, message.chat)
+    today = datetime.now(MOSCOW_TZ).date()
+    args = (command.args or "").split()
+
+    if not args:
+        budgets = budget_tracker.budgets(context.id)
+        if not budgets:
+            await message.reply(f"Бюджеты не заданы.\n\n{BUDGET_USAGE}", reply_markup=menu_inline_keyboard())
             return
+        titles = dict((await session.execute(
+            select(Category.id, Category.title).where(Category.id.in_(list(budgets)))
+        )).all())
+        lines = [
+            f"{titles.get(category_id, '—')}: {int(budget_tracker.spent(context.id, category_id, today))} "
+            f"из {int(limit)} {PERIOD_TEXT[period]}"
+            for category_id, (period, limit) in budgets.items()
+        ]
+        await message.reply("Бюджеты:\n" + "\n".join(lines), reply_markup=menu_inline_keyboard())
+        return
+
+    period = "month"
+    if args[-1].lower() in BUDGET_PERIODS:
+        period = args.pop().lower()
+    try:
+        amount = Decimal(args[-1].replace(",", "."))
+    except InvalidOperation:
+        amount = None
+    if len(args) < 2 or amount is None or not amount.is_finite() or amount < 0:
+        await message.reply(BUDGET_USAGE, reply_markup=menu_inline_keyboard())
+        return
+
+    if message.chat.type in [ChatType.GROUP, ChatType.SUPERGROUP] and not await is_admin(message):
+        await message.reply("Менять бюджеты могут только администраторы.", reply_markup=menu_inline_keyboard())
+        return
 
-        # Удаление расходов, доходов, категорий и самого контекста
+    if context.purging:
+        await message.reply(PURGE_REJECTED)
+        return
+
+    title = " ".join(args[:-1])
+    category = await resolve_category(session, title, context)
+    if not category:
+        await message.reply(f"Категория '{title}' не найдена.", reply_markup=menu_inline_keyboard())
+        return
+
+    if amount == 0:
         await session.execute(
-            text(
-                "DELETE FROM expenses WHERE category_id IN (SELECT id FROM categories WHERE context_id = :context_id)"
-            ),
-            {"context_id": context.id}
+            delete(Budget).where(Budget.context_id == context.id, Budget.category_id == category.id)
         )
-        await session.execute(
-            text(
-                "DELETE FROM incomes WHERE category_id IN (SELECT id FROM categories WHERE context_id = :context_id)"
+        after_commit(session, lambda: budget_tracker.remove_budget(context.id, category.id))
+        await message.reply(f"Бюджет «{category.title}» снят.", reply_markup=menu_inline_keyboard())
+        return
+
+    start = period_start(period, today)
+    current = budget_tracker.budget(context.id, category.id)
+    current_spent = budget_tracker.spent(context.id, category.id, today)
+    # Записи операций с этого момента прибавляют расходы категории к счетчику нового периода
+    budget_tracker.set_budget(
+        context.id, category.id, period, amount, start,
+        current_spent if current and current[0] == period else Decimal(0),
+    )
+    try:
+        budget = insert(Budget).values(context_id=context.id, category_id=category.id, period=period, amount=amount)
+        await session.execute(budget.on_conflict_do_update(
+            index_elements=[Budget.context_id, Budget.category_id],
+            set_={"period": budget.excluded.period, "amount": budget.excluded.amount},
+        ))
+        # Начальное значение счетчика — расходы уже начавшегося периода из дневного агрегата.
+        # Если параллельная запись уже держит строку счетчика, после ее коммита к сумме
+        # прибавляется ее добавка: текущее значение строки минус видимое в начале запроса
+        snapshot = aliased(BudgetSpending)
+        counter = insert(BudgetSpending).from_select(
+            ["context_id", "category_id", "period", "period_start", "total"],
+            select(
+                literal(context.id), literal(category.id), literal(period), literal(start, Date),
+                func.coalesce(func.sum(DailyTotal.total), 0),
+            ).where(
+                DailyTotal.context_id == context.id,
+                DailyTotal.category_id == category.id,
+                DailyTotal.kind == "expense",
+                # Операции с датами позже текущего периода (импорт) в его счетчик не входят
+                DailyTotal.day >= start,
+                DailyTotal.day < next_period_start(period, start),
             ),
-            {"context_id": context.id}
         )
-        await session.execute(
-            Category.__table__.delete().where(Category.context_id == context.id)
+        seen = (
+            select(snapshot.total)
+            .where(
+                snapshot.context_id == context.id,
+                snapshot.category_id == category.id,
+                snapshot.period == period,
+                snapshot.period_start == start,
+            )
+            .scalar_subquery()
         )
-        await session.delete(context)
-        await session.commit()
-        await message.reply("Контекст, категории, расходы и доходы успешно удалены.", reply_markup=menu_inline_keyboard())
\ No newline at end of file
+        spent = (await session.execute(
+            counter.on_conflict_do_update(
+                index_elements=[
+                    BudgetSpending.context_id,
+                    BudgetSpending.category_id,
+                    BudgetSpending.period,
+                    BudgetSpending.period_start,
+                ],
+                set_={"total": counter.excluded.total + BudgetSpending.total - func.coalesce(seen, 0)},
+            ).returning(BudgetSpending.total)
+        )).scalar()
+    except Exception:
+        # Прежний бюджет в памяти, если установка не удалась
+        if current:
+            budget_tracker.set_budget(
+                context.id, category.id, *current, period_start(current[0], today), current_spent
+            )
+        else:
+            budget_tracker.remove_budget(context.id, category.id)
+        raise
+    # Расходы, записанные после запроса, прибавятся к сумме в памяти после своего коммита
+    after_commit(session, lambda: budget_tracker.set_budget(context.id, category.id, period, amount, start, spent))
+    await message.reply(
+        f"Бюджет «{category.title}» {PERIOD_TEXT[period]}: {int(amount)}. Уже потрачено: {int(spent)}.",
+        reply_markup=menu_inline_keyboard()
+    )
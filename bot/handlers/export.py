@@ -0,0 +1,66 @@
+from datetime import datetime
+
+from aiogram import Router
+from aiogram.filters import Command, CommandObject
+from aiogram.types import Message
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from bot.keyboards.menu import menu_inline_keyboard
+from bot.services.export import SpooledInputFile, export_formats, export_operations
+from bot.services.utils import parse_date_arg, resolve_context, resolve_existing_user
+
+router = Router()
+
+
+@router.message(Command("export"))
+async def export_handler(message: Message, command: CommandObject, session: AsyncSession):
+    """
+    Обрабатывает команду /export [период] [csv|xlsx].
+    Отправляет файл с операциями пользователя в этом чате за период (без периода — за все время).
+    """
+    args = (command.args or "").strip()
+    fmt = "csv"
+    last = args.rsplit(maxsplit=1)[-1].lower() if args else ""
+    if last in ("csv", "xlsx"):
+        fmt = last
+        args = args[: -len(last)].strip()
+
+    if fmt not in export_formats():
+        await message.answer("Выгрузка в XLSX сейчас недоступна, используйте CSV.")
+        return
+
+    date_from = date_to = None
+    period_text = "за все время"
+    if args:
+        parsed = parse_date_arg(args)
+        if not parsed:
+            await message.answer(
+                "Для выгрузки операций используйте следующие форматы:\n\n"
+                "• /export - за все время\n"
+                "• /export month - за текущий месяц (также day, week)\n"
+                "• /export dd.mm.yyyy - dd.mm.yyyy - за период\n"
+                "• /export month xlsx - в формате Excel"
+            )
+            return
+        date_from, date_to, period_text = parsed
+
+    context = await resolve_context(session, message.chat)
+    user = await resolve_existing_user(session, message.from_user.id)
+    if not user:
+        await message.answer("Пользователь не найден.")
+        return
+
+    file, count = await export_operations(session, fmt, context.id, user.id, date_from, date_to)
+    # Строки уже во временном файле: транзакция завершается и соединение возвращается в пул
+    # до отправки файла, которая может занять много времени
+    await session.commit()
+    with file:
+        if not count:
+            await message.answer(f"Нет операций {period_text}.", reply_markup=menu_inline_keyboard())
+            return
+        filename = f"operations_{datetime.now().strftime('%Y%m%d_%H%M')}.{fmt}"
+        await message.answer_document(
+            SpooledInputFile(file, filename),
+            caption=f"Операции {period_text}: {count}",
+            reply_markup=menu_inline_keyboard(),
+        )
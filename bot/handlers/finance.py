@@ -1,19 +1,41 @@
+import html
 import re
 from datetime import datetime, timezone, timedelta
 from decimal import Decimal, InvalidOperation
 
 from aiogram import Router, types, F
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
-from bot.models.models import User, Expense, Income
-from bot.services.db import get_async_session
-from bot.services.utils import get_or_create_user, get_or_create_context, get_category
+from bot.config import settings
+from bot.models.models import Category, Operation, User
+from bot.services.budgets import add_budget_spending, apply_budget_spending, check_budget
+from bot.services.cache import normalize_title, stats_generations
+from bot.services.confirmations import SUMMARY_HEADER, SummaryEntry, confirmation_summaries
+from bot.services.db import after_commit
+from bot.services.ingest import PendingRecord, delete_operations_at, insert_batcher, insert_operations
+from bot.services.purge import PURGE_REJECTED
+from bot.services.rollup import add_daily_total
+from bot.services.utils import (
+    get_categories_by_titles,
+    get_user_display,
+    resolve_category,
+    resolve_context,
+    resolve_existing_user,
+    resolve_user,
+    suggest_category,
+)
 
 router = Router()
 
+# Строка с операцией: `1000 категория` (расход) или `+5000 категория` (доход)
+OPERATION_LINE = re.compile(r"^(\+?)\s*(\d+(?:[.,]\d+)?)\s+(.+)$")
+# Точка отсчета для времени пакета операций в callback_data
+EPOCH = datetime(1970, 1, 1)
+
 @router.message(F.text)
-async def handle_expense_income(message: types.Message):
+async def handle_expense_income(message: types.Message, session: AsyncSession):
     """
     Обрабатывает сообщения с расходами и доходами.
     Формат: `1000 категория` (расход) или `+5000 категория` (доход).
@@ -24,94 +46,254 @@ async def handle_expense_income(message: types.Message):
         # Игнорируем команды
         return
 
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if len(lines) > 1:
+        # Несколько операций в одном сообщении, по одной на строке
+        if OPERATION_LINE.match(lines[0]):
+            await handle_batch(message, lines, session)
+        return
+
     # Проверяем формат сообщения: сумма категория или +сумма категория
     if not re.match(r"^\+?\d+([.,]\d+)?\s+\S+", text):
         return  # Не обрабатываем неподходящие сообщения
 
-    async with get_async_session() as session:
-        user_tg = message.from_user
-        chat = message.chat
-
-        # Определяем тип операции (доход или расход)
-        if text.startswith("+"):
-            operation_type = "income"
-            text = text[1:].strip()
-        else:
-            operation_type = "expense"
-
-        try:
-            parts = text.split(maxsplit=1)
-            if len(parts) != 2:
-                await message.reply(
-                    "Неверный формат сообщения. Используйте:\n\n"
-                    "Для расхода: `1000 категория`\n"
-                    "Для дохода: `+5000 категория`",
-                    parse_mode="Markdown"
-                )
-                return
-
-            amount_str, category_title = parts
-            amount = Decimal(amount_str.replace(",", "."))
-            if amount <= 0:
-                await message.reply("Сумма должна быть положительным числом.")
-                return
-        except (InvalidOperation, ValueError):
+    user_tg = message.from_user
+    chat = message.chat
+
+    # Определяем тип операции (доход или расход)
+    if text.startswith("+"):
+        operation_type = "income"
+        text = text[1:].strip()
+    else:
+        operation_type = "expense"
+
+    try:
+        parts = text.split(maxsplit=1)
+        if len(parts) != 2:
             await message.reply(
-                "Неверная сумма. Введите число, например: `1000 бензин` или `+50000 зарплата`.\n\n"
-                "Список доступных категорий: `/categories`",
+                "Неверный формат сообщения. Используйте:\n\n"
+                "Для расхода: `1000 категория`\n"
+                "Для дохода: `+5000 категория`",
                 parse_mode="Markdown"
             )
             return
 
-        # Получаем пользователя, контекст и категорию
-        user = await get_or_create_user(session, user_tg)
-        context = await get_or_create_context(session, chat)
-        category = await get_category(session, category_title, context)
-        if not category:
+        amount_str, category_title = parts
+        amount = Decimal(amount_str.replace(",", "."))
+        if amount <= 0:
+            await message.reply("Сумма должна быть положительным числом.")
+            return
+    except (InvalidOperation, ValueError):
+        await message.reply(
+            "Неверная сумма. Введите число, например: `1000 бензин` или `+50000 зарплата`.\n\n"
+            "Список доступных категорий: `/categories`",
+            parse_mode="Markdown"
+        )
+        return
+
+    # Получаем пользователя, контекст и категорию (из кэша, если они уже известны)
+    user = await resolve_user(session, user_tg)
+    context = await resolve_context(session, chat)
+    if context.purging:
+        await message.reply(PURGE_REJECTED)
+        return
+    category = await resolve_category(session, category_title, context)
+    if not category:
+        # Опечатка в названии: предлагаем ближайшую категорию кнопкой
+        suggestion = await suggest_category(session, category_title, context)
+        callback_data = suggestion and f"suggest_{operation_type}:{suggestion.id}:{amount}"
+        # callback_data в Telegram ограничена 64 байтами
+        if suggestion and len(callback_data.encode()) <= 64:
+            keyboard = InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(text=f"Записать в «{suggestion.title}»", callback_data=callback_data)]
+            ])
             await message.reply(
                 f"Категория '{category_title}' не найдена в этом чате. "
-                "Используйте /categories чтобы посмотреть доступные категории."
+                f"Возможно, вы имели в виду «{suggestion.title}»?",
+                reply_markup=keyboard
             )
             return
+        await message.reply(
+            f"Категория '{category_title}' не найдена в этом чате. "
+            "Используйте /categories чтобы посмотреть доступные категории."
+        )
+        return
 
-        moscow_tz = timezone(timedelta(hours=3))
-        now = datetime.now(moscow_tz).replace(tzinfo=None)
-        # Создаем запись о расходе или доходе
-        if operation_type == "expense":
-            record = Expense(
-                user_id=user.id, context_id=context.id, category_id=category.id,
-                amount=amount, created_at=now
-            )
-        else:
-            record = Income(
-                user_id=user.id, context_id=context.id, category_id=category.id,
-                amount=amount, created_at=now
+    if context.compact_confirmations:
+        # Подтверждение попадает в общую сводку чата
+        record_id, now, warning = await record_operation(session, operation_type, user, context, category, amount)
+        await confirmation_summaries.add(message.bot, chat.id, context.id, SummaryEntry(
+            operation_type, record_id, amount, category.title, get_user_display(user_tg), now
+        ))
+    else:
+        text, keyboard, warning = await add_operation(session, operation_type, user, context, category, amount, user_tg)
+        await message.answer(text, reply_markup=keyboard)
+    if warning:
+        await message.reply(warning)
+
+async def handle_batch(message: types.Message, lines: list[str], session: AsyncSession):
+    """
+    Записывает операции из всех строк сообщения в одной транзакции: категории находятся
+    одним запросом, операции пишутся многострочными INSERT. Отвечает одним сообщением
+    с результатом по каждой строке и кнопкой отмены всех записанных операций.
+    """
+    if len(lines) > settings.batch_max_lines:
+        await message.reply(f"В одном сообщении можно записать не больше {settings.batch_max_lines} операций.")
+        return
+
+    # Строки разбираются целиком до обращения к базе: (тип, сумма, категория) или ошибка
+    parsed = []
+    for line in lines:
+        match = OPERATION_LINE.match(line)
+        if not match:
+            parsed.append((line, None, None, "не распознана"))
+            continue
+        sign, amount_str, title = match.groups()
+        amount = Decimal(amount_str.replace(",", "."))
+        if amount <= 0:
+            parsed.append((line, None, None, "сумма должна быть положительной"))
+            continue
+        parsed.append((line, "income" if sign else "expense", amount, title.strip()))
+
+    user = await resolve_user(session, message.from_user)
+    context = await resolve_context(session, message.chat)
+    if context.purging:
+        await message.reply(PURGE_REJECTED)
+        return
+    categories = await get_categories_by_titles(
+        session, {title for _, kind, _, title in parsed if kind}, context
+    )
+
+    moscow_tz = timezone(timedelta(hours=3))
+    # Общее время создания связывает операции сообщения для отмены одной кнопкой
+    now = datetime.now(moscow_tz).replace(tzinfo=None)
+    records = []
+    results = []
+    expenses = []
+    for number, (line, kind, amount, title) in enumerate(parsed, 1):
+        if not kind:
+            results.append(f"{number}. ✖ {html.escape(line)} — {title}")
+            continue
+        category = categories.get(normalize_title(title))
+        if not category:
+            results.append(f"{number}. ✖ {html.escape(line)} — категория не найдена")
+            continue
+        records.append(PendingRecord(kind, user.id, context.id, category.id, amount, now))
+        results.append(
+            f"{number}. {'Расход' if kind == 'expense' else 'Доход'} {amount} — {html.escape(category.title)}"
+        )
+        if kind == "expense":
+            expenses.append((category, amount))
+
+    keyboard = None
+    warnings = []
+    if records:
+        await insert_operations(session, records)
+        # О записи сообщаем только после коммита
+        await session.commit()
+        stats_generations.bump(context.id, user.id)
+        for category, amount in expenses:
+            warning = check_budget(context.id, category.id, html.escape(category.title), now.date(), amount)
+            if warning:
+                warnings.append(warning)
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[[
+            InlineKeyboardButton(
+                text=f"Отменить все ({len(records)})",
+                callback_data=f"undo_batch:{(now - EPOCH) // timedelta(microseconds=1)}",
             )
+        ]])
 
-        session.add(record)
+    text = f"Записано операций: {len(records)} из {len(lines)}\n" + "\n".join(results)
+    if warnings:
+        text += "\n\n" + "\n".join(warnings)
+    await message.reply(text, reply_markup=keyboard)
+
+async def record_operation(session: AsyncSession, operation_type: str, user, context, category, amount: Decimal):
+    """
+    Отправляет операцию в пакетную запись. Возвращает id записи, время операции
+    и предупреждение, если расход пересек порог бюджета категории (иначе None).
+    """
+    # Пакетная запись идет в отдельной транзакции и должна видеть только что
+    # созданных пользователя и контекст (на теплом пути транзакции нет)
+    if session.in_transaction():
         await session.commit()
 
-        # Кнопка для удаления записи
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [
-                InlineKeyboardButton(
-                    text=f"Удалить {'расход' if operation_type == 'expense' else 'доход'}",
-                    callback_data=f"delete_{operation_type}:{record.id}"
-                )
-            ]
-        ])
-
-        await message.answer(
-            f"{'Расход' if operation_type == 'expense' else 'Доход'} добавлен!\n"
-            f"Сумма: {amount}\n"
-            f"Категория: {category.title}\n"
-            f"Дата: {now.strftime('%d.%m.%Y %H:%M')}\n"
-            f"Пользователь: @{user_tg.username or user_tg.first_name}",
-            reply_markup=keyboard
-        )
+    moscow_tz = timezone(timedelta(hours=3))
+    now = datetime.now(moscow_tz).replace(tzinfo=None)
+    # Запись попадает в базу пакетом вместе с соседними операциями,
+    # дневной агрегат обновляется в той же транзакции
+    record_id = await insert_batcher.submit(
+        operation_type, user.id, context.id, category.id, amount, now
+    )
+    # Запись уже в базе: кэшированные статистика и диаграммы пользователя устарели
+    stats_generations.bump(context.id, user.id)
+    # Счетчик бюджета обновлен в транзакции вставки, проверка лимита — по сумме в памяти
+    warning = None
+    if operation_type == "expense":
+        warning = check_budget(context.id, category.id, html.escape(category.title), now.date(), amount)
+    return record_id, now, warning
+
+async def add_operation(session: AsyncSession, operation_type: str, user, context, category, amount: Decimal, user_tg: types.User):
+    """
+    Отправляет операцию в пакетную запись и возвращает текст подтверждения с кнопкой удаления
+    и предупреждение о бюджете (или None).
+    """
+    record_id, now, warning = await record_operation(session, operation_type, user, context, category, amount)
+
+    # Кнопка для удаления записи
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(
+                text=f"Удалить {'расход' if operation_type == 'expense' else 'доход'}",
+                callback_data=f"delete_{operation_type}:{record_id}"
+            )
+        ]
+    ])
+
+    text = (
+        f"{'Расход' if operation_type == 'expense' else 'Доход'} добавлен!\n"
+        f"Сумма: {amount}\n"
+        f"Категория: {category.title}\n"
+        f"Дата: {now.strftime('%d.%m.%Y %H:%M')}\n"
+        f"Пользователь: @{user_tg.username or user_tg.first_name}"
+    )
+    return text, keyboard, warning
+
+@router.callback_query(lambda c: c.data and c.data.startswith(("suggest_expense:", "suggest_income:")))
+async def suggest_category_callback(callback: CallbackQuery, session: AsyncSession):
+    """
+    Обрабатывает нажатие на кнопку с предложенной категорией: записывает операцию в нее.
+    Нажать кнопку может только автор исходного сообщения.
+    """
+    op_type, category_id_str, amount_str = callback.data.split(":")
+    operation_type = op_type.removeprefix("suggest_")
+    user_tg = callback.from_user
+
+    original = callback.message.reply_to_message
+    if not original or not original.from_user or original.from_user.id != user_tg.id:
+        await callback.answer("Вы не можете выбрать категорию за другого пользователя.", show_alert=True)
+        return
+
+    context = await resolve_context(session, callback.message.chat)
+    if context.purging:
+        await callback.answer(PURGE_REJECTED, show_alert=True)
+        return
+    # Категорию могли удалить после подсказки — проверяем заново по названию
+    category = await session.get(Category, int(category_id_str))
+    category = category and await resolve_category(session, category.title, context)
+    if not category:
+        await callback.answer("Категория уже удалена.", show_alert=True)
+        return
+
+    user = await resolve_user(session, user_tg)
+    text, keyboard, warning = await add_operation(session, operation_type, user, context, category, Decimal(amount_str), user_tg)
+    await callback.message.edit_text(text, reply_markup=keyboard)
+    if warning:
+        await callback.message.answer(warning)
+    await callback.answer()
 
 @router.callback_query(lambda c: c.data and c.data.startswith(("delete_expense:", "delete_income:")))
-async def delete_record_callback(callback: CallbackQuery):
+async def delete_record_callback(callback: CallbackQuery, session: AsyncSession):
     """
     Обрабатывает нажатие на кнопку удаления расхода или дохода.
     Удалить запись может только ее автор.
@@ -122,26 +304,57 @@ async def delete_record_callback(callback: CallbackQuery):
     op_type, record_id_str = data.split(":")
     record_id = int(record_id_str)
 
-    async with get_async_session() as session:
-        # Получаем запись по типу (расход или доход)
-        if op_type == "delete_expense":
-            record = await session.get(Expense, record_id)
-        else:
-            record = await session.get(Income, record_id)
+    operation_type = op_type.removeprefix("delete_")
+    record = await session.get(Operation, record_id)
 
-        if not record:
-            await callback.answer("Запись уже удалена или не найдена.", show_alert=True)
-            return
+    # Тип в кнопке должен совпадать с типом записи
+    if not record or record.kind != operation_type:
+        await callback.answer("Запись уже удалена или не найдена.", show_alert=True)
+        return
 
-        # Проверяем, что удаляет автор записи
-        user_result = await session.execute(select(User).where(User.tg_id == user_tg.id))
-        user = user_result.scalars().first()
-        if not user or user.id != record.user_id:
-            await callback.answer("Вы не можете удалить эту запись.", show_alert=True)
-            return
+    # Проверяем, что удаляет автор записи
+    user_result = await session.execute(select(User).where(User.tg_id == user_tg.id))
+    user = user_result.scalars().first()
+    if not user or user.id != record.user_id:
+        await callback.answer("Вы не можете удалить эту запись.", show_alert=True)
+        return
 
-        await session.delete(record)
-        await session.commit()
+    await session.delete(record)
+    await add_daily_total(
+        session, operation_type, record.context_id, record.user_id,
+        record.category_id, record.created_at.date(), -record.amount, count=-1,
+    )
+    if record.kind == "expense":
+        counted = await add_budget_spending(
+            session, [(record.context_id, record.category_id, record.created_at.date(), -record.amount)]
+        )
+        if counted:
+            after_commit(session, lambda: apply_budget_spending(counted))
+
+    after_commit(session, lambda: stats_generations.bump(record.context_id, record.user_id))
 
+    if callback.message.text and callback.message.text.startswith(SUMMARY_HEADER):
+        # В сводке зачеркивается только удаленная операция
+        text, keyboard = confirmation_summaries.mark_deleted(record.context_id, callback.message, data)
+        await callback.message.edit_text(text, reply_markup=keyboard)
+    else:
         await callback.message.edit_text("Запись удалена.")
-        await callback.answer()
+    await callback.answer()
+
+@router.callback_query(lambda c: c.data and c.data.startswith("undo_batch:"))
+async def undo_batch_callback(callback: CallbackQuery, session: AsyncSession):
+    """
+    Отменяет все операции, записанные одним сообщением.
+    Удаляются только операции нажавшего пользователя, поэтому отменить их может только автор.
+    """
+    created_at = EPOCH + timedelta(microseconds=int(callback.data.split(":")[1]))
+    user = await resolve_existing_user(session, callback.from_user.id)
+    context = await resolve_context(session, callback.message.chat)
+    deleted = user and await delete_operations_at(session, context.id, user.id, created_at)
+    if not deleted:
+        await callback.answer("Нечего отменять: операции уже удалены или записаны другим пользователем.", show_alert=True)
+        return
+
+    after_commit(session, lambda: stats_generations.bump(context.id, user.id))
+    await callback.message.edit_text(f"Отменено операций: {deleted}.")
+    await callback.answer()
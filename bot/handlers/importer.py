@@ -0,0 +1,75 @@
+import asyncio
+import io
+
+from aiogram import Router
+from aiogram.filters import Command, CommandObject
+from aiogram.types import Message
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from bot.keyboards.menu import menu_inline_keyboard
+from bot.services.cache import stats_generations
+from bot.services.export import SpooledInputFile
+from bot.services.importer import StatementError, import_operations, parse_mapping, parse_statement, write_report
+from bot.services.purge import PURGE_REJECTED
+from bot.services.utils import resolve_context, resolve_user
+
+router = Router()
+
+# Бот может скачать из Telegram файл размером не больше 20 МБ
+MAX_FILE_SIZE = 20 * 1024 * 1024
+
+IMPORT_HELP = (
+    "Отправьте CSV-файл выписки с подписью /import (или ответьте /import на сообщение с файлом).\n\n"
+    "Нужны колонки с датой, суммой и категорией, например: Дата;Сумма;Категория.\n"
+    "Колонка Тип (доход/расход) необязательна: без нее отрицательные суммы считаются расходами.\n"
+    "Если колонки называются иначе, укажите их в подписи:\n"
+    "/import дата=Дата платежа; сумма=Сумма в рублях; категория=Описание"
+)
+
+
+@router.message(Command("import"))
+async def import_handler(message: Message, command: CommandObject, session: AsyncSession):
+    """
+    Обрабатывает команду /import: загружает операции из CSV-выписки.
+    Строки, которые не удалось загрузить, возвращаются файлом с причинами.
+    """
+    document = message.document or (message.reply_to_message and message.reply_to_message.document)
+    if not document:
+        await message.answer(IMPORT_HELP)
+        return
+    if document.file_size and document.file_size > MAX_FILE_SIZE:
+        await message.answer("Файл слишком большой: максимум 20 МБ.")
+        return
+    context = await resolve_context(session, message.chat)
+    if context.purging:
+        await message.answer(PURGE_REJECTED)
+        return
+
+    buffer = io.BytesIO()
+    await message.bot.download(document, destination=buffer)
+    try:
+        # Разбор сотен тысяч строк не должен блокировать event loop
+        parsed = await asyncio.to_thread(parse_statement, buffer.getvalue(), parse_mapping(command.args or ""))
+    except StatementError as e:
+        await message.answer(f"Не удалось импортировать файл. {e}")
+        return
+
+    user = await resolve_user(session, message.from_user)
+    imported, unknown = await import_operations(session, parsed.rows, user.id, context)
+    # Об успехе сообщаем только после коммита всех загруженных строк
+    await session.commit()
+    stats_generations.bump(context.id, user.id)
+
+    failed = parsed.failed + unknown
+    text = f"Импортировано операций: {imported}"
+    if not failed:
+        await message.answer(text, reply_markup=menu_inline_keyboard())
+        return
+
+    report = await asyncio.to_thread(write_report, parsed.header, failed)
+    with report:
+        await message.answer_document(
+            SpooledInputFile(report, "import_errors.csv"),
+            caption=f"{text}\nНе удалось импортировать: {len(failed)} (причины в файле)",
+            reply_markup=menu_inline_keyboard(),
+        )
@@ -1,8 +1,9 @@
 from aiogram import Router, types
 from aiogram.types import CallbackQuery
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from bot.handlers.categories import list_categories_handler
-from bot.handlers.statistics import statcat_handler, statdetail_handler
+from bot.handlers.statistics import statcat_handler, statchart_handler, statdetail_handler
 from bot.handlers.base_commands import commands_handler, help_handler
 from bot.keyboards.menu import (
     menu_inline_keyboard,
@@ -27,8 +28,8 @@ async def back_to_main_menu(callback: types.CallbackQuery):
 
 
 @router.callback_query(lambda c: c.data == "show_categories")
-async def show_categories_callback(callback: types.CallbackQuery):
-    await list_categories_handler(callback.message)
+async def show_categories_callback(callback: types.CallbackQuery, session: AsyncSession):
+    await list_categories_handler(callback.message, session)
     await callback.answer()
 
 
@@ -47,26 +48,42 @@ async def show_period_menu(callback: types.CallbackQuery):
 
 @router.callback_query(lambda c: c.data == "stat_detail")
 async def show_detail_period_menu(callback: types.CallbackQuery):
-    await callback.message.edit_reply_markup(
-        reply_markup=period_menu_keyboard("stat_detail", weeks=False, months=False)
-    )
+    await callback.message.edit_reply_markup(reply_markup=period_menu_keyboard("stat_detail"))
     await callback.answer()
 
 
-@router.callback_query(lambda c: c.data == "stat_detail_day")
-async def handle_stat_detail_day(callback: CallbackQuery):
+@router.callback_query(
+    lambda c: c.data in ["stat_detail_day", "stat_detail_week", "stat_detail_month"]
+)
+async def handle_stat_detail_period(callback: CallbackQuery, session: AsyncSession):
+    period = callback.data.split("_")[-1]
     await callback.answer()
-    await statdetail_handler(callback, None)
+    await statdetail_handler(callback, period, session)
 
 
 @router.callback_query(
     lambda c: c.data
     in ["stat_by_category_day", "stat_by_category_week", "stat_by_category_month"]
 )
-async def handle_stat_by_category_period(callback: CallbackQuery):
+async def handle_stat_by_category_period(callback: CallbackQuery, session: AsyncSession):
+    period = callback.data.split("_")[-1]
+    await callback.answer()
+    await statcat_handler(callback, period, session)
+
+
+@router.callback_query(lambda c: c.data == "stat_chart")
+async def show_chart_period_menu(callback: types.CallbackQuery):
+    await callback.message.edit_reply_markup(reply_markup=period_menu_keyboard("stat_chart"))
+    await callback.answer()
+
+
+@router.callback_query(
+    lambda c: c.data in ["stat_chart_day", "stat_chart_week", "stat_chart_month"]
+)
+async def handle_stat_chart_period(callback: CallbackQuery, session: AsyncSession):
     period = callback.data.split("_")[-1]
     await callback.answer()
-    await statcat_handler(callback, period)
+    await statchart_handler(callback, period, session)
 
 
 @router.callback_query(lambda c: c.data == "show_commands")
@@ -1,32 +1,49 @@
-from datetime import UTC, datetime, timedelta
+from datetime import datetime, timedelta
 
 from aiogram import Router
+from aiogram.enums import ChatType
 from aiogram.filters import Command, CommandObject
-from aiogram.types import CallbackQuery, Message
-from sqlalchemy import func
-from sqlalchemy.future import select
+from aiogram.types import (
+    BufferedInputFile,
+    CallbackQuery,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InputMediaPhoto,
+    Message,
+)
+from sqlalchemy import delete
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from bot.keyboards.menu import menu_inline_keyboard
-from bot.models.models import Category, Expense, Income
-from bot.services.db import get_async_session
+from bot.models.models import DigestSubscription
+from bot.services.cache import stats_generations
+from bot.services.charts import ChartQueueFull, chart_cache, chart_renderer, charts_available
+from bot.services.stats import OperationCursor, get_category_stats_cached, get_operations_page
 from bot.services.utils import (
-    get_or_create_context,
-    get_user,
+    get_context,
     get_user_display,
+    is_admin,
     parse_date_arg,
+    resolve_context,
+    resolve_existing_user,
 )
 
 router = Router()
 
+STATDETAIL_PAGE_SIZE = 30
+# Точка отсчета для границ периода и курсора в callback_data
+EPOCH = datetime(1970, 1, 1)
+
 
 @router.message(Command("statcat"))
-async def statcat_command(message: Message, command: CommandObject):
+async def statcat_command(message: Message, command: CommandObject, session: AsyncSession):
     """Обработчик прямой команды /statcat"""
     period = command.args if command.args else ""
-    await statcat_handler(message, period)
+    await statcat_handler(message, period, session)
 
 
-async def statcat_handler(message_or_callback, period):
+async def statcat_handler(message_or_callback, period, session: AsyncSession):
     """
     Обрабатывает статистику по категориям за выбранный период.
     Показывает суммы доходов и расходов по каждой категории.
@@ -48,50 +65,18 @@ async def statcat_handler(message_or_callback, period):
 
     date_from, date_to, period_text = parsed
 
-    async with get_async_session() as session:
-        context = await get_or_create_context(session, message.chat)
-        db_user = await get_user(session, user.id)
+    context = await resolve_context(session, message.chat)
+    db_user = await resolve_existing_user(session, user.id)
 
-        if not db_user:
-            await message.answer("Пользователь не найден.")
-            return
+    if not db_user:
+        await message.answer("Пользователь не найден.")
+        return
+
+    # Доходы и расходы по категориям вместе с итогами — одним запросом (или из кэша)
+    income_rows, expense_rows, total_income, total_expense = await get_category_stats_cached(
+        session, context.id, db_user.id, date_from, date_to, period_text
+    )
 
-        # Доходы по категориям
-        income_rows = (
-            await session.execute(
-                select(Category.title, func.sum(Income.amount))
-                .join(Income, Income.category_id == Category.id)
-                .where(
-                    Income.context_id == context.id,
-                    Income.user_id == db_user.id,
-                    Income.created_at >= date_from,
-                    Income.created_at < date_to,
-                    Category.is_deleted == False,
-                )
-                .group_by(Category.title)
-                .order_by(func.sum(Income.amount).desc())
-            )
-        ).all()
-
-        # Расходы по категориям
-        expense_rows = (
-            await session.execute(
-                select(Category.title, func.sum(Expense.amount))
-                .join(Expense, Expense.category_id == Category.id)
-                .where(
-                    Expense.context_id == context.id,
-                    Expense.user_id == db_user.id,
-                    Expense.created_at >= date_from,
-                    Expense.created_at < date_to,
-                    Category.is_deleted == False,
-                )
-                .group_by(Category.title)
-                .order_by(func.sum(Expense.amount).desc())
-            )
-        ).all()
-
-    total_income = sum(amount for _, amount in income_rows) if income_rows else 0
-    total_expense = sum(amount for _, amount in expense_rows) if expense_rows else 0
     user_display = get_user_display(user)
 
     text = f"Статистика для {user_display} по категориям {period_text}\n\n"
@@ -112,85 +97,235 @@ async def statcat_handler(message_or_callback, period):
     await message.answer(text, reply_markup=menu_inline_keyboard())
 
 
+@router.message(Command("statchart"))
+async def statchart_command(message: Message, command: CommandObject, session: AsyncSession):
+    """Обработчик прямой команды /statchart (без периода — за текущий месяц)"""
+    await statchart_handler(message, command.args or "month", session)
+
+
+async def statchart_handler(message_or_callback, period, session: AsyncSession):
+    """
+    Отправляет круговую и столбчатую диаграммы расходов по категориям за период.
+    Диаграммы рисуются в пуле процессов и кэшируются до появления новых данных.
+    """
+    is_callback = isinstance(message_or_callback, CallbackQuery)
+    message = message_or_callback.message if is_callback else message_or_callback
+    user = message_or_callback.from_user
+
+    if not charts_available():
+        await message.answer("Диаграммы сейчас недоступны.")
+        return
+
+    parsed = parse_date_arg(period or "")
+    if not parsed:
+        text = ("Для построения диаграммы используйте следующие форматы:\n\n"
+                "• /statchart day - за сегодня\n"
+                "• /statchart week - за текущую неделю\n"
+                "• /statchart month - за текущий месяц\n"
+                "• /statchart dd.mm.yyyy - за конкретную дату\n"
+                "• /statchart dd.mm.yyyy - dd.mm.yyyy - за период")
+        await message.answer(text)
+        return
+
+    date_from, date_to, period_text = parsed
+
+    context = await resolve_context(session, message.chat)
+    db_user = await resolve_existing_user(session, user.id)
+    if not db_user:
+        await message.answer("Пользователь не найден.")
+        return
+
+    # Начало и описание периода однозначно задают его для day/week/month и явных дат
+    key = (context.id, db_user.id, date_from, period_text)
+    generation = stats_generations.current(context.id, db_user.id)
+    charts = chart_cache.get(key, generation)
+    if charts:
+        pie, bar = charts
+    else:
+        # Те же агрегаты, что и у /statcat
+        stats = await get_category_stats_cached(session, context.id, db_user.id, date_from, date_to, period_text)
+        if not stats.expense_rows:
+            await message.answer(f"Нет расходов {period_text}.", reply_markup=menu_inline_keyboard())
+            return
+        rows = [(title, float(amount)) for title, amount in stats.expense_rows]
+        try:
+            pie, bar = await chart_renderer.render(f"Расходы {period_text}", rows)
+        except ChartQueueFull:
+            await message.answer("Сейчас строится много диаграмм, попробуйте через минуту.")
+            return
+        chart_cache.set(key, generation, (pie, bar))
+
+    await message.answer_media_group([
+        InputMediaPhoto(
+            media=BufferedInputFile(pie, "pie.png"),
+            caption=f"Расходы {get_user_display(user)} {period_text}",
+        ),
+        InputMediaPhoto(media=BufferedInputFile(bar, "bar.png")),
+    ])
+
+
 @router.message(Command("statdetail"))
-async def statdetail_handler(callback: CallbackQuery, period):
+async def statdetail_command(message: Message, command: CommandObject, session: AsyncSession):
+    """Обработчик прямой команды /statdetail (без периода — за сегодня)"""
+    await statdetail_handler(message, command.args or "day", session)
+
+
+async def statdetail_handler(message_or_callback, period, session: AsyncSession):
     """
-    Обрабатывает команду /statdetail и возвращает детальную статистику по всем операциям пользователя за текущий день.
-    Показывает список всех доходов и расходов с датой, категорией и суммой.
+    Показывает первую страницу детальной статистики пользователя за период:
+    доходы и расходы с датой, категорией и суммой, по STATDETAIL_PAGE_SIZE операций на страницу.
     """
-    now = datetime.now(UTC)
-    date_from = now.replace(hour=0, minute=0, second=0, microsecond=0).replace(
-        tzinfo=None
+    is_callback = isinstance(message_or_callback, CallbackQuery)
+    message = message_or_callback.message if is_callback else message_or_callback
+
+    parsed = parse_date_arg(period or "")
+    if not parsed:
+        text = ("Для просмотра детализации используйте следующие форматы:\n\n"
+                "• /statdetail day - за сегодня\n"
+                "• /statdetail week - за текущую неделю\n"
+                "• /statdetail month - за текущий месяц\n"
+                "• /statdetail dd.mm.yyyy - за конкретную дату\n"
+                "• /statdetail dd.mm.yyyy - dd.mm.yyyy - за период")
+        await message.answer(text)
+        return
+
+    date_from, date_to, period_text = parsed
+    # Границы периода передаются в кнопках с точностью до секунды
+    date_to = date_to.replace(microsecond=0) + timedelta(seconds=1 if date_to.microsecond else 0)
+    page = await _statdetail_page(message_or_callback.from_user, message, session, date_from, date_to, period_text)
+    if page:
+        text, keyboard = page
+        await message.answer(text, reply_markup=keyboard)
+
+
+@router.callback_query(lambda c: c.data and c.data.startswith("sdu:"))
+async def statdetail_page_callback(callback: CallbackQuery, session: AsyncSession):
+    """
+    Листает детальную статистику: в кнопке закодированы владелец, период и курсор (created_at, id).
+    Листать может только тот, чья это статистика.
+    """
+    _, owner_id, date_from, span, direction, offset, record_id = callback.data.split(":")
+    owner_id, record_id = int(owner_id, 36), int(record_id, 36)
+    date_from = EPOCH + timedelta(seconds=int(date_from, 36))
+    date_to = date_from + timedelta(seconds=int(span, 36))
+    created_at = date_from + timedelta(microseconds=int(offset, 36))
+    if owner_id != callback.from_user.id:
+        await callback.answer("Это чужая статистика. Свою можно посмотреть командой /statdetail.", show_alert=True)
+        return
+    cursor = OperationCursor(created_at, record_id)
+    page = await _statdetail_page(
+        callback.from_user, callback.message, session, date_from, date_to,
+        _period_text(date_from, date_to), cursor, backward=direction == "p",
     )
-    date_to = (date_from + timedelta(days=1)).replace(tzinfo=None)
+    if page:
+        text, keyboard = page
+        await callback.message.edit_text(text, reply_markup=keyboard)
+    await callback.answer()
 
-    async with get_async_session() as session:
-        # Получаем контекст чата и пользователя
-        context = await get_or_create_context(session, callback.message.chat)
-        user = await get_user(session, callback.from_user.id)
 
-        if not user:
-            await callback.message.reply("Пользователь не найден.")
-            return
+def _period_text(date_from: datetime, date_to: datetime) -> str:
+    last_day = date_to - timedelta(microseconds=1)
+    if last_day.date() == date_from.date():
+        return f"за {date_from.strftime('%d.%m.%Y')}"
+    return f"c {date_from.strftime('%d.%m.%Y')} по {last_day.strftime('%d.%m.%Y')}"
 
-        # Доходы за день
-        income_rows = (
-            await session.execute(
-                select(Income.created_at, Income.amount, Category.title)
-                .join(Category, Income.category_id == Category.id)
-                .where(
-                    Income.context_id == context.id,
-                    Income.user_id == user.id,
-                    Income.created_at >= date_from,
-                    Income.created_at < date_to,
-                    Category.is_deleted == False,
-                )
-                .order_by(Income.created_at)
-            )
-        ).all()
-
-        # Расходы за день
-        expense_rows = (
-            await session.execute(
-                select(Expense.created_at, Expense.amount, Category.title)
-                .join(Category, Expense.category_id == Category.id)
-                .where(
-                    Expense.context_id == context.id,
-                    Expense.user_id == user.id,
-                    Expense.created_at >= date_from,
-                    Expense.created_at < date_to,
-                    Category.is_deleted == False,
-                )
-                .order_by(Expense.created_at)
-            )
-        ).all()
-
-    def fmt_rows(rows):
-        """Форматирует строки для вывода операций."""
-        return "\n".join(
-            f"{dt.strftime('%d.%m.%Y - %H:%M')} | {int(amount)} • {cat}"
-            for dt, amount, cat in rows
-        )
 
-    income_text = fmt_rows(income_rows)
-    income_total = sum(int(amount) for _, amount, _ in income_rows)
+def _base36(number: int) -> str:
+    digits = ""
+    while True:
+        number, digit = divmod(number, 36)
+        digits = "0123456789abcdefghijklmnopqrstuvwxyz"[digit] + digits
+        if not number:
+            return digits
 
-    expense_text = fmt_rows(expense_rows)
-    expense_total = sum(int(amount) for _, amount, _ in expense_rows)
 
-    user_display = get_user_display(callback.from_user)
+def _page_button(text: str, direction: str, owner_id: int, date_from: datetime, date_to: datetime,
+                 row) -> InlineKeyboardButton:
+    _, record_id, created_at = row[:3]
+    # callback_data ограничена 64 байтами: числа в base36, длина периода и курсор — от начала периода
+    data = ":".join((
+        "sdu",
+        _base36(owner_id),
+        _base36(int((date_from - EPOCH).total_seconds())),
+        _base36(int((date_to - date_from).total_seconds())),
+        direction,
+        _base36((created_at - date_from) // timedelta(microseconds=1)),
+        _base36(record_id),
+    ))
+    return InlineKeyboardButton(text=text, callback_data=data)
 
-    text = f"Детальная статистика за {now.strftime('%d.%m.%Y')} для {user_display}\n\n"
-    text += "🟢 Доход\n"
-    text += "- - - - - - - - - -\n"
-    text += income_text or "нет"
-    text += "\n- - - - - - - - - -\n"
-    text += f"Итого: {income_total}\n\n"
-    text += "🔴 Расход\n"
+
+async def _statdetail_page(user_tg, message: Message, session: AsyncSession, date_from, date_to, period_text,
+                           cursor: OperationCursor | None = None, backward: bool = False):
+    """
+    Собирает текст и клавиатуру страницы детализации. Возвращает None, если пользователь не найден.
+    """
+    context = await resolve_context(session, message.chat)
+    user = await resolve_existing_user(session, user_tg.id)
+    if not user:
+        await message.answer("Пользователь не найден.")
+        return None
+
+    # Одна страница — один запрос по индексу, независимо от длины периода
+    page = await get_operations_page(
+        session, context.id, user.id, date_from, date_to, cursor, backward, STATDETAIL_PAGE_SIZE
+    )
+
+    text = f"Детальная статистика {period_text} для {get_user_display(user_tg)}\n"
     text += "- - - - - - - - - -\n"
-    text += expense_text or "нет"
-    text += "\n- - - - - - - - - -\n"
-    text += f"Итого: {expense_total}"
+    if page.rows:
+        text += "\n".join(
+            f"{dt.strftime('%d.%m.%Y - %H:%M')} | {'🟢 +' if kind == 'income' else '🔴 '}{int(amount)} • {title}"
+            for kind, _, dt, amount, title in page.rows
+        )
+    else:
+        text += "нет операций"
+    text += "\n- - - - - - - - - -"
+
+    navigation = []
+    if page.rows and page.has_prev:
+        navigation.append(_page_button("« Назад", "p", user_tg.id, date_from, date_to, page.rows[0]))
+    if page.rows and page.has_next:
+        navigation.append(_page_button("Далее »", "n", user_tg.id, date_from, date_to, page.rows[-1]))
+    keyboard = menu_inline_keyboard()
+    if navigation:
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[navigation, *keyboard.inline_keyboard])
+    return text, keyboard
 
-    # Отправляем детальную статистику за день
-    await callback.message.answer(text, reply_markup=menu_inline_keyboard())
+
+@router.message(Command("digest"))
+async def digest_handler(message: Message, command: CommandObject, session: AsyncSession):
+    """
+    Подписывает чат на автоматическую сводку по категориям: за вчера (day) или за прошлую
+    неделю (week), либо отменяет все сводки (off). В группах доступно только администраторам.
+    """
+    mode = (command.args or "").strip().lower()
+    if mode not in ("day", "week", "off"):
+        await message.reply(
+            "Используйте /digest day, чтобы каждое утро получать сводку за вчера, "
+            "/digest week — сводку за прошлую неделю по понедельникам, "
+            "/digest off — отключить сводки.",
+            reply_markup=menu_inline_keyboard()
+        )
+        return
+
+    if message.chat.type in [ChatType.GROUP, ChatType.SUPERGROUP] and not await is_admin(message):
+        await message.reply("Настраивать сводки могут только администраторы.", reply_markup=menu_inline_keyboard())
+        return
+
+    context = await get_context(session, message.chat)
+    if mode == "off":
+        await session.execute(delete(DigestSubscription).where(DigestSubscription.context_id == context.id))
+        await message.reply("Сводки отключены.", reply_markup=menu_inline_keyboard())
+        return
+
+    await session.execute(
+        insert(DigestSubscription)
+        .values(context_id=context.id, period=mode)
+        .on_conflict_do_nothing(index_elements=[DigestSubscription.context_id, DigestSubscription.period])
+    )
+    await message.reply(
+        "Каждое утро в чат будет приходить сводка за вчера."
+        if mode == "day" else "По понедельникам в чат будет приходить сводка за прошлую неделю.",
+        reply_markup=menu_inline_keyboard()
+    )
@@ -28,6 +28,7 @@ def statistics_menu_keyboard():
                 )
             ],
             [InlineKeyboardButton(text="Детализация", callback_data="stat_detail")],
+            [InlineKeyboardButton(text="Диаграмма", callback_data="stat_chart")],
             [InlineKeyboardButton(text="Назад", callback_data="back_to_menu")],
         ]
     )
@@ -0,0 +1,4 @@
+from .db import DbSessionMiddleware
+from .outgoing import OutgoingRateLimiter, outgoing_limiter
+
+__all__ = ["DbSessionMiddleware", "OutgoingRateLimiter", "outgoing_limiter"]
@@ -0,0 +1,60 @@
+import asyncio
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+# Сессия обновления и задача, которая его обрабатывает
+update_session: ContextVar[tuple[AsyncSession, asyncio.Task] | None] = ContextVar("update_session", default=None)
+
+
+class DbSessionMiddleware(BaseMiddleware):
+    """
+    Открывает одну сессию БД на обновление и передает ее в обработчики как `session`.
+    В конце обработки выполняет один коммит, при ошибке — откат. Функции сервисов,
+    получающие эту сессию, сами не коммитят: все изменения обновления попадают в базу
+    одной транзакцией. Действия, которые должны идти после коммита, регистрируются
+    через after_commit (bot/services/db.py).
+    Исключение — отправка сообщений: перед ней транзакция коммитится раньше (release_session),
+    чтобы ожидание очереди исходящих сообщений не держало соединение из пула.
+    Соединение берется из пула только при первом запросе, поэтому обновления
+    без работы с базой его не занимают.
+    """
+
+    def __init__(self, session_factory: async_sessionmaker):
+        self.session_factory = session_factory
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        async with self.session_factory() as session:
+            data["session"] = session
+            token = update_session.set((session, asyncio.current_task()))
+            try:
+                result = await handler(event, data)
+            except Exception:
+                await session.rollback()
+                raise
+            finally:
+                update_session.reset(token)
+            await session.commit()
+        return result
+
+
+async def release_session():
+    """
+    Коммитит транзакцию обновления, которое обрабатывается в текущей задаче, и возвращает
+    соединение в пул. Дальнейшие запросы обработчика идут в новой транзакции.
+    """
+    current = update_session.get()
+    if current is None:
+        return
+    session, task = current
+    # Задачи, запущенные из обработчика, наследуют контекст, но не владеют его сессией
+    if task is asyncio.current_task() and session.in_transaction():
+        await session.commit()
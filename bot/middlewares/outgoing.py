@@ -0,0 +1,215 @@
+import asyncio
+import heapq
+import itertools
+from contextvars import ContextVar
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMediaGroup, TelegramMethod
+
+from bot.config import settings
+from bot.middlewares.db import release_session
+from bot.services.cache import LRUCache
+from bot.utils.logger import logger
+
+# Приоритеты исходящих сообщений: меньше — раньше
+PRIORITY_CONFIRMATION = 0   # Ответы на команды и записи операций, правка кнопок
+PRIORITY_FILE = 1           # Выгрузки, отчеты, диаграммы
+PRIORITY_BACKGROUND = 2     # Рассылки, которые не ждет пользователь
+
+# Методы, которые отправляют или меняют сообщения и подпадают под ограничения Telegram
+LIMITED_METHOD_PREFIXES = ("send", "edit", "copy", "forward")
+FILE_METHODS = ("sendDocument", "sendPhoto", "sendMediaGroup")
+
+# Приоритет, заданный вызывающим кодом (например, фоновой рассылкой), вместо приоритета по методу
+send_priority: ContextVar[int | None] = ContextVar("send_priority", default=None)
+
+
+class TokenBucket:
+    """
+    Корзина токенов: rate токенов в секунду, не больше capacity про запас.
+    Отправка дороже одного токена (альбом) уводит корзину в минус, и следующие ждут дольше.
+    """
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+        # До этого момента корзина закрыта (retry_after от Telegram)
+        self.paused_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """
+        Через сколько секунд в корзине появится токен (0 — есть сейчас).
+        """
+        self._refill(now)
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.paused_until - now)
+
+    def take(self, cost: int):
+        self.tokens -= cost
+
+    def pause(self, now: float, seconds: float):
+        self.paused_until = max(self.paused_until, now + seconds)
+
+
+class OutgoingRateLimiter(BaseRequestMiddleware):
+    """
+    Middleware сессии бота: держит отправку сообщений в пределах ограничений Telegram.
+    Общая корзина ограничивает все сообщения бота (около 30 в секунду), корзины чатов —
+    сообщения в одну группу (около 20 в минуту) и в личный чат (около 1 в секунду).
+    Ожидающие отправки выдаются по приоритету, а внутри приоритета — по порядку;
+    чат, исчерпавший свою корзину, не задерживает другие чаты.
+    При TelegramRetryAfter чат закрывается на retry_after секунд, и отправка повторяется
+    не больше max_retries раз. Остальные методы (getUpdates, answerCallbackQuery и т.п.)
+    проходят без ограничений.
+    """
+
+    def __init__(self, global_rate: float, group_rate: float, private_rate: float,
+                 chat_burst: int, max_retries: int, max_chats: int = 10000):
+        self.global_rate = global_rate
+        self.group_rate = group_rate
+        self.private_rate = private_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        # Корзина чата, вытесненная из LRU, была полной: чат давно ничего не получал
+        self._chats = LRUCache(max_chats, float("inf"))
+        self._global: TokenBucket | None = None
+        self._waiters: list[tuple[int, int, int | str, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    @property
+    def queue_depth(self) -> int:
+        """
+        Число отправок, ожидающих своей очереди.
+        """
+        return len(self._waiters)
+
+    def set_global_rate(self, rate: float):
+        """
+        Общий лимит этого процесса (воркеры делят лимит бота между собой).
+        """
+        self.global_rate = rate
+        if self._global is not None:
+            self._global.rate = self._global.capacity = rate
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot, method: TelegramMethod):
+        api_method = method.__api_method__
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None or not api_method.startswith(LIMITED_METHOD_PREFIXES):
+            return await make_request(bot, method)
+
+        priority = send_priority.get()
+        if priority is None:
+            priority = PRIORITY_FILE if api_method in FILE_METHODS else PRIORITY_CONFIRMATION
+        # Альбом расходует лимит как отдельные сообщения
+        cost = len(method.media) if isinstance(method, SendMediaGroup) else 1
+        # Повтор после retry_after сохраняет место в очереди
+        sequence = next(self._sequence)
+        # Ожидание очереди (в группу — до нескольких секунд) не должно держать соединение с базой
+        await release_session()
+
+        for attempt in itertools.count():
+            await self._acquire(priority, sequence, chat_id, cost)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt >= self.max_retries:
+                    raise
+                logger.warning(f"Flood control в чате {chat_id} ({api_method}), повтор через {e.retry_after} с")
+                now = asyncio.get_running_loop().time()
+                self._chat_bucket(chat_id, now).pause(now, e.retry_after)
+
+    async def _acquire(self, priority: int, sequence: int, chat_id: int | str, cost: int):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, sequence, chat_id, cost, future))
+        self._wakeup.set()
+        await future
+
+    def _chat_bucket(self, chat_id: int | str, now: float) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # У групп и каналов id отрицательный (или @username)
+            is_group = not isinstance(chat_id, int) or chat_id < 0
+            bucket = TokenBucket(self.group_rate if is_group else self.private_rate, self.chat_burst, now)
+            self._chats.set(chat_id, bucket)
+        return bucket
+
+    def _grant(self, now: float) -> float | None:
+        """
+        Выдает разрешения на отправку, пока хватает токенов.
+        Возвращает, через сколько секунд стоит проверить очередь снова (None — очередь пуста).
+        """
+        if self._global is None:
+            self._global = TokenBucket(self.global_rate, self.global_rate, now)
+        deferred = []
+        delay = None
+        while self._waiters:
+            waiter = heapq.heappop(self._waiters)
+            _, _, chat_id, cost, future = waiter
+            if future.done():
+                # Обработчик отменен, пока ждал очереди
+                continue
+            global_wait = self._global.wait_time(now)
+            if global_wait > 0:
+                # Общий лимит исчерпан: следующие по приоритету ждут его первыми
+                deferred.append(waiter)
+                delay = global_wait if delay is None else min(delay, global_wait)
+                break
+            bucket = self._chat_bucket(chat_id, now)
+            chat_wait = bucket.wait_time(now)
+            if chat_wait > 0:
+                deferred.append(waiter)
+                delay = chat_wait if delay is None else min(delay, chat_wait)
+                continue
+            self._global.take(cost)
+            bucket.take(cost)
+            future.set_result(None)
+        for waiter in deferred:
+            heapq.heappush(self._waiters, waiter)
+        return delay
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wakeup.clear()
+            delay = self._grant(loop.time())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def stop(self):
+        """
+        Останавливает выдачу очереди. Ожидающие отправки уходят сразу, без ограничений.
+        """
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        while self._waiters:
+            future = heapq.heappop(self._waiters)[-1]
+            if not future.done():
+                future.set_result(None)
+
+
+outgoing_limiter = OutgoingRateLimiter(
+    global_rate=settings.api_global_rate,
+    group_rate=settings.api_group_rate,
+    private_rate=settings.api_private_rate,
+    chat_burst=settings.api_chat_burst,
+    max_retries=settings.api_max_retries,
+)
@@ -1,15 +1,22 @@
-from datetime import datetime
+from datetime import date, datetime
 from decimal import Decimal
 
 from sqlalchemy import (
     BigInteger,
+    Enum,
     ForeignKey,
+    Index,
+    UniqueConstraint,
     func,
+    text,
 )
 from sqlalchemy.orm import Mapped, mapped_column
 
 from bot.models.base import Base
 
+# Тип операции: перечисление PostgreSQL занимает 4 байта вместо строки
+OPERATION_KIND = Enum("income", "expense", name="operation_kind")
+
 
 class User(Base):
     """
@@ -27,45 +34,134 @@ class Context(Base):
     Модель контекста (чат или пользователь).
     """
     __tablename__ = "contexts"
+    __table_args__ = (
+        # Один контекст на чат; используется в INSERT … ON CONFLICT (upsert_context)
+        UniqueConstraint("context_id", "context_type", name="uq_contexts_context_id_context_type"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    context_id: Mapped[int] = mapped_column(BigInteger, index=True)  # chat_id или user_id
+    context_id: Mapped[int] = mapped_column(BigInteger)              # chat_id или user_id
     context_type: Mapped[str] = mapped_column()                      # 'private' или 'group'
+    # Подтверждения операций собираются в одно сообщение-сводку (/compact)
+    compact_confirmations: Mapped[bool] = mapped_column(default=False, server_default=text("false"))
+    # Идет фоновая очистка (/clearcontext): новые операции не принимаются
+    purging: Mapped[bool] = mapped_column(default=False, server_default=text("false"))
 
 class Category(Base):
     """
     Модель категории дохода или расхода.
     """
     __tablename__ = "categories"
+    __table_args__ = (
+        # Поиск категории по названию без учета регистра (find_category), включая удаленные
+        # переопределения шаблонных категорий
+        Index("ix_categories_context_id_lower_title", "context_id", text("lower(title)")),
+        # Нечеткий поиск похожей категории по триграммам (suggest_category), требует pg_trgm
+        Index(
+            "ix_categories_lower_title_trgm",
+            text("lower(title) gin_trgm_ops"),
+            postgresql_using="gin",
+        ),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     title: Mapped[str] = mapped_column()                                 # Название категории
-    context_id: Mapped[int] = mapped_column(ForeignKey("contexts.id"))   # Контекст (чат)
+    context_id: Mapped[int | None] = mapped_column(ForeignKey("contexts.id", ondelete="CASCADE"), nullable=True)  # Контекст (чат); NULL — шаблонная категория для всех чатов
     is_default: Mapped[bool] = mapped_column(default=False)              # Является ли категорией по умолчанию
     is_deleted: Mapped[bool] = mapped_column(default=False)              # Удалена ли категория
 
-class Expense(Base):
+class Operation(Base):
     """
-    Модель расхода пользователя.
+    Модель операции пользователя: расхода или дохода.
     """
-    __tablename__ = "expenses"
+    __tablename__ = "operations"
+    __table_args__ = (
+        # Покрывающий индекс для статистики: фильтр по контексту, пользователю и периоду,
+        # id — для keyset-пагинации детализации по (created_at, id)
+        Index(
+            "ix_operations_context_id_user_id_created_at_id",
+            "context_id",
+            "user_id",
+            "created_at",
+            "id",
+            postgresql_include=["kind", "amount", "category_id"],
+        ),
+        # Проверка ссылок при удалении категорий (ON DELETE CASCADE) идет по индексу
+        Index("ix_operations_category_id", "category_id"),
+        # Месячные секции по created_at (bot/services/partitions.py): запросы за период
+        # читают только секции своих месяцев
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+    # Первичный ключ таблицы — (id, created_at), как требует секционирование;
+    # id уникален сам по себе (последовательность), поэтому ORM адресует строку по нему
+    __mapper_args__ = {"primary_key": ["id"]}
 
-    id: Mapped[int] = mapped_column(primary_key=True)
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))            # Пользователь
-    context_id: Mapped[int] = mapped_column(ForeignKey("contexts.id"))      # Контекст (чат)
-    category_id: Mapped[int] = mapped_column(ForeignKey("categories.id"))   # Категория расхода
-    amount: Mapped[Decimal] = mapped_column()                               # Сумма расхода
-    created_at: Mapped[datetime] = mapped_column(server_default=func.now()) # Дата и время создания
+    context_id: Mapped[int] = mapped_column(ForeignKey("contexts.id", ondelete="CASCADE"))      # Контекст (чат)
+    category_id: Mapped[int] = mapped_column(ForeignKey("categories.id", ondelete="CASCADE"))   # Категория
+    kind: Mapped[str] = mapped_column(OPERATION_KIND)                       # 'income' или 'expense'
+    amount: Mapped[Decimal] = mapped_column()                               # Сумма операции
+    created_at: Mapped[datetime] = mapped_column(primary_key=True, server_default=func.now()) # Дата и время создания
 
-class Income(Base):
+class DailyTotal(Base):
     """
-    Модель дохода пользователя.
+    Дневной агрегат операций (rollup) для статистики за длинные периоды.
+    Обновляется в той же транзакции, что и вставка/удаление операции.
     """
-    __tablename__ = "incomes"
+    __tablename__ = "daily_totals"
+    __table_args__ = (
+        # category_id — не первая колонка первичного ключа, поэтому каскаду по категории нужен свой индекс
+        Index("ix_daily_totals_category_id", "category_id"),
+    )
 
-    id: Mapped[int] = mapped_column(primary_key=True)
-    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))            # Пользователь
-    context_id: Mapped[int] = mapped_column(ForeignKey("contexts.id"))      # Контекст (чат)
-    category_id: Mapped[int] = mapped_column(ForeignKey("categories.id"))   # Категория дохода
-    amount: Mapped[Decimal] = mapped_column()                               # Сумма дохода
-    created_at: Mapped[datetime] = mapped_column(server_default=func.now()) # Дата и время создания
\ No newline at end of file
+    context_id: Mapped[int] = mapped_column(ForeignKey("contexts.id", ondelete="CASCADE"), primary_key=True)    # Контекст (чат)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), primary_key=True)          # Пользователь
+    day: Mapped[date] = mapped_column(primary_key=True)                                     # День операций
+    category_id: Mapped[int] = mapped_column(ForeignKey("categories.id", ondelete="CASCADE"), primary_key=True) # Категория
+    kind: Mapped[str] = mapped_column(OPERATION_KIND, primary_key=True)                     # 'income' или 'expense'
+    total: Mapped[Decimal] = mapped_column(default=0)                                       # Сумма операций за день
+    count: Mapped[int] = mapped_column(default=0)                                           # Количество операций за день
+
+class DigestSubscription(Base):
+    """
+    Подписка чата на автоматическую сводку (/digest): за вчера или за прошлую неделю.
+    """
+    __tablename__ = "digest_subscriptions"
+
+    context_id: Mapped[int] = mapped_column(ForeignKey("contexts.id", ondelete="CASCADE"), primary_key=True)  # Контекст (чат)
+    period: Mapped[str] = mapped_column(primary_key=True)                        # 'day' или 'week'
+    # Конец последнего периода, за который сводка уже разослана (NULL — еще не было)
+    last_sent_on: Mapped[date | None] = mapped_column(nullable=True)
+
+class Budget(Base):
+    """
+    Лимит расходов категории в контексте на месяц или неделю (/budget).
+    """
+    __tablename__ = "budgets"
+    __table_args__ = (
+        # Бюджеты удаляемой категории находятся по индексу, а не перебором всех бюджетов
+        Index("ix_budgets_category_id", "category_id"),
+    )
+
+    context_id: Mapped[int] = mapped_column(ForeignKey("contexts.id", ondelete="CASCADE"), primary_key=True)     # Контекст (чат)
+    category_id: Mapped[int] = mapped_column(ForeignKey("categories.id", ondelete="CASCADE"), primary_key=True)  # Категория
+    period: Mapped[str] = mapped_column()                                                                        # 'month' или 'week'
+    amount: Mapped[Decimal] = mapped_column()                                                                    # Лимит на период
+
+class BudgetSpending(Base):
+    """
+    Счетчик расходов категории с бюджетом за период. Обновляется в той же транзакции,
+    что и вставка/удаление операции, поэтому проверка лимита не пересчитывает историю.
+    """
+    __tablename__ = "budget_spending"
+    __table_args__ = (
+        # Счетчики хранятся по каждому периоду, их больше, чем бюджетов: каскад по категории — по индексу
+        Index("ix_budget_spending_category_id", "category_id"),
+    )
+
+    context_id: Mapped[int] = mapped_column(ForeignKey("contexts.id", ondelete="CASCADE"), primary_key=True)     # Контекст (чат)
+    category_id: Mapped[int] = mapped_column(ForeignKey("categories.id", ondelete="CASCADE"), primary_key=True)  # Категория
+    period: Mapped[str] = mapped_column(primary_key=True)                                                        # 'month' или 'week'
+    period_start: Mapped[date] = mapped_column(primary_key=True)                                                 # Первый день периода
+    total: Mapped[Decimal] = mapped_column(default=0)                                                            # Расходы за период
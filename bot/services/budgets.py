@@ -0,0 +1,205 @@
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from bot.models.models import Budget, BudgetSpending
+
+BUDGET_PERIODS = ("month", "week")
+PERIOD_TEXT = {"month": "на месяц", "week": "на неделю"}
+# Пороги предупреждений, % лимита: сообщается старший из пересеченных одной операцией
+BUDGET_THRESHOLDS = (100, 80)
+# Время операций — московское (как в bot/handlers/finance.py)
+MOSCOW_TZ = timezone(timedelta(hours=3))
+
+
+def period_start(period: str, day: date) -> date:
+    """
+    Первый день периода бюджета, в который попадает день: 1-е число месяца или понедельник.
+    """
+    if period == "month":
+        return day.replace(day=1)
+    return day - timedelta(days=day.weekday())
+
+
+def next_period_start(period: str, start: date) -> date:
+    """
+    Первый день периода бюджета, следующего за периодом, который начинается в start.
+    """
+    if period == "month":
+        return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return start + timedelta(days=7)
+
+
+def budget_warning(title: str, period: str, threshold: int, spent: Decimal, limit: Decimal) -> str:
+    if threshold >= 100:
+        return f"❗ Бюджет «{title}» {PERIOD_TEXT[period]} превышен: {int(spent)} из {int(limit)}."
+    return f"⚠️ Бюджет «{title}» {PERIOD_TEXT[period]} израсходован на {threshold}%: {int(spent)} из {int(limit)}."
+
+
+class BudgetTracker:
+    """
+    Бюджеты и расходы текущего периода по ним в памяти процесса.
+    Проверка лимита при записи расхода — два обращения к словарям, без запросов к базе:
+    счетчики budget_spending обновляются в транзакции вставки (add_budget_spending),
+    а в память суммы попадают после коммита (add). При запуске состояние загружается из базы.
+    Все обновления чата обрабатывает один процесс (bot/services/sharding.py),
+    поэтому суммы в памяти не расходятся с базой.
+    """
+
+    def __init__(self):
+        # context_id -> {category_id: (период, лимит)}
+        self._budgets: dict[int, dict[int, tuple[str, Decimal]]] = {}
+        # (context_id, category_id) -> [начало периода, расходы за период]
+        self._spent: dict[tuple[int, int], list] = {}
+
+    def budget(self, context_id: int, category_id: int) -> tuple[str, Decimal] | None:
+        """
+        (период, лимит) бюджета категории или None, если бюджета нет.
+        """
+        budgets = self._budgets.get(context_id)
+        return budgets and budgets.get(category_id)
+
+    def budgets(self, context_id: int) -> dict[int, tuple[str, Decimal]]:
+        return self._budgets.get(context_id, {})
+
+    def spent(self, context_id: int, category_id: int, today: date) -> Decimal:
+        """
+        Расходы категории за текущий период бюджета.
+        """
+        budget = self.budget(context_id, category_id)
+        spent = self._spent.get((context_id, category_id))
+        if budget is None or spent is None or spent[0] != period_start(budget[0], today):
+            return Decimal(0)
+        return spent[1]
+
+    def set_budget(self, context_id: int, category_id: int, period: str, limit: Decimal,
+                   start: date, spent: Decimal):
+        self._budgets.setdefault(context_id, {})[category_id] = (period, limit)
+        self._spent[(context_id, category_id)] = [start, spent]
+
+    def remove_budget(self, context_id: int, category_id: int):
+        self._budgets.get(context_id, {}).pop(category_id, None)
+        self._spent.pop((context_id, category_id), None)
+
+    def move_category(self, context_id: int, old_category_id: int, new_category_id: int):
+        """
+        Переносит бюджет и сумму периода на другую категорию (копию шаблонной в контексте).
+        """
+        budget = self._budgets.get(context_id, {}).pop(old_category_id, None)
+        spent = self._spent.pop((context_id, old_category_id), None)
+        if budget is not None:
+            self._budgets[context_id][new_category_id] = budget
+        if spent is not None:
+            self._spent[(context_id, new_category_id)] = spent
+
+    def drop_context(self, context_id: int):
+        for category_id in self._budgets.pop(context_id, {}):
+            self._spent.pop((context_id, category_id), None)
+
+    def add(self, context_id: int, category_id: int, day: date, amount: Decimal,
+            today: date | None = None) -> tuple | None:
+        """
+        Прибавляет уже записанный расход (отрицательный amount — удаленный) к сумме периода.
+        Если расход пересек порог, возвращает (период, порог, сумма за период, лимит), иначе None.
+        """
+        budget = self.budget(context_id, category_id)
+        if budget is None:
+            return None
+        period, limit = budget
+        start = period_start(period, day)
+        spent = self._spent.setdefault((context_id, category_id), [start, Decimal(0)])
+        if start < spent[0]:
+            # Операция прошлого периода (импорт выписки) текущую сумму не меняет
+            return None
+        if start >= next_period_start(period, period_start(period, today or datetime.now(MOSCOW_TZ).date())):
+            # Операция будущего периода (импорт выписки с будущими датами) текущую сумму не меняет
+            return None
+        if start > spent[0]:
+            # Начался новый период
+            spent[0], spent[1] = start, Decimal(0)
+        before = spent[1]
+        spent[1] += amount
+        for threshold in BUDGET_THRESHOLDS:
+            bound = limit * threshold / 100
+            if before < bound <= spent[1]:
+                return period, threshold, spent[1], limit
+        return None
+
+    async def load(self, session: AsyncSession, today: date | None = None):
+        """
+        Загружает бюджеты и счетчики их текущих периодов (при запуске бота).
+        """
+        today = today or datetime.now(MOSCOW_TZ).date()
+        self._budgets.clear()
+        self._spent.clear()
+        for budget in (await session.execute(select(Budget))).scalars():
+            self.set_budget(
+                budget.context_id, budget.category_id, budget.period, budget.amount,
+                period_start(budget.period, today), Decimal(0),
+            )
+        starts = {period: period_start(period, today) for period in BUDGET_PERIODS}
+        counters = await session.execute(
+            select(BudgetSpending).where(BudgetSpending.period_start.in_(set(starts.values())))
+        )
+        for counter in counters.scalars():
+            budget = self.budget(counter.context_id, counter.category_id)
+            if budget and budget[0] == counter.period and starts[counter.period] == counter.period_start:
+                self._spent[(counter.context_id, counter.category_id)] = [counter.period_start, counter.total]
+
+
+async def add_budget_spending(session: AsyncSession, rows: list[tuple[int, int, date, Decimal]]) -> list[tuple]:
+    """
+    Прибавляет расходы (context_id, category_id, день, сумма) к счетчикам бюджетов одним запросом
+    (для удаления передаются отрицательные суммы). Категории без бюджета пропускаются без
+    обращения к базе. Не коммитит: вызывается в транзакции, которая вставляет или удаляет
+    сами операции. Возвращает учтенные строки — их нужно передать в budget_tracker.add после коммита.
+    """
+    counted = []
+    totals = defaultdict(Decimal)
+    for context_id, category_id, day, amount in rows:
+        budget = budget_tracker.budget(context_id, category_id)
+        if budget is None:
+            continue
+        counted.append((context_id, category_id, day, amount))
+        totals[(context_id, category_id, budget[0], period_start(budget[0], day))] += amount
+    if not totals:
+        return counted
+
+    stmt = insert(BudgetSpending).values([
+        {"context_id": context_id, "category_id": category_id, "period": period, "period_start": start, "total": total}
+        for (context_id, category_id, period, start), total in totals.items()
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[
+            BudgetSpending.context_id,
+            BudgetSpending.category_id,
+            BudgetSpending.period,
+            BudgetSpending.period_start,
+        ],
+        set_={"total": BudgetSpending.total + stmt.excluded.total},
+    )
+    await session.execute(stmt)
+    return counted
+
+
+def check_budget(context_id: int, category_id: int, title: str, day: date, amount: Decimal) -> str | None:
+    """
+    Учитывает записанный расход в памяти и возвращает предупреждение, если он пересек порог бюджета.
+    """
+    alert = budget_tracker.add(context_id, category_id, day, amount)
+    return alert and budget_warning(title, *alert)
+
+
+def apply_budget_spending(rows: list[tuple[int, int, date, Decimal]]):
+    """
+    Переносит учтенные add_budget_spending расходы в память (после коммита), без предупреждений.
+    """
+    for row in rows:
+        budget_tracker.add(*row)
+
+
+budget_tracker = BudgetTracker()
@@ -0,0 +1,218 @@
+import itertools
+import time
+from collections import OrderedDict
+
+from bot.config import settings
+
+
+class _Entry:
+    """
+    Запись кэша: значение и момент истечения срока жизни.
+    """
+    __slots__ = ("value", "expires_at")
+
+    def __init__(self, value, expires_at: float):
+        self.value = value
+        self.expires_at = expires_at
+
+
+class LRUCache:
+    """
+    Ограниченный по размеру кэш с вытеснением давно неиспользуемых записей (LRU)
+    и ограничением времени жизни записи (TTL).
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+
+    def get(self, key):
+        """
+        Возвращает значение по ключу или None, если записи нет или она устарела.
+        """
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return entry.value
+
+    def set(self, key, value):
+        """
+        Сохраняет значение и при переполнении вытесняет самую старую запись.
+        """
+        self._data[key] = _Entry(value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key):
+        self._data.pop(key, None)
+
+    def pop_where(self, predicate):
+        """
+        Удаляет все записи, ключ которых удовлетворяет условию.
+        """
+        for key in [k for k in self._data if predicate(k)]:
+            del self._data[key]
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class CachedCategory:
+    """
+    Компактное представление категории для кэша (вместо ORM-объекта).
+    """
+    __slots__ = ("id", "title")
+
+    def __init__(self, id: int, title: str):
+        self.id = id
+        self.title = title
+
+
+class CachedRef:
+    """
+    Компактная ссылка на строку БД, у которой нужен только первичный ключ.
+    """
+    __slots__ = ("id",)
+
+    def __init__(self, id: int):
+        self.id = id
+
+
+class CachedContext:
+    """
+    Контекст чата в кэше: id и настройки, которые нужны при записи операций.
+    """
+    __slots__ = ("id", "compact_confirmations", "purging")
+
+    def __init__(self, id: int, compact_confirmations: bool, purging: bool = False):
+        self.id = id
+        self.compact_confirmations = compact_confirmations
+        self.purging = purging
+
+
+def normalize_title(title: str) -> str:
+    """
+    Нормализует название категории для использования в качестве ключа.
+    """
+    return title.strip().casefold()
+
+
+class ResolverCache:
+    """
+    Кэш сопоставлений, которые нужны при каждой записи расхода/дохода:
+      - tg_id -> User.id
+      - (chat.id, chat.type) -> Context.id
+      - (Context.id, нормализованное название) -> Category
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.users = LRUCache(maxsize, ttl)
+        self.contexts = LRUCache(maxsize, ttl)
+        self.categories = LRUCache(maxsize, ttl)
+
+    def invalidate_categories(self, context_id: int):
+        """
+        Сбрасывает закэшированные категории контекста (после /add, /del).
+        """
+        self.categories.pop_where(lambda key: key[0] == context_id)
+
+    def invalidate_context(self, chat_id: int, chat_type: str, context_id: int | None = None):
+        """
+        Сбрасывает контекст чата и его категории (после /clearcontext).
+        """
+        self.contexts.pop((chat_id, chat_type))
+        if context_id is not None:
+            self.invalidate_categories(context_id)
+
+    def clear(self):
+        self.users.clear()
+        self.contexts.clear()
+        self.categories.clear()
+
+
+class StatsGenerations:
+    """
+    Поколения данных статистики по контекстам и пользователям (в пределах процесса;
+    обновления одного чата всегда обрабатывает один процесс).
+    Кэш результатов хранит поколение, при котором результат посчитан, и при несовпадении
+    считает запись устаревшей. Все поколения берутся из одного счетчика, поэтому ключ,
+    вытесненный из LRU и созданный заново, не совпадет ни с одним старым значением.
+    """
+
+    def __init__(self, maxsize: int):
+        self._counter = itertools.count(1)
+        self._contexts = LRUCache(maxsize, float("inf"))
+        self._users = LRUCache(maxsize, float("inf"))
+
+    def _get(self, cache: LRUCache, key) -> int:
+        generation = cache.get(key)
+        if generation is None:
+            generation = next(self._counter)
+            cache.set(key, generation)
+        return generation
+
+    def current(self, context_id: int, user_id: int) -> tuple[int, int]:
+        """
+        Текущее поколение данных пользователя в контексте.
+        """
+        return self._get(self._contexts, context_id), self._get(self._users, (context_id, user_id))
+
+    def bump(self, context_id: int, user_id: int | None = None):
+        """
+        Отмечает изменение данных пользователя (операция добавлена или удалена)
+        или всего контекста, если user_id не задан (изменились категории).
+        """
+        if user_id is None:
+            self._contexts.set(context_id, next(self._counter))
+        else:
+            self._users.set((context_id, user_id), next(self._counter))
+
+
+class ResultCache:
+    """
+    Кэш вычисленных результатов (статистика, диаграммы), привязанных к поколению данных
+    из StatsGenerations: запись с другим поколением считается промахом.
+    Считает попадания и промахи.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._cache = LRUCache(maxsize, ttl)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, generation):
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] == generation:
+            self.hits += 1
+            return cached[1]
+        self.misses += 1
+        return None
+
+    def set(self, key, generation, value):
+        self._cache.set(key, (generation, value))
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._cache),
+        }
+
+
+resolver_cache = ResolverCache(
+    maxsize=settings.resolver_cache_size,
+    ttl=settings.resolver_cache_ttl,
+)
+
+stats_generations = StatsGenerations(maxsize=settings.resolver_cache_size)
@@ -0,0 +1,117 @@
+import asyncio
+import importlib.util
+import io
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from bot.config import settings
+from bot.services.cache import ResultCache
+from bot.utils.logger import logger
+
+# На круговой диаграмме остальные категории объединяются в "прочее"
+PIE_MAX_SLICES = 8
+
+
+class ChartQueueFull(Exception):
+    """
+    В очереди отрисовки уже chart_max_pending задач.
+    """
+
+
+def charts_available() -> bool:
+    """
+    Диаграммы строятся только при установленном matplotlib.
+    """
+    return importlib.util.find_spec("matplotlib") is not None
+
+
+def render_charts(title: str, rows: list[tuple[str, float]]) -> tuple[bytes, bytes]:
+    """
+    Рисует круговую и столбчатую диаграммы расходов по категориям и возвращает два PNG.
+    Выполняется в процессе пула: matplotlib импортируется только там.
+    """
+    import matplotlib
+
+    matplotlib.use("Agg")
+    from matplotlib import pyplot as plt
+
+    pie_rows = rows[:PIE_MAX_SLICES]
+    rest = sum(amount for _, amount in rows[PIE_MAX_SLICES:])
+    if rest:
+        pie_rows = pie_rows + [("прочее", rest)]
+
+    figure, axes = plt.subplots(figsize=(7, 7))
+    axes.pie(
+        [amount for _, amount in pie_rows],
+        labels=[label for label, _ in pie_rows],
+        autopct="%1.0f%%",
+        startangle=90,
+        counterclock=False,
+    )
+    axes.set_title(title)
+    pie = _to_png(figure)
+    plt.close(figure)
+
+    figure, axes = plt.subplots(figsize=(8, max(3, 0.4 * len(rows) + 1)))
+    labels = [label for label, _ in reversed(rows)]
+    values = [amount for _, amount in reversed(rows)]
+    axes.barh(labels, values)
+    # Место справа для подписей сумм
+    axes.margins(x=0.12)
+    for y, value in enumerate(values):
+        axes.text(value, y, f" {value:,.0f}".replace(",", " "), va="center")
+    axes.set_title(title)
+    figure.tight_layout()
+    bar = _to_png(figure)
+    plt.close(figure)
+    return pie, bar
+
+
+def _to_png(figure) -> bytes:
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format="png", dpi=100)
+    return buffer.getvalue()
+
+
+class ChartRenderer:
+    """
+    Отрисовка диаграмм в пуле процессов: CPU-нагрузка не попадает в event loop.
+    Число задач в работе и в очереди ограничено max_pending, лишние запросы отклоняются.
+    Пул создается при первой отрисовке.
+    """
+
+    def __init__(self, max_workers: int, max_pending: int):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._pending = 0
+        self._executor: ProcessPoolExecutor | None = None
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    async def render(self, title: str, rows: list[tuple[str, float]]) -> tuple[bytes, bytes]:
+        if self._pending >= self.max_pending:
+            raise ChartQueueFull()
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, render_charts, title, rows)
+        finally:
+            self._pending -= 1
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+            logger.info("Пул отрисовки диаграмм остановлен")
+
+
+chart_renderer = ChartRenderer(max_workers=settings.chart_workers, max_pending=settings.chart_max_pending)
+
+# Готовые диаграммы по ключу (context_id, user_id, начало периода, описание периода)
+chart_cache = ResultCache(maxsize=settings.chart_cache_size, ttl=settings.chart_cache_ttl)
@@ -0,0 +1,177 @@
+import asyncio
+import html
+import re
+from datetime import datetime
+from decimal import Decimal
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, Message
+
+from bot.config import settings
+from bot.services.cache import LRUCache
+from bot.utils.logger import logger
+
+SUMMARY_HEADER = "Добавленные операции:"
+BUTTONS_PER_ROW = 5
+
+
+class SummaryEntry:
+    """
+    Операция в сводке подтверждений.
+    """
+    __slots__ = ("kind", "record_id", "amount", "title", "user_display", "created_at", "deleted")
+
+    def __init__(self, kind: str, record_id: int, amount: Decimal, title: str,
+                 user_display: str, created_at: datetime):
+        self.kind = kind
+        self.record_id = record_id
+        self.amount = amount
+        self.title = title
+        self.user_display = user_display
+        self.created_at = created_at
+        self.deleted = False
+
+    @property
+    def callback_data(self) -> str:
+        return f"delete_{self.kind}:{self.record_id}"
+
+    def line(self) -> str:
+        line = (
+            f"{'Расход' if self.kind == 'expense' else 'Доход'} {self.amount} — {html.escape(self.title)}, "
+            f"{html.escape(self.user_display)}, {self.created_at.strftime('%H:%M')}"
+        )
+        return f"<s>{line}</s>" if self.deleted else line
+
+
+class Summary:
+    """
+    Сообщение-сводка одного контекста: операции, отправленное сообщение и отложенная правка.
+    """
+    __slots__ = ("chat_id", "message_id", "entries", "sent", "flush_task")
+
+    def __init__(self, chat_id: int, entry: SummaryEntry):
+        self.chat_id = chat_id
+        self.message_id: int | None = None
+        self.entries = [entry]
+        self.sent = asyncio.Event()
+        self.flush_task: asyncio.Task | None = None
+
+
+def render_summary(entries: list[SummaryEntry]) -> tuple[str, InlineKeyboardMarkup | None]:
+    """
+    Текст сводки с пронумерованными операциями и кнопки удаления по номерам.
+    """
+    lines = [SUMMARY_HEADER]
+    buttons = []
+    for number, entry in enumerate(entries, 1):
+        lines.append(f"{number}. {entry.line()}")
+        if not entry.deleted:
+            buttons.append(InlineKeyboardButton(text=f"❌ {number}", callback_data=entry.callback_data))
+    rows = [buttons[i:i + BUTTONS_PER_ROW] for i in range(0, len(buttons), BUTTONS_PER_ROW)]
+    return "\n".join(lines), InlineKeyboardMarkup(inline_keyboard=rows) if rows else None
+
+
+class ConfirmationCoalescer:
+    """
+    Объединяет подтверждения операций контекста за window секунд в одно сообщение-сводку.
+    Первая операция отправляет сводку, следующие дописываются в нее одной правкой
+    не чаще раза в flush_delay секунд, поэтому серия операций в группе обходится
+    в одно сообщение и несколько правок вместо сообщения на каждую операцию.
+    В сводке не больше max_entries операций, дальше начинается новая.
+    Сводки хранятся в памяти процесса: обновления одного чата обрабатывает один процесс.
+    """
+
+    def __init__(self, window: float, flush_delay: float, max_entries: int, max_contexts: int = 10000):
+        self.window = window
+        self.flush_delay = flush_delay
+        self.max_entries = max_entries
+        # Сводка, в которую еще можно дописывать, по id контекста
+        self._summaries = LRUCache(max_contexts, window)
+        # Сводки с отложенной правкой (в том числе уже закрытые для новых операций)
+        self._pending: set[Summary] = set()
+
+    async def add(self, bot: Bot, chat_id: int, context_id: int, entry: SummaryEntry):
+        summary = self._summaries.get(context_id)
+        if summary is not None and len(summary.entries) < self.max_entries:
+            summary.entries.append(entry)
+            if summary.flush_task is None:
+                summary.flush_task = asyncio.create_task(self._flush_later(bot, summary))
+                self._pending.add(summary)
+            return
+
+        summary = Summary(chat_id, entry)
+        self._summaries.set(context_id, summary)
+        text, keyboard = render_summary(summary.entries)
+        try:
+            message = await bot.send_message(chat_id, text, reply_markup=keyboard)
+            summary.message_id = message.message_id
+        except Exception:
+            self._summaries.pop(context_id)
+            raise
+        finally:
+            summary.sent.set()
+
+    async def _flush_later(self, bot: Bot, summary: Summary):
+        await asyncio.sleep(self.flush_delay)
+        summary.flush_task = None
+        self._pending.discard(summary)
+        await self._flush(bot, summary)
+
+    async def _flush(self, bot: Bot, summary: Summary):
+        await summary.sent.wait()
+        if summary.message_id is None:
+            return
+        text, keyboard = render_summary(summary.entries)
+        try:
+            await bot.edit_message_text(
+                text, chat_id=summary.chat_id, message_id=summary.message_id, reply_markup=keyboard
+            )
+        except TelegramBadRequest as e:
+            # Сводку удалили из чата или она не изменилась
+            logger.warning(f"Не удалось обновить сводку в чате {summary.chat_id}: {e}")
+
+    def mark_deleted(self, context_id: int, message: Message, callback_data: str) -> tuple[str, InlineKeyboardMarkup | None]:
+        """
+        Отмечает операцию сводки удаленной и возвращает новый текст и кнопки.
+        Если сводка уже не в памяти (старое сообщение, перезапуск), правит текст сообщения.
+        """
+        for summary in (self._summaries.get(context_id), *self._pending):
+            if summary is not None and summary.message_id == message.message_id:
+                for entry in summary.entries:
+                    if entry.callback_data == callback_data:
+                        entry.deleted = True
+                return render_summary(summary.entries)
+
+        number = None
+        buttons = []
+        for row in message.reply_markup.inline_keyboard if message.reply_markup else []:
+            for button in row:
+                if button.callback_data == callback_data:
+                    number = button.text.split()[-1]
+                else:
+                    buttons.append(button)
+        lines = message.html_text.split("\n")
+        for i, line in enumerate(lines):
+            match = re.match(r"(\d+)\. (.*)", line)
+            if match and match.group(1) == number:
+                lines[i] = f"{number}. <s>{match.group(2)}</s>"
+        rows = [buttons[i:i + BUTTONS_PER_ROW] for i in range(0, len(buttons), BUTTONS_PER_ROW)]
+        return "\n".join(lines), InlineKeyboardMarkup(inline_keyboard=rows) if rows else None
+
+    async def stop(self, bot: Bot):
+        """
+        Сразу дописывает отложенные правки сводок (при остановке бота).
+        """
+        for summary in list(self._pending):
+            summary.flush_task.cancel()
+            summary.flush_task = None
+            self._pending.discard(summary)
+            await self._flush(bot, summary)
+
+
+confirmation_summaries = ConfirmationCoalescer(
+    window=settings.confirmation_window,
+    flush_delay=settings.confirmation_flush_delay,
+    max_entries=settings.confirmation_max_entries,
+)
@@ -1,9 +1,25 @@
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncConnection, create_async_engine, async_sessionmaker
+from sqlalchemy.orm import Session
 
 from bot.config import settings
+from bot.utils.logger import logger
 
-# Создание асинхронного движка базы данных с использованием URL из настроек
-engine = create_async_engine(settings.database_url, echo=False)
+# Размер пула задается только для серверных СУБД: SQLite (тесты в CI) использует
+# StaticPool/NullPool, которые не принимают pool_size и max_overflow
+pool_options = {}
+if make_url(settings.database_url).get_backend_name() != "sqlite":
+    pool_options = {"pool_size": settings.db_pool_size, "max_overflow": settings.db_max_overflow}
+
+# Создание асинхронного движка базы данных с использованием URL из настроек.
+# Движок создается при импорте, поэтому у каждого процесса-воркера (см. bot/services/sharding.py)
+# свой движок и свой пул соединений размером db_pool_size.
+engine = create_async_engine(
+    settings.database_url,
+    echo=False,
+    **pool_options,
+)
 
 # Создание фабрики асинхронных сессий
 AsyncSessionLocal = async_sessionmaker(engine, expire_on_commit=False)
@@ -11,3 +27,45 @@ AsyncSessionLocal = async_sessionmaker(engine, expire_on_commit=False)
 # Функция для получения новой асинхронной сессии
 def get_async_session():
     return AsyncSessionLocal()
+
+# Регистрирует действие, которое выполнится после успешного коммита транзакции сессии
+# (например, сброс кэша, который не должен увидеть незакоммиченные данные)
+def after_commit(session, callback):
+    session.info.setdefault("after_commit", []).append(callback)
+
+# Действия выполняются при любом коммите сессии — в конце обновления (DbSessionMiddleware)
+# или явном в обработчике, даже если обработчик потом упадет
+@event.listens_for(Session, "after_commit")
+def _run_after_commit(session):
+    for callback in session.info.pop("after_commit", []):
+        try:
+            callback()
+        except Exception as e:
+            logger.error(f"Ошибка в after_commit: {e}")
+
+# Действия откатанной транзакции не выполняются
+@event.listens_for(Session, "after_rollback")
+def _drop_after_commit(session):
+    session.info.pop("after_commit", None)
+
+# Ключ advisory-блокировки единственного экземпляра бота (произвольная константа)
+INSTANCE_LOCK_KEY = 7_424_001
+
+async def acquire_instance_lock() -> AsyncConnection | None:
+    """
+    Проверяет, что бот с этой базой запущен в одном экземпляре (main.py или supervisor.py).
+    Кэши статистики, сводки подтверждений, счетчики бюджетов и возобновление очисток хранятся
+    в памяти процесса, поэтому несколько реплик за балансировщиком webhook нарушили бы их
+    согласованность — масштабировать нужно воркерами supervisor.py.
+    Держит advisory-блокировку на отдельном соединении; его нужно закрыть при остановке.
+    """
+    if make_url(settings.database_url).get_backend_name() == "sqlite":
+        return None
+    connection = await engine.connect()
+    # Блокировка уровня сессии: соединение не держит открытую транзакцию
+    await connection.execution_options(isolation_level="AUTOCOMMIT")
+    locked = (await connection.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": INSTANCE_LOCK_KEY})).scalar()
+    if not locked:
+        await connection.close()
+        raise RuntimeError("Бот с этой базой уже запущен: для масштабирования используйте supervisor.py --workers N")
+    return connection
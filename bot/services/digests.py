@@ -0,0 +1,201 @@
+import asyncio
+import html
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramForbiddenError
+from sqlalchemy import delete, text
+
+from bot.config import settings
+from bot.middlewares.outgoing import PRIORITY_BACKGROUND, send_priority
+from bot.models.models import DigestSubscription
+from bot.services.db import AsyncSessionLocal
+from bot.utils.logger import logger
+
+DIGEST_PERIODS = ("day", "week")
+
+# Одна порция рассылки — один запрос: подписки, по которым пора отправить сводку, помечаются
+# отправленными (SKIP LOCKED — параллельные воркеры берут разные чаты), и для всех них сразу
+# считаются суммы по категориям из дневного агрегата. Контекст без операций за период
+# возвращается одной строкой с NULL, чтобы было видно, сколько подписок забрано
+CLAIM_DIGESTS = """
+WITH claimed AS (
+    UPDATE digest_subscriptions AS s SET last_sent_on = :period_end
+    FROM contexts AS c
+    WHERE c.id = s.context_id AND (s.context_id, s.period) IN (
+        SELECT due.context_id, due.period FROM digest_subscriptions AS due
+        JOIN contexts AS due_context ON due_context.id = due.context_id
+        WHERE due.period = :period
+          AND (due.last_sent_on IS NULL OR due.last_sent_on < :period_end)
+          AND NOT due_context.purging{shard}
+        LIMIT :limit
+        FOR UPDATE OF due SKIP LOCKED
+    )
+    RETURNING s.context_id, c.context_id AS chat_id
+)
+SELECT claimed.context_id, claimed.chat_id, t.kind, cat.title, sum(t.total) AS total
+FROM claimed
+LEFT JOIN (daily_totals AS t JOIN categories AS cat ON cat.id = t.category_id AND NOT cat.is_deleted)
+    ON t.context_id = claimed.context_id
+   AND t.day >= :period_start AND t.day < :period_end AND t.count > 0
+GROUP BY claimed.context_id, claimed.chat_id, t.kind, cat.title
+ORDER BY claimed.context_id, t.kind, total DESC
+"""
+# Чаты воркера при распределении по процессам: то же, что shard_for, с остатком как в Python
+SHARD_FILTER = "\n          AND ((due_context.context_id % :workers) + :workers) % :workers = :shard"
+
+
+def digest_period(period: str, today: date) -> tuple[date, date]:
+    """
+    Последний завершенный период сводки: вчера для 'day', прошлая неделя (с понедельника) для 'week'.
+    Возвращает (первый день, день после последнего).
+    """
+    if period == "day":
+        return today - timedelta(days=1), today
+    monday = today - timedelta(days=today.weekday())
+    return monday - timedelta(days=7), monday
+
+
+def format_digest(period: str, period_start: date, period_end: date,
+                  rows: list[tuple[str, str, Decimal]]) -> str | None:
+    """
+    Текст сводки чата по строкам (kind, название категории, сумма). None — операций за период не было.
+    """
+    if not rows:
+        return None
+    last_day = period_end - timedelta(days=1)
+    if period == "day":
+        header = f"Сводка за {last_day.strftime('%d.%m.%Y')}"
+    else:
+        header = f"Сводка за неделю {period_start.strftime('%d.%m.%Y')} - {last_day.strftime('%d.%m.%Y')}"
+    message_text = f"📊 {header}\n"
+    for kind, title in (("income", "🟢 Доход"), ("expense", "🔴 Расход")):
+        kind_rows = [(category, amount) for row_kind, category, amount in rows if row_kind == kind]
+        if not kind_rows:
+            continue
+        message_text += f"\n{title}:\n- - - - - - - - - -\n"
+        message_text += "\n".join(f"{int(amount)} {html.escape(category)}" for category, amount in kind_rows)
+        message_text += f"\n- - - - - - - - - -\nИтого: {int(sum(amount for _, amount in kind_rows))}\n"
+    return message_text
+
+
+class DigestScheduler:
+    """
+    Рассылка сводок (/digest) по расписанию. Раз в check_interval секунд, начиная с часа hour,
+    забирает порцию из batch_size подписок, по которым пора отправить сводку, одним
+    сгруппированным запросом к дневному агрегату (а не запросом статистики на каждый чат)
+    и рассылает ее не больше чем concurrency сообщениями одновременно. Сообщения идут
+    с фоновым приоритетом через ограничитель исходящих сообщений: ответы пользователям
+    не ждут рассылку, а лимиты Telegram соблюдаются. Следующая порция забирается, когда
+    разослана предыдущая, поэтому рассылка не держит в памяти все чаты сразу.
+    Подписка помечается отправленной до отправки: после сбоя сводка не повторяется.
+    """
+
+    def __init__(self, session_factory=AsyncSessionLocal, hour: int = 9, check_interval: float = 60,
+                 batch_size: int = 1000, concurrency: int = 50):
+        self.session_factory = session_factory
+        self.hour = hour
+        self.check_interval = check_interval
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self._task: asyncio.Task | None = None
+
+    def start(self, bot: Bot, shard: tuple[int, int] | None = None):
+        """
+        Запускает рассылку. shard — (номер воркера, число воркеров): воркер рассылает сводки своим чатам.
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(bot, shard))
+
+    async def _run(self, bot: Bot, shard: tuple[int, int] | None):
+        while True:
+            try:
+                await self.tick(bot, datetime.now(), shard)
+            except Exception as e:
+                logger.exception(f"Ошибка рассылки сводок: {e}")
+            await asyncio.sleep(self.check_interval)
+
+    async def tick(self, bot: Bot, now: datetime, shard: tuple[int, int] | None = None) -> int:
+        """
+        Рассылает все сводки, которые пора отправить. Возвращает число отправленных сообщений.
+        """
+        if now.hour < self.hour:
+            return 0
+        sent = 0
+        for period in DIGEST_PERIODS:
+            period_start, period_end = digest_period(period, now.date())
+            while True:
+                digests, claimed = await self._claim(period, period_start, period_end, shard)
+                sent += await self._send_all(bot, period, period_start, period_end, digests)
+                if claimed < self.batch_size:
+                    break
+        return sent
+
+    async def _claim(self, period: str, period_start: date, period_end: date,
+                     shard: tuple[int, int] | None) -> tuple[dict, int]:
+        """
+        Забирает порцию подписок. Возвращает строки сводок по чатам (context_id, chat_id) и число подписок.
+        """
+        params = {"period": period, "period_start": period_start, "period_end": period_end, "limit": self.batch_size}
+        statement = CLAIM_DIGESTS.format(shard=SHARD_FILTER if shard else "")
+        if shard:
+            params["shard"], params["workers"] = shard
+        async with self.session_factory() as session:
+            result = (await session.execute(text(statement), params)).all()
+            await session.commit()
+        digests: dict[tuple[int, int], list] = {}
+        for context_id, chat_id, kind, title, total in result:
+            rows = digests.setdefault((context_id, chat_id), [])
+            if kind is not None:
+                rows.append((kind, title, total))
+        return digests, len(digests)
+
+    async def _send_all(self, bot: Bot, period: str, period_start: date, period_end: date, digests: dict) -> int:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        gone: list[int] = []
+
+        async def send(context_id: int, chat_id: int, message_text: str) -> bool:
+            # Рассылка уступает ответам пользователям в очереди исходящих сообщений
+            send_priority.set(PRIORITY_BACKGROUND)
+            async with semaphore:
+                try:
+                    await bot.send_message(chat_id, message_text)
+                    return True
+                except TelegramForbiddenError:
+                    # Бота удалили из чата или заблокировали: подписка больше не нужна
+                    gone.append(context_id)
+                except TelegramAPIError as e:
+                    logger.warning(f"Не удалось отправить сводку в чат {chat_id}: {e}")
+                return False
+
+        sends = []
+        for (context_id, chat_id), rows in digests.items():
+            message_text = format_digest(period, period_start, period_end, rows)
+            if message_text is not None:
+                sends.append(send(context_id, chat_id, message_text))
+        results = await asyncio.gather(*sends)
+
+        if gone:
+            async with self.session_factory() as session:
+                await session.execute(delete(DigestSubscription).where(DigestSubscription.context_id.in_(gone)))
+                await session.commit()
+        return sum(results)
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+
+digest_scheduler = DigestScheduler(
+    hour=settings.digest_hour,
+    check_interval=settings.digest_check_interval,
+    batch_size=settings.digest_batch_size,
+    concurrency=settings.digest_concurrency,
+)
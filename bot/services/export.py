@@ -0,0 +1,131 @@
+import asyncio
+import csv
+import io
+from datetime import datetime
+from tempfile import SpooledTemporaryFile
+
+from aiogram.types import InputFile
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from bot.config import settings
+from bot.models.models import Category, Operation
+
+try:
+    from openpyxl import Workbook
+except ImportError:  # XLSX доступен только при установленном openpyxl
+    Workbook = None
+
+HEADER = ("Дата", "Тип", "Сумма", "Категория")
+KIND_TITLES = {"income": "доход", "expense": "расход"}
+
+
+def export_formats() -> tuple[str, ...]:
+    """
+    Доступные форматы выгрузки.
+    """
+    return ("csv", "xlsx") if Workbook else ("csv",)
+
+
+def _export_query(context_id: int, user_id: int, date_from: datetime | None, date_to: datetime | None):
+    """
+    Операции пользователя в контексте за период (или за все время) в порядке времени.
+    """
+    conditions = [Operation.context_id == context_id, Operation.user_id == user_id]
+    if date_from is not None:
+        conditions += [Operation.created_at >= date_from, Operation.created_at < date_to]
+    return (
+        select(Operation.created_at, Operation.kind, Operation.amount, Category.title)
+        .join(Category, Category.id == Operation.category_id)
+        .where(*conditions)
+        .order_by(Operation.created_at)
+    )
+
+
+class CsvExportWriter:
+    """
+    Пишет строки в CSV (UTF-8 с BOM, чтобы Excel правильно определил кодировку).
+    """
+
+    def __init__(self, file):
+        self._text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="", write_through=True)
+        self._writer = csv.writer(self._text, delimiter=";")
+        self._writer.writerow(HEADER)
+
+    def write_rows(self, rows):
+        self._writer.writerows(
+            (created_at.strftime("%d.%m.%Y %H:%M"), KIND_TITLES[kind], amount, title)
+            for created_at, kind, amount, title in rows
+        )
+
+    def close(self):
+        self._text.flush()
+        # Файл остается открытым для отправки
+        self._text.detach()
+
+
+class XlsxExportWriter:
+    """
+    Пишет строки в XLSX через write-only книгу openpyxl: строки не копятся в памяти.
+    """
+
+    def __init__(self, file):
+        self._file = file
+        self._workbook = Workbook(write_only=True)
+        self._sheet = self._workbook.create_sheet("Операции")
+        self._sheet.append(HEADER)
+
+    def write_rows(self, rows):
+        for created_at, kind, amount, title in rows:
+            self._sheet.append((created_at, KIND_TITLES[kind], amount, title))
+
+    def close(self):
+        self._workbook.save(self._file)
+
+
+class SpooledInputFile(InputFile):
+    """
+    Файл для отправки в Telegram из временного файла; читается частями вне event loop.
+    """
+
+    def __init__(self, file, filename: str):
+        super().__init__(filename=filename)
+        self._file = file
+
+    async def read(self, bot):
+        await asyncio.to_thread(self._file.seek, 0)
+        while chunk := await asyncio.to_thread(self._file.read, self.chunk_size):
+            yield chunk
+
+
+async def export_operations(
+    session: AsyncSession,
+    fmt: str,
+    context_id: int,
+    user_id: int,
+    date_from: datetime | None = None,
+    date_to: datetime | None = None,
+) -> tuple[SpooledTemporaryFile, int]:
+    """
+    Выгружает операции во временный файл (в памяти до export_spool_size байт, дальше на диске).
+    Строки читаются серверным курсором порциями по export_chunk_size, а кодируются
+    в отдельном потоке, поэтому память не растет с числом строк и event loop не блокируется.
+    Возвращает файл и число выгруженных строк; закрыть файл должен вызывающий код.
+    """
+    file = SpooledTemporaryFile(max_size=settings.export_spool_size)
+    try:
+        writer_class = XlsxExportWriter if fmt == "xlsx" else CsvExportWriter
+        writer = await asyncio.to_thread(writer_class, file)
+        result = await session.stream(
+            _export_query(context_id, user_id, date_from, date_to),
+            execution_options={"yield_per": settings.export_chunk_size},
+        )
+        count = 0
+        async for rows in result.partitions():
+            await asyncio.to_thread(writer.write_rows, rows)
+            count += len(rows)
+        await asyncio.to_thread(writer.close)
+    except BaseException:
+        file.close()
+        raise
+    return file, count
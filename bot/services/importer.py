@@ -0,0 +1,231 @@
+import csv
+import io
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from tempfile import SpooledTemporaryFile
+from typing import NamedTuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from bot.config import settings
+from bot.services.budgets import add_budget_spending, apply_budget_spending
+from bot.services.cache import normalize_title
+from bot.services.db import after_commit
+from bot.services.rollup import add_daily_totals
+from bot.services.utils import get_categories_by_titles
+
+# Поля выписки и названия колонок, по которым они определяются автоматически
+FIELD_ALIASES = {
+    "date": ("дата", "дата операции", "дата платежа", "date"),
+    "amount": ("сумма", "сумма операции", "сумма платежа", "amount"),
+    "category": ("категория", "category"),
+    "sign": ("тип", "тип операции", "type", "kind"),
+}
+# Названия полей в аргументах /import
+FIELD_NAMES = {"дата": "date", "сумма": "amount", "категория": "category", "тип": "sign"}
+
+INCOME_SIGNS = ("доход", "income", "+", "пополнение", "зачисление")
+EXPENSE_SIGNS = ("расход", "expense", "-", "списание", "покупка")
+
+DATE_FORMATS = (
+    "%d.%m.%Y %H:%M:%S",
+    "%d.%m.%Y %H:%M",
+    "%d.%m.%Y",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y-%m-%d",
+)
+
+# Колонки COPY в порядке значений в кортежах, которые собирает import_operations
+COPY_COLUMNS = ("kind", "user_id", "context_id", "category_id", "amount", "created_at")
+
+
+class StatementError(Exception):
+    """
+    Файл нельзя импортировать целиком (нет нужных колонок, слишком много строк и т.п.).
+    """
+
+
+class ImportRow(NamedTuple):
+    kind: str
+    created_at: datetime
+    amount: Decimal
+    title: str
+    line: list[str]
+
+
+class ParsedStatement(NamedTuple):
+    header: list[str]
+    rows: list[ImportRow]
+    failed: list[tuple[list[str], str]]
+
+
+def parse_mapping(args: str) -> dict[str, str]:
+    """
+    Разбирает явное сопоставление колонок из аргументов /import,
+    например "дата=Дата платежа; сумма=Сумма в рублях".
+    """
+    mapping = {}
+    for part in args.split(";"):
+        if "=" not in part:
+            continue
+        field, column = (p.strip() for p in part.split("=", 1))
+        field = FIELD_NAMES.get(field.lower(), field.lower())
+        if field in FIELD_ALIASES and column:
+            mapping[field] = column
+    return mapping
+
+
+def _decode(data: bytes) -> str:
+    # Банки выгружают выписки в UTF-8 или в Windows-1251
+    try:
+        return data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        return data.decode("cp1251")
+
+
+def _columns(header: list[str], mapping: dict[str, str]) -> dict[str, int]:
+    normalized = [column.strip().lower() for column in header]
+    columns = {}
+    for field, aliases in FIELD_ALIASES.items():
+        names = (mapping[field].strip().lower(),) if field in mapping else aliases
+        for name in names:
+            if name in normalized:
+                columns[field] = normalized.index(name)
+                break
+    missing = [field for field in ("date", "amount", "category") if field not in columns]
+    if missing:
+        raise StatementError(
+            "Не найдены колонки: " + ", ".join(missing) + ". Колонки файла: " + ", ".join(header)
+        )
+    return columns
+
+
+def _parse_date(value: str) -> datetime:
+    value = value.strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    raise ValueError(f"неверная дата '{value}'")
+
+
+def _parse_amount(value: str) -> Decimal:
+    value = value.replace("\xa0", "").replace(" ", "").replace(",", ".")
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        raise ValueError(f"неверная сумма '{value}'") from None
+
+
+def _parse_kind(sign: str | None, amount: Decimal) -> str:
+    if sign is None:
+        # Без колонки типа знак суммы определяет операцию: списания в выписках отрицательные
+        return "expense" if amount < 0 else "income"
+    sign = sign.strip().lower()
+    if sign in INCOME_SIGNS:
+        return "income"
+    if sign in EXPENSE_SIGNS:
+        return "expense"
+    raise ValueError(f"неизвестный тип операции '{sign}'")
+
+
+def parse_statement(data: bytes, mapping: dict[str, str] | None = None) -> ParsedStatement:
+    """
+    Разбирает CSV-выписку. Синхронная функция: вызывается в отдельном потоке.
+    Строки с ошибками возвращаются отдельно вместе с причиной.
+    """
+    text = _decode(data)
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=";,\t")
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.reader(io.StringIO(text), dialect)
+    header = next(reader, None)
+    if not header:
+        raise StatementError("Файл пуст.")
+    columns = _columns(header, mapping or {})
+
+    rows, failed = [], []
+    for line in reader:
+        if not any(cell.strip() for cell in line):
+            continue
+        if len(rows) + len(failed) >= settings.import_max_rows:
+            raise StatementError(f"В файле больше {settings.import_max_rows} строк.")
+        try:
+            amount = _parse_amount(line[columns["amount"]])
+            kind = _parse_kind(line[columns["sign"]] if "sign" in columns else None, amount)
+            amount = abs(amount)
+            if amount == 0:
+                raise ValueError("нулевая сумма")
+            title = line[columns["category"]].strip()
+            if not title:
+                raise ValueError("пустая категория")
+            rows.append(ImportRow(kind, _parse_date(line[columns["date"]]), amount, title, line))
+        except IndexError:
+            failed.append((line, "не хватает колонок"))
+        except ValueError as e:
+            failed.append((line, str(e)))
+    return ParsedStatement(header, rows, failed)
+
+
+async def import_operations(
+    session: AsyncSession, rows: list[ImportRow], user_id: int, context
+) -> tuple[int, list[tuple[list[str], str]]]:
+    """
+    Загружает операции через COPY (asyncpg copy_records_to_table) в транзакции сессии
+    вместе с дневными агрегатами и счетчиками бюджетов. Категории разрешаются одним запросом.
+    Возвращает число загруженных строк и строки с неизвестными категориями.
+    """
+    categories = await get_categories_by_titles(session, {row.title for row in rows}, context)
+
+    records = []
+    totals = defaultdict(lambda: [Decimal(0), 0])
+    failed = []
+    for row in rows:
+        category = categories.get(normalize_title(row.title))
+        if not category:
+            failed.append((row.line, f"категория '{row.title}' не найдена"))
+            continue
+        records.append((row.kind, user_id, context.id, category.id, row.amount, row.created_at))
+        key = (row.kind, context.id, user_id, category.id, row.created_at.date())
+        totals[key][0] += row.amount
+        totals[key][1] += 1
+
+    if records:
+        connection = await session.connection()
+        raw_connection = await connection.get_raw_connection()
+        await raw_connection.driver_connection.copy_records_to_table(
+            "operations", records=records, columns=COPY_COLUMNS
+        )
+        totals = [(*key, total, count) for key, (total, count) in totals.items()]
+        # Ограничение на число параметров одного запроса в asyncpg — 32767
+        for start in range(0, len(totals), 1000):
+            await add_daily_totals(session, totals[start:start + 1000])
+        # Счетчиков не больше, чем категорий с бюджетом, умноженных на число периодов выписки
+        counted = await add_budget_spending(session, [
+            (context_id, category_id, day, total)
+            for kind, context_id, _, category_id, day, total, _ in totals if kind == "expense"
+        ])
+        if counted:
+            after_commit(session, lambda: apply_budget_spending(counted))
+
+    return len(records), failed
+
+
+def write_report(header: list[str], failed: list[tuple[list[str], str]]) -> SpooledTemporaryFile:
+    """
+    Пишет строки, которые не удалось импортировать, в CSV с колонкой причины.
+    Синхронная функция: вызывается в отдельном потоке.
+    """
+    file = SpooledTemporaryFile(max_size=settings.export_spool_size)
+    text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    writer = csv.writer(text, delimiter=";")
+    writer.writerow([*header, "Ошибка"])
+    writer.writerows([*line, reason] for line, reason in failed)
+    text.flush()
+    text.detach()
+    return file
+
@@ -0,0 +1,201 @@
+import asyncio
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy import delete, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from bot.config import settings
+from bot.models.models import Operation
+from bot.services.budgets import add_budget_spending, apply_budget_spending
+from bot.services.db import AsyncSessionLocal, after_commit
+from bot.services.rollup import add_daily_totals
+from bot.utils.logger import logger
+
+
+class PendingRecord:
+    """
+    Расход или доход, ожидающий записи в базу, и future для его id.
+    """
+    __slots__ = ("kind", "user_id", "context_id", "category_id", "amount", "created_at", "future")
+
+    def __init__(self, kind: str, user_id: int, context_id: int, category_id: int,
+                 amount: Decimal, created_at: datetime, future: asyncio.Future | None = None):
+        self.kind = kind
+        self.user_id = user_id
+        self.context_id = context_id
+        self.category_id = category_id
+        self.amount = amount
+        self.created_at = created_at
+        self.future = future
+
+    def values(self) -> dict:
+        return {
+            "kind": self.kind,
+            "user_id": self.user_id,
+            "context_id": self.context_id,
+            "category_id": self.category_id,
+            "amount": self.amount,
+            "created_at": self.created_at,
+        }
+
+
+class InsertBatcher:
+    """
+    Отложенная пакетная запись расходов и доходов.
+    Записи копятся не дольше max_latency секунд (или до max_batch_size штук)
+    и пишутся одним многострочным INSERT … RETURNING id в одной транзакции.
+    Очередь ограничена max_queue_size: при переполнении submit ждет (backpressure).
+    """
+
+    def __init__(self, session_factory=AsyncSessionLocal, max_batch_size: int = 100,
+                 max_latency: float = 0.005, max_queue_size: int = 1000):
+        self.session_factory = session_factory
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        self._task: asyncio.Task | None = None
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Дописывает все накопленные записи и останавливает фоновую задачу.
+        """
+        if self._task is None:
+            return
+        await self._queue.join()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        logger.info("Очередь записи операций сброшена в базу")
+
+    async def submit(self, kind: str, user_id: int, context_id: int, category_id: int,
+                     amount: Decimal, created_at: datetime) -> int:
+        """
+        Ставит операцию в очередь и ждет ее записи. Возвращает id созданной записи.
+        """
+        if self._task is None:
+            raise RuntimeError("InsertBatcher не запущен")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(
+            PendingRecord(kind, user_id, context_id, category_id, amount, created_at, future)
+        )
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_latency
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._flush(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _flush(self, batch: list[PendingRecord]):
+        try:
+            ids = await self._write(batch)
+        except Exception as e:
+            if len(batch) == 1:
+                logger.error(f"Ошибка записи операции: {e}")
+                if not batch[0].future.done():
+                    batch[0].future.set_exception(e)
+                return
+            # Одна ошибочная запись не должна ронять весь пакет — пишем по одной
+            logger.warning(f"Ошибка пакетной записи ({len(batch)} операций), повтор по одной: {e}")
+            for record in batch:
+                await self._flush([record])
+            return
+
+        for record in batch:
+            if not record.future.done():
+                record.future.set_result(ids[id(record)])
+
+    async def _write(self, batch: list[PendingRecord]) -> dict[int, int]:
+        """
+        Пишет пакет в одной транзакции.
+        """
+        async with self.session_factory() as session:
+            ids = await insert_operations(session, batch)
+            await session.commit()
+        return {id(record): record_id for record, record_id in zip(batch, ids)}
+
+
+async def insert_operations(session: AsyncSession, records: list[PendingRecord]) -> list[int]:
+    """
+    Пишет операции одним многострочным INSERT … RETURNING id
+    и обновляет дневные агрегаты одним запросом, а счетчики бюджетов — еще одним, если
+    у категорий расходов есть бюджет. Возвращает id в порядке записей.
+    Не коммитит; суммы бюджетов в памяти обновляет вызывающий код после коммита (budget_tracker.add).
+    """
+    result = await session.execute(
+        insert(Operation).returning(Operation.id, sort_by_parameter_order=True),
+        [record.values() for record in records],
+    )
+    ids = result.scalars().all()
+
+    totals = defaultdict(lambda: [Decimal(0), 0])
+    for record in records:
+        key = (record.kind, record.context_id, record.user_id, record.category_id, record.created_at.date())
+        totals[key][0] += record.amount
+        totals[key][1] += 1
+    await add_daily_totals(session, [(*key, total, count) for key, (total, count) in totals.items()])
+    await add_budget_spending(session, [
+        (record.context_id, record.category_id, record.created_at.date(), record.amount)
+        for record in records if record.kind == "expense"
+    ])
+    return ids
+
+
+async def delete_operations_at(session: AsyncSession, context_id: int, user_id: int, created_at: datetime) -> int:
+    """
+    Удаляет операции пользователя, записанные одним сообщением (у них общее время создания),
+    и вычитает их из дневных агрегатов и счетчиков бюджетов. Возвращает число удаленных операций.
+    Не коммитит.
+    """
+    result = await session.execute(
+        delete(Operation)
+        .where(Operation.context_id == context_id, Operation.user_id == user_id, Operation.created_at == created_at)
+        .returning(Operation.kind, Operation.category_id, Operation.amount)
+    )
+    totals = defaultdict(lambda: [Decimal(0), 0])
+    for kind, category_id, amount in result:
+        key = (kind, context_id, user_id, category_id, created_at.date())
+        totals[key][0] -= amount
+        totals[key][1] -= 1
+    if totals:
+        await add_daily_totals(session, [(*key, total, count) for key, (total, count) in totals.items()])
+        counted = await add_budget_spending(session, [
+            (context_id, category_id, day, total)
+            for (kind, _, _, category_id, day), (total, _) in totals.items() if kind == "expense"
+        ])
+        if counted:
+            after_commit(session, lambda: apply_budget_spending(counted))
+    return -sum(count for _, count in totals.values())
+
+
+insert_batcher = InsertBatcher(
+    max_batch_size=settings.ingest_batch_size,
+    max_latency=settings.ingest_max_latency_ms / 1000,
+    max_queue_size=settings.ingest_queue_size,
+)
@@ -0,0 +1,155 @@
+import re
+from datetime import date
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from bot.utils.logger import logger
+
+# Таблицы, секционированные по месяцам created_at
+PARTITIONED_TABLES = ("operations",)
+# Схема, в которую переносятся отсоединенные секции
+ARCHIVE_SCHEMA = "archive"
+
+PARTITION_NAME = re.compile(r"^(?P<table>\w+)_y(?P<year>\d{4})m(?P<month>\d{2})$")
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_y{month.year}m{month.month:02d}"
+
+
+def partitions_ddl(first_month: date, last_month: date) -> list[str]:
+    """
+    DDL секций по умолчанию и месячных секций с first_month по last_month для только что
+    созданных (Base.metadata.create_all) пустых таблиц операций — так схему готовят бенчмарки.
+    В рабочей базе секции создает миграция и manage.py partitions maintain.
+    """
+    statements = []
+    for table in PARTITIONED_TABLES:
+        statements.append(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+        month = first_month
+        while month <= last_month:
+            statements.append(
+                f"CREATE TABLE {partition_name(table, month)} PARTITION OF {table} "
+                f"FOR VALUES FROM ('{month}') TO ('{add_months(month, 1)}')"
+            )
+            month = add_months(month, 1)
+    return statements
+
+
+async def list_partitions(session: AsyncSession, table: str) -> dict[date, str]:
+    """
+    Месячные секции таблицы: {первый день месяца: имя секции}. Секция по умолчанию не входит.
+    """
+    result = await session.execute(
+        text(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE parent.relname = :table"
+        ),
+        {"table": table},
+    )
+    partitions = {}
+    for (name,) in result:
+        match = PARTITION_NAME.match(name)
+        if match and match.group("table") == table:
+            partitions[date(int(match.group("year")), int(match.group("month")), 1)] = name
+    return partitions
+
+
+async def create_partition(session: AsyncSession, table: str, month: date) -> str:
+    """
+    Создает секцию таблицы за месяц. Строки этого месяца, попавшие в секцию по умолчанию
+    (например, импорт старой выписки), переносятся в новую секцию.
+    Секция заполняется отдельно от таблицы и подключается через ATTACH PARTITION:
+    проверочное ограничение избавляет ATTACH от полного просмотра секции.
+    Не коммитит.
+    """
+    name = partition_name(table, month)
+    bounds = {"lower": month, "upper": add_months(month, 1)}
+    await session.execute(text(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS)"))
+    await session.execute(
+        text(
+            f"WITH moved AS (DELETE FROM {table}_default "
+            f"WHERE created_at >= :lower AND created_at < :upper RETURNING *) "
+            f"INSERT INTO {name} SELECT * FROM moved"
+        ),
+        bounds,
+    )
+    await session.execute(
+        text(
+            f"ALTER TABLE {name} ADD CONSTRAINT {name}_bounds "
+            f"CHECK (created_at >= '{bounds['lower']}' AND created_at < '{bounds['upper']}')"
+        )
+    )
+    await session.execute(
+        text(
+            f"ALTER TABLE {table} ATTACH PARTITION {name} "
+            f"FOR VALUES FROM ('{bounds['lower']}') TO ('{bounds['upper']}')"
+        )
+    )
+    await session.execute(text(f"ALTER TABLE {name} DROP CONSTRAINT {name}_bounds"))
+    return name
+
+
+async def ensure_partitions(session: AsyncSession, today: date, months_ahead: int) -> list[str]:
+    """
+    Создает секции на текущий месяц и months_ahead месяцев вперед, а также за месяцы,
+    строки которых лежат в секции по умолчанию. Каждая секция создается в своей транзакции.
+    Возвращает имена созданных секций.
+    """
+    created = []
+    for table in PARTITIONED_TABLES:
+        existing = await list_partitions(session, table)
+        result = await session.execute(
+            text(f"SELECT DISTINCT date_trunc('month', created_at)::date FROM {table}_default")
+        )
+        months = {month for (month,) in result}
+        current = month_start(today)
+        months.update(add_months(current, i) for i in range(months_ahead + 1))
+        for month in sorted(months - existing.keys()):
+            created.append(await create_partition(session, table, month))
+            await session.commit()
+            logger.info(f"Создана секция {created[-1]}")
+    return created
+
+
+async def archive_partitions(session: AsyncSession, today: date, retention_months: int,
+                             drop: bool = False) -> list[str]:
+    """
+    Отсоединяет секции месяцев старше retention_months и переносит их в схему archive
+    (или удаляет при drop=True). Дневные агрегаты за эти месяцы удаляются,
+    чтобы статистика и сверка rollup совпадали с оставшимися операциями.
+    Каждая секция обрабатывается в своей транзакции. Возвращает имена секций.
+    """
+    cutoff = add_months(month_start(today), -retention_months)
+    archived = []
+    await session.execute(text(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}"))
+    for table in PARTITIONED_TABLES:
+        for month, name in sorted((await list_partitions(session, table)).items()):
+            if month >= cutoff:
+                break
+            await session.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+            if drop:
+                await session.execute(text(f"DROP TABLE {name}"))
+            else:
+                await session.execute(text(f"ALTER TABLE {name} SET SCHEMA {ARCHIVE_SCHEMA}"))
+            await session.execute(
+                text("DELETE FROM daily_totals WHERE day >= :lower AND day < :upper"),
+                {"lower": month, "upper": add_months(month, 1)},
+            )
+            await session.commit()
+            archived.append(name)
+            logger.info(f"Секция {name} {'удалена' if drop else 'перенесена в ' + ARCHIVE_SCHEMA}")
+    await session.commit()
+    return archived
@@ -0,0 +1,163 @@
+import asyncio
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+from sqlalchemy import text
+from sqlalchemy.future import select
+
+from bot.config import settings
+from bot.middlewares.outgoing import PRIORITY_BACKGROUND, send_priority
+from bot.models.models import Context
+from bot.services.budgets import budget_tracker
+from bot.services.cache import resolver_cache, stats_generations
+from bot.services.db import AsyncSessionLocal
+from bot.utils.logger import logger
+
+# Порции удаления: каждая выбирает до :limit строк контекста по индексу с ведущим context_id
+# и удаляет их по ключу. Операции идут первыми: на категории ссылаются операции и агрегаты
+PURGE_STEPS = (
+    (
+        "operations",
+        "DELETE FROM operations WHERE (id, created_at) IN "
+        "(SELECT id, created_at FROM operations WHERE context_id = :context_id LIMIT :limit)",
+    ),
+    (
+        "daily_totals",
+        "DELETE FROM daily_totals WHERE (context_id, user_id, day, category_id, kind) IN "
+        "(SELECT context_id, user_id, day, category_id, kind FROM daily_totals "
+        "WHERE context_id = :context_id LIMIT :limit)",
+    ),
+    (
+        "budget_spending",
+        "DELETE FROM budget_spending WHERE (context_id, category_id, period, period_start) IN "
+        "(SELECT context_id, category_id, period, period_start FROM budget_spending "
+        "WHERE context_id = :context_id LIMIT :limit)",
+    ),
+    (
+        "budgets",
+        "DELETE FROM budgets WHERE (context_id, category_id) IN "
+        "(SELECT context_id, category_id FROM budgets WHERE context_id = :context_id LIMIT :limit)",
+    ),
+    (
+        "categories",
+        "DELETE FROM categories WHERE id IN "
+        "(SELECT id FROM categories WHERE context_id = :context_id LIMIT :limit)",
+    ),
+)
+
+PURGE_DONE = "Контекст, категории, расходы и доходы успешно удалены."
+PURGE_FAILED = "Очистка контекста прервана из-за ошибки. Повторите /clearcontext."
+PURGE_REJECTED = "Контекст этого чата очищается, новые операции не принимаются."
+
+
+def purge_progress(operations: int) -> str:
+    return f"Очистка контекста… Удалено операций: {operations}."
+
+
+class ContextPurger:
+    """
+    Фоновая очистка контекстов (/clearcontext). Строки удаляются порциями по batch_size,
+    каждая порция — отдельная короткая транзакция, поэтому очистка большой группы
+    не держит блокировки и не занимает обработчик обновления. Ход очистки показывается
+    правкой одного сообщения не чаще раза в progress_interval секунд.
+    Пока контекст помечен purging, новые операции в нем не принимаются; контекст удаляется
+    последним, и ON DELETE CASCADE дочищает строки, записанные до появления пометки.
+    """
+
+    def __init__(self, session_factory=AsyncSessionLocal, batch_size: int = 5000, progress_interval: float = 5):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.progress_interval = progress_interval
+        self._tasks: dict[int, asyncio.Task] = {}
+
+    def is_running(self, context_id: int) -> bool:
+        return context_id in self._tasks
+
+    def start(self, bot: Bot, context_id: int, chat_id: int, chat_type: str, message_id: int | None):
+        """
+        Запускает очистку контекста, уже помеченного purging. Повторный запуск не начинает вторую очистку.
+        """
+        if context_id in self._tasks:
+            return
+        task = asyncio.create_task(self._purge(bot, context_id, chat_id, chat_type, message_id))
+        self._tasks[context_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(context_id, None))
+
+    async def resume(self, bot: Bot, owns_chat=lambda chat_id: True):
+        """
+        Продолжает очистки, прерванные остановкой бота (контексты с пометкой purging).
+        owns_chat отбирает чаты этого процесса, когда обновления распределены между воркерами.
+        """
+        async with self.session_factory() as session:
+            contexts = (await session.execute(select(Context).where(Context.purging == True))).scalars().all()
+        for context in contexts:
+            if not owns_chat(context.context_id):
+                continue
+            message_id = None
+            try:
+                message = await bot.send_message(context.context_id, purge_progress(0))
+                message_id = message.message_id
+            except TelegramAPIError as e:
+                # Бота могли удалить из чата: очистка продолжается без сообщения о ходе
+                logger.warning(f"Не удалось сообщить об очистке в чат {context.context_id}: {e}")
+            self.start(bot, context.id, context.context_id, context.context_type, message_id)
+
+    async def _purge(self, bot: Bot, context_id: int, chat_id: int, chat_type: str, message_id: int | None):
+        # Правки хода очистки не должны задерживать ответы пользователям
+        send_priority.set(PRIORITY_BACKGROUND)
+        loop = asyncio.get_running_loop()
+        reported_at = loop.time()
+        operations = 0
+        try:
+            for table, statement in PURGE_STEPS:
+                while True:
+                    async with self.session_factory() as session:
+                        result = await session.execute(
+                            text(statement), {"context_id": context_id, "limit": self.batch_size}
+                        )
+                        await session.commit()
+                    if table == "operations":
+                        operations += result.rowcount
+                    if result.rowcount < self.batch_size:
+                        break
+                    if message_id is not None and loop.time() - reported_at >= self.progress_interval:
+                        reported_at = loop.time()
+                        await self._report(bot, chat_id, message_id, purge_progress(operations))
+            async with self.session_factory() as session:
+                await session.execute(text("DELETE FROM contexts WHERE id = :context_id"), {"context_id": context_id})
+                await session.commit()
+        except asyncio.CancelledError:
+            # Остановка бота: пометка purging остается, очистка продолжится после запуска
+            logger.info(f"Очистка контекста {context_id} приостановлена ({operations} операций удалено)")
+            raise
+        except Exception as e:
+            logger.exception(f"Ошибка очистки контекста {context_id}: {e}")
+            if message_id is not None:
+                await self._report(bot, chat_id, message_id, PURGE_FAILED)
+            return
+        finally:
+            resolver_cache.invalidate_context(chat_id, chat_type, context_id)
+            stats_generations.bump(context_id)
+            budget_tracker.drop_context(context_id)
+
+        logger.info(f"Контекст {context_id} очищен: {operations} операций удалено")
+        if message_id is not None:
+            await self._report(bot, chat_id, message_id, PURGE_DONE)
+
+    async def _report(self, bot: Bot, chat_id: int, message_id: int, message_text: str):
+        try:
+            await bot.edit_message_text(message_text, chat_id=chat_id, message_id=message_id)
+        except TelegramAPIError as e:
+            logger.warning(f"Не удалось обновить ход очистки в чате {chat_id}: {e}")
+
+    async def stop(self):
+        """
+        Приостанавливает очистки (при остановке бота): текущая порция откатывается.
+        """
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+context_purger = ContextPurger(batch_size=settings.purge_batch_size, progress_interval=settings.purge_progress_interval)
@@ -0,0 +1,154 @@
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import Date, and_, cast, func, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from bot.models.models import DailyTotal, Operation
+
+
+async def add_daily_total(
+    session: AsyncSession,
+    kind: str,
+    context_id: int,
+    user_id: int,
+    category_id: int,
+    day: date,
+    amount: Decimal,
+    count: int = 1,
+):
+    """
+    Прибавляет операцию к дневному агрегату (для удаления передаются отрицательные amount и count).
+    Не коммитит: вызывается в транзакции, которая вставляет или удаляет саму операцию.
+    """
+    await add_daily_totals(session, [(kind, context_id, user_id, category_id, day, amount, count)])
+
+
+async def add_daily_totals(session: AsyncSession, rows: list[tuple]):
+    """
+    Прибавляет к дневным агрегатам несколько строк одним запросом.
+    Строки — (kind, context_id, user_id, category_id, day, amount, count);
+    ключи строк внутри одного вызова не должны повторяться.
+    """
+    stmt = insert(DailyTotal).values([
+        {
+            "kind": kind,
+            "context_id": context_id,
+            "user_id": user_id,
+            "category_id": category_id,
+            "day": day,
+            "total": amount,
+            "count": count,
+        }
+        for kind, context_id, user_id, category_id, day, amount, count in rows
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[
+            DailyTotal.context_id,
+            DailyTotal.user_id,
+            DailyTotal.day,
+            DailyTotal.category_id,
+            DailyTotal.kind,
+        ],
+        set_={
+            "total": DailyTotal.total + stmt.excluded.total,
+            "count": DailyTotal.count + stmt.excluded.count,
+        },
+    )
+    await session.execute(stmt)
+
+
+def split_period(date_from: datetime, date_to: datetime) -> tuple[datetime, datetime] | None:
+    """
+    Выделяет из периода целые дни, которые можно взять из агрегата.
+    Возвращает (начало первого целого дня, конец последнего целого дня)
+    или None, если целых дней в периоде нет.
+    """
+    first_day = date_from.replace(hour=0, minute=0, second=0, microsecond=0)
+    if first_day < date_from:
+        first_day += timedelta(days=1)
+    last_day_end = date_to.replace(hour=0, minute=0, second=0, microsecond=0)
+    if first_day >= last_day_end:
+        return None
+    return first_day, last_day_end
+
+
+def _recomputed_totals(context_id: int | None = None):
+    """
+    Запрос, пересчитывающий дневные агрегаты из исходных операций.
+    """
+    day = cast(Operation.created_at, Date)
+    stmt = (
+        select(
+            Operation.context_id,
+            Operation.user_id,
+            day.label("day"),
+            Operation.category_id,
+            Operation.kind,
+            func.sum(Operation.amount).label("total"),
+            func.count().label("count"),
+        )
+        .group_by(Operation.context_id, Operation.user_id, day, Operation.category_id, Operation.kind)
+    )
+    if context_id is not None:
+        stmt = stmt.where(Operation.context_id == context_id)
+    return stmt
+
+
+async def rebuild_daily_totals(session: AsyncSession, context_id: int | None = None) -> int:
+    """
+    Пересчитывает дневные агрегаты из всей истории (или одного контекста).
+    Блокирует запись в daily_totals до коммита, поэтому операции, добавленные
+    во время пересчета, не теряются и не учитываются дважды.
+    Возвращает количество записанных строк.
+    """
+    await session.execute(text("LOCK TABLE daily_totals IN SHARE ROW EXCLUSIVE MODE"))
+    delete = DailyTotal.__table__.delete()
+    if context_id is not None:
+        delete = delete.where(DailyTotal.context_id == context_id)
+    await session.execute(delete)
+
+    recomputed = _recomputed_totals(context_id).subquery()
+    result = await session.execute(
+        insert(DailyTotal).from_select(
+            ["context_id", "user_id", "day", "category_id", "kind", "total", "count"],
+            select(recomputed),
+        )
+    )
+    await session.commit()
+    return result.rowcount
+
+
+async def verify_daily_totals(session: AsyncSession, context_id: int | None = None, limit: int = 20) -> list:
+    """
+    Сравнивает дневные агрегаты с пересчетом из исходных операций.
+    Возвращает до limit расхождений: (context_id, user_id, day, category_id, kind,
+    сумма в агрегате, сумма по операциям, количество в агрегате, количество по операциям).
+    Строки агрегата с нулевым количеством считаются отсутствующими.
+    """
+    recomputed = _recomputed_totals(context_id).subquery("recomputed")
+    stored = select(DailyTotal).where(DailyTotal.count != 0)
+    if context_id is not None:
+        stored = stored.where(DailyTotal.context_id == context_id)
+    stored = stored.subquery("stored")
+
+    keys = ("context_id", "user_id", "day", "category_id", "kind")
+    on = [stored.c[key] == recomputed.c[key] for key in keys]
+    rows = await session.execute(
+        select(
+            *(func.coalesce(stored.c[key], recomputed.c[key]) for key in keys),
+            stored.c.total,
+            recomputed.c.total,
+            stored.c.count,
+            recomputed.c.count,
+        )
+        .select_from(stored.join(recomputed, and_(*on), full=True))
+        .where(
+            (stored.c.total.is_distinct_from(recomputed.c.total))
+            | (stored.c.count.is_distinct_from(recomputed.c.count))
+        )
+        .limit(limit)
+    )
+    return rows.all()
@@ -0,0 +1,264 @@
+import asyncio
+import json
+import multiprocessing
+import queue
+import secrets
+import signal
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+from aiogram import Bot
+from aiohttp import web
+
+from bot.utils.logger import logger
+
+# Поля обновления, в которых лежит объект с чатом (или сам чат)
+CHAT_UPDATE_FIELDS = (
+    "message",
+    "edited_message",
+    "channel_post",
+    "edited_channel_post",
+    "my_chat_member",
+    "chat_member",
+    "chat_join_request",
+    "message_reaction",
+    "message_reaction_count",
+    "chat_boost",
+    "removed_chat_boost",
+)
+
+
+def update_chat_id(raw: dict) -> int:
+    """
+    Возвращает id чата, к которому относится обновление (для callback — чат сообщения с кнопкой).
+    Если чата нет, возвращает id пользователя, а если нет и его — 0.
+    """
+    for field in CHAT_UPDATE_FIELDS:
+        event = raw.get(field)
+        if event:
+            return event["chat"]["id"]
+    callback = raw.get("callback_query")
+    if callback:
+        if callback.get("message"):
+            return callback["message"]["chat"]["id"]
+        return callback["from"]["id"]
+    for event in raw.values():
+        if isinstance(event, dict) and isinstance(event.get("from"), dict):
+            return event["from"]["id"]
+    return 0
+
+
+def shard_for(chat_id: int, workers: int) -> int:
+    """
+    Номер воркера для чата. Все обновления одного чата попадают в один воркер.
+    """
+    return chat_id % workers
+
+
+class ChatSequencer:
+    """
+    Выполняет обработку обновлений одного чата строго по очереди,
+    а обновления разных чатов — параллельно (не более max_in_flight одновременно).
+    Слот занимается только когда до обновления дошла очередь его чата: обновления,
+    ждущие медленный чат, не отнимают слоты у остальных чатов. submit ждет, если
+    принято max_pending необработанных обновлений, — так воркер не вычитывает очередь supervisor
+    в память быстрее, чем успевает обработать.
+    """
+
+    def __init__(self, max_in_flight: int = 100, max_pending: int = 1000):
+        self._tails: dict[int, asyncio.Task] = {}
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self._pending = asyncio.Semaphore(max_pending)
+
+    async def submit(self, chat_id: int, coro_factory):
+        await self._pending.acquire()
+        previous = self._tails.get(chat_id)
+        task = asyncio.create_task(self._run(previous, coro_factory))
+        self._tails[chat_id] = task
+        task.add_done_callback(lambda t: self._release(chat_id, t))
+
+    async def _run(self, previous: asyncio.Task | None, coro_factory):
+        if previous is not None:
+            await asyncio.wait([previous])
+        async with self._semaphore:
+            try:
+                await coro_factory()
+            except Exception as e:
+                logger.exception(f"Ошибка обработки обновления: {e}")
+
+    def _release(self, chat_id: int, task: asyncio.Task):
+        self._pending.release()
+        if self._tails.get(chat_id) is task:
+            del self._tails[chat_id]
+
+    async def join(self):
+        while self._tails:
+            await asyncio.wait(list(self._tails.values()))
+
+
+def worker_main(index: int, queue, workers: int = 1):
+    """
+    Точка входа процесса-воркера. Процесс запускается через spawn, поэтому модули бота
+    (в том числе движок SQLAlchemy из bot/services/db.py) импортируются в нем заново.
+    """
+    # Остановкой управляет supervisor: он присылает None в очередь
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_run_worker(index, queue, workers))
+
+
+async def _run_worker(index: int, queue, workers: int):
+    from bot.config import settings
+    from bot.handlers import all_handlers
+    from bot.services.budgets import budget_tracker
+    from bot.services.charts import chart_renderer
+    from bot.services.confirmations import confirmation_summaries
+    from bot.services.db import AsyncSessionLocal, engine
+    from bot.services.digests import digest_scheduler
+    from bot.services.ingest import insert_batcher
+    from bot.services.purge import context_purger
+    from bot.settings import bot, dp, outgoing_limiter
+
+    for router in all_handlers:
+        dp.include_router(router)
+    # Общий лимит отправки бота делится поровну между воркерами,
+    # лимиты чатов действуют целиком: чат всегда обрабатывает один воркер
+    outgoing_limiter.set_global_rate(settings.api_global_rate / workers)
+
+    loop = asyncio.get_running_loop()
+    sequencer = ChatSequencer()
+    # Бюджеты чатов воркера проверяются по суммам в его памяти
+    async with AsyncSessionLocal() as session:
+        await budget_tracker.load(session)
+    await insert_batcher.start()
+    # Прерванные очистки продолжает воркер, которому принадлежит чат
+    await context_purger.resume(bot, lambda chat_id: shard_for(chat_id, workers) == index)
+    # Сводки своим чатам рассылает каждый воркер в пределах своей доли общего лимита
+    digest_scheduler.start(bot, (index, workers))
+    logger.info(f"Воркер {index} запущен")
+    try:
+        while True:
+            raw = await loop.run_in_executor(None, queue.get)
+            if raw is None:
+                break
+            await sequencer.submit(update_chat_id(raw), lambda raw=raw: dp.feed_raw_update(bot, raw))
+        await sequencer.join()
+    finally:
+        await insert_batcher.stop()
+        await context_purger.stop()
+        await digest_scheduler.stop()
+        await asyncio.to_thread(chart_renderer.shutdown)
+        await confirmation_summaries.stop(bot)
+        await outgoing_limiter.stop()
+        await bot.session.close()
+        await engine.dispose()
+        logger.info(f"Воркер {index} остановлен")
+
+
+class Supervisor:
+    """
+    Получает обновления от Telegram (long polling или webhook) в виде JSON и раздает их
+    процессам-воркерам по хэшу chat.id. Разбор моделей aiogram, валидация и обработка
+    выполняются в воркерах, а порядок обновлений внутри чата сохраняется.
+    Упавший воркер перезапускается при следующей отправке в его очередь: обновления,
+    которые уже лежат в очереди, обработает новый процесс.
+    """
+
+    def __init__(self, workers: int, queue_size: int = 1000, put_timeout: float = 5):
+        self.workers = workers
+        self.put_timeout = put_timeout
+        self._context = multiprocessing.get_context("spawn")
+        self._queues = [self._context.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._processes = [self._spawn(i) for i in range(workers)]
+        # По одному потоку на очередь: put блокируется при заполнении (backpressure),
+        # а порядок отправки в очередь совпадает с порядком получения
+        self._executors = [ThreadPoolExecutor(max_workers=1) for _ in range(workers)]
+
+    def _spawn(self, index: int):
+        return self._context.Process(
+            target=worker_main, args=(index, self._queues[index], self.workers),
+            name=f"bot-worker-{index}", daemon=False,
+        )
+
+    def start(self):
+        for process in self._processes:
+            process.start()
+        logger.info(f"Supervisor запустил {self.workers} воркеров")
+
+    def _put(self, index: int, raw: dict | None, restart: bool = True) -> bool:
+        """
+        Кладет обновление в очередь воркера (в потоке этой очереди). Пока очередь заполнена,
+        раз в put_timeout секунд проверяет, жив ли воркер: упавший перезапускается,
+        а при остановке (restart=False) отправка в его очередь пропускается.
+        """
+        while True:
+            process = self._processes[index]
+            if not process.is_alive():
+                if not restart:
+                    return False
+                logger.error(f"Воркер {index} завершился (код {process.exitcode}), перезапуск")
+                self._processes[index] = self._spawn(index)
+                self._processes[index].start()
+            try:
+                self._queues[index].put(raw, timeout=self.put_timeout)
+                return True
+            except queue.Full:
+                logger.warning(f"Очередь воркера {index} заполнена дольше {self.put_timeout} с")
+
+    async def dispatch(self, raw: dict):
+        index = shard_for(update_chat_id(raw), self.workers)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executors[index], self._put, index, raw)
+
+    async def poll(self, bot: Bot, allowed_updates: list[str], timeout: int = 30):
+        """
+        Long polling без разбора обновлений: getUpdates возвращает JSON, который сразу уходит воркерам.
+        """
+        await bot.delete_webhook()
+        url = bot.session.api.api_url(token=bot.token, method="getUpdates")
+        params = {"timeout": timeout, "allowed_updates": json.dumps(allowed_updates)}
+        client_timeout = aiohttp.ClientTimeout(total=timeout + 10)
+        async with aiohttp.ClientSession(timeout=client_timeout) as http:
+            while True:
+                try:
+                    async with http.get(url, params=params) as response:
+                        data = await response.json()
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    logger.warning(f"Ошибка getUpdates: {e}")
+                    await asyncio.sleep(1)
+                    continue
+                if not data.get("ok"):
+                    logger.warning(f"getUpdates вернул ошибку: {data.get('description')}")
+                    await asyncio.sleep(data.get("parameters", {}).get("retry_after", 1))
+                    continue
+                for raw in data["result"]:
+                    params["offset"] = raw["update_id"] + 1
+                    await self.dispatch(raw)
+
+    def create_webhook_app(self, path: str, secret_token: str) -> web.Application:
+        """
+        aiohttp-приложение, которое принимает webhook и раздает обновления воркерам.
+        """
+        async def handle(request: web.Request) -> web.Response:
+            token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+            if not secrets.compare_digest(token, secret_token):
+                return web.Response(status=401, text="Unauthorized")
+            await self.dispatch(await request.json())
+            return web.Response()
+
+        app = web.Application()
+        app.router.add_post(path, handle)
+        return app
+
+    def stop(self):
+        """
+        Просит воркеры дообработать очереди и дождаться записи накопленных операций.
+        Упавшие воркеры не перезапускаются: их очереди остаются необработанными.
+        """
+        stops = [executor.submit(self._put, i, None, False) for i, executor in enumerate(self._executors)]
+        for executor in self._executors:
+            executor.shutdown(wait=True)
+        for index, (stop, process) in enumerate(zip(stops, self._processes)):
+            if not stop.result():
+                logger.error(f"Воркер {index} завершился раньше остановки (код {process.exitcode})")
+            process.join()
+        logger.info("Supervisor остановлен")
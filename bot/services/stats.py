@@ -0,0 +1,183 @@
+from datetime import datetime
+from decimal import Decimal
+from typing import NamedTuple
+
+from sqlalchemy import and_, func, or_, tuple_, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from bot.config import settings
+from bot.models.models import Category, DailyTotal, Operation
+from bot.services.cache import ResultCache, stats_generations
+from bot.services.rollup import split_period
+
+# Результаты /statcat по ключу (context_id, user_id, начало периода, описание периода)
+statcat_cache = ResultCache(maxsize=settings.statcat_cache_size, ttl=settings.statcat_cache_ttl)
+
+
+class CategoryStats(NamedTuple):
+    """
+    Суммы доходов и расходов по категориям за период.
+    Строки — пары (название категории, сумма), отсортированные по убыванию суммы.
+    """
+    income_rows: list[tuple[str, Decimal]]
+    expense_rows: list[tuple[str, Decimal]]
+    total_income: Decimal
+    total_expense: Decimal
+
+
+def _operations(context_id: int, user_id: int, date_from: datetime, date_to: datetime, *columns: str):
+    """
+    Операции пользователя за период в виде подзапроса с колонкой kind ('income' или 'expense').
+    """
+    return _raw_operations(context_id, user_id, [(date_from, date_to)], *columns).subquery("ops")
+
+
+def _raw_operations(context_id: int, user_id: int, ranges: list[tuple[datetime, datetime]], *columns: str):
+    """
+    Запрос к исходным операциям за набор непересекающихся интервалов.
+    """
+    return (
+        select(Operation.kind, *(getattr(Operation, c) for c in columns))
+        .where(
+            Operation.context_id == context_id,
+            Operation.user_id == user_id,
+            or_(*(and_(Operation.created_at >= start, Operation.created_at < end) for start, end in ranges)),
+        )
+    )
+
+
+def _category_amounts(context_id: int, user_id: int, date_from: datetime, date_to: datetime):
+    """
+    Подзапрос (kind, category_id, amount) за период.
+    Целые дни берутся из дневного агрегата, неполные крайние дни — из исходных операций.
+    """
+    whole_days = split_period(date_from, date_to)
+    if whole_days is None:
+        return _operations(context_id, user_id, date_from, date_to, "category_id", "amount")
+
+    first_day, last_day_end = whole_days
+    edges = [(start, end) for start, end in ((date_from, first_day), (last_day_end, date_to)) if start < end]
+    parts = [_raw_operations(context_id, user_id, edges, "category_id", "amount")] if edges else []
+    parts.append(
+        select(DailyTotal.kind, DailyTotal.category_id, DailyTotal.total.label("amount"))
+        .where(
+            DailyTotal.context_id == context_id,
+            DailyTotal.user_id == user_id,
+            DailyTotal.day >= first_day.date(),
+            DailyTotal.day < last_day_end.date(),
+            DailyTotal.count > 0,
+        )
+    )
+    return union_all(*parts).subquery("ops")
+
+
+async def get_category_stats(
+    session: AsyncSession, context_id: int, user_id: int, date_from: datetime, date_to: datetime
+) -> CategoryStats:
+    """
+    Считает суммы по категориям и итоги отдельно для доходов и расходов
+    одним запросом к базе. Целые дни периода берутся из дневного агрегата.
+    """
+    ops = _category_amounts(context_id, user_id, date_from, date_to)
+    amount_sum = func.sum(ops.c.amount)
+    rows = (
+        await session.execute(
+            select(
+                ops.c.kind,
+                Category.title,
+                amount_sum,
+                func.sum(amount_sum).over(partition_by=ops.c.kind),
+            )
+            .join(Category, Category.id == ops.c.category_id)
+            .where(Category.is_deleted == False)
+            .group_by(ops.c.kind, Category.title)
+            .order_by(ops.c.kind, amount_sum.desc())
+        )
+    ).all()
+
+    income_rows, expense_rows = [], []
+    totals = {"income": Decimal(0), "expense": Decimal(0)}
+    for kind, title, amount, kind_total in rows:
+        (income_rows if kind == "income" else expense_rows).append((title, amount))
+        totals[kind] = kind_total
+    return CategoryStats(income_rows, expense_rows, totals["income"], totals["expense"])
+
+
+async def get_category_stats_cached(
+    session: AsyncSession, context_id: int, user_id: int, date_from: datetime, date_to: datetime, period_text: str
+) -> CategoryStats:
+    """
+    get_category_stats с кэшем результатов. Начало и описание периода однозначно задают
+    период ("за сегодня", "с начала недели", явные даты), а запись в кэше действует,
+    пока не изменились данные пользователя или категории контекста (stats_generations).
+    """
+    key = (context_id, user_id, date_from, period_text)
+    generation = stats_generations.current(context_id, user_id)
+    stats = statcat_cache.get(key, generation)
+    if stats is None:
+        stats = await get_category_stats(session, context_id, user_id, date_from, date_to)
+        statcat_cache.set(key, generation, stats)
+    return stats
+
+
+class OperationCursor(NamedTuple):
+    """
+    Позиция в списке операций для keyset-пагинации: операции упорядочены по (created_at, id).
+    """
+    created_at: datetime
+    id: int
+
+
+class OperationsPage(NamedTuple):
+    """
+    Страница операций: строки (kind, id, created_at, amount, title) в порядке времени.
+    """
+    rows: list[tuple[str, int, datetime, Decimal, str]]
+    has_prev: bool
+    has_next: bool
+
+
+async def get_operations_page(
+    session: AsyncSession,
+    context_id: int,
+    user_id: int,
+    date_from: datetime,
+    date_to: datetime,
+    cursor: OperationCursor | None = None,
+    backward: bool = False,
+    limit: int = 30,
+) -> OperationsPage:
+    """
+    Возвращает страницу операций пользователя за период после курсора (или до него при backward).
+    Один диапазон индекса (context_id, user_id, created_at, id) с LIMIT,
+    поэтому стоимость страницы не зависит от длины периода.
+    """
+    conditions = [
+        Operation.context_id == context_id,
+        Operation.user_id == user_id,
+        Operation.created_at >= date_from,
+        Operation.created_at < date_to,
+        Category.is_deleted == False,
+    ]
+    if cursor is not None:
+        key = tuple_(Operation.created_at, Operation.id)
+        bound = tuple_(cursor.created_at, cursor.id)
+        conditions.append(key < bound if backward else key > bound)
+    order = (Operation.created_at, Operation.id)
+    rows = (
+        await session.execute(
+            select(Operation.kind, Operation.id, Operation.created_at, Operation.amount, Category.title)
+            .join(Category, Category.id == Operation.category_id)
+            .where(*conditions)
+            .order_by(*(column.desc() if backward else column for column in order))
+            .limit(limit + 1)
+        )
+    ).all()
+
+    has_more = len(rows) > limit
+    rows = [tuple(row) for row in rows[:limit]]
+    if backward:
+        rows.reverse()
+        return OperationsPage(rows, has_prev=has_more, has_next=cursor is not None)
+    return OperationsPage(rows, has_prev=cursor is not None, has_next=has_more)
@@ -2,10 +2,16 @@ import re
 from datetime import datetime, timedelta
 
 from aiogram import types
+from sqlalchemy import String, any_, bindparam, exists, func, literal_column, or_, update
+from sqlalchemy.dialects.postgresql import ARRAY, insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from sqlalchemy.orm import aliased
 
-from bot.models.models import Category, Context, User
+from bot.models.models import Budget, BudgetSpending, Category, Context, DailyTotal, Operation, User
+from bot.services.budgets import budget_tracker
+from bot.services.cache import CachedCategory, CachedContext, CachedRef, normalize_title, resolver_cache
+from bot.services.db import after_commit
 
 def parse_date_arg(arg: str) -> tuple[datetime, datetime, str] | None:
     """
@@ -49,19 +55,29 @@ def parse_date_arg(arg: str) -> tuple[datetime, datetime, str] | None:
         pass
     return None
 
+async def upsert_context(session, chat) -> tuple[Context, bool]:
+    """
+    Получает или создает контекст чата одним запросом INSERT … ON CONFLICT DO UPDATE … RETURNING.
+    Возвращает (контекст, True если контекст только что создан).
+    Безопасно при одновременной обработке первых сообщений нового чата.
+    """
+    stmt = insert(Context).values(context_id=chat.id, context_type=chat.type)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Context.context_id, Context.context_type],
+        # Обновление без изменений нужно, чтобы RETURNING вернул существующую строку
+        set_={"context_type": stmt.excluded.context_type},
+    ).returning(Context, literal_column("xmax = 0").label("inserted"))
+    context, inserted = (
+        await session.execute(stmt, execution_options={"populate_existing": True})
+    ).one()
+    return context, inserted
+
 async def get_or_create_context(session, chat):
     """
     Получает контекст чата (Context) по id и типу.
     Если не найден — создает новый контекст.
     """
-    result = await session.execute(
-        select(Context).where(Context.context_id == chat.id, Context.context_type == chat.type)
-    )
-    context = result.scalars().first()
-    if not context:
-        context = Context(context_id=chat.id, context_type=chat.type)
-        session.add(context)
-        await session.commit()
+    context, _ = await upsert_context(session, chat)
     return context
 
 async def get_user(session, tg_id: int):
@@ -75,44 +91,27 @@ async def get_user(session, tg_id: int):
 async def get_or_create_user(session, tg_user):
     """
     Получает пользователя (User) по Telegram ID.
-    Если не найден — создает нового пользователя.
-    """
-    result = await session.execute(select(User).where(User.tg_id == tg_user.id))
-    user = result.scalar_one_or_none()
-    if not user:
-        user = User(
-            tg_id=tg_user.id,
-            username=tg_user.username,
-            first_name=tg_user.first_name
-        )
-        session.add(user)
-        await session.commit()
-    return user
+    Если не найден — создает нового пользователя; username и first_name обновляются тем же запросом.
+    """
+    stmt = insert(User).values(
+        tg_id=tg_user.id,
+        username=tg_user.username,
+        first_name=tg_user.first_name
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[User.tg_id],
+        set_={"username": stmt.excluded.username, "first_name": stmt.excluded.first_name},
+    ).returning(User)
+    result = await session.scalars(stmt, execution_options={"populate_existing": True})
+    return result.one()
 
 async def get_context(session, chat: types.Chat):
     """
     Получает контекст чата (Context) по id и типу.
-    Если не найден — создает новый контекст и добавляет стандартные категории.
+    Если не найден — создает новый контекст. Стандартные категории не копируются:
+    они общие для всех чатов (шаблонные строки categories с context_id = NULL).
     """
-    result = await session.execute(
-        select(Context).where(Context.context_id == chat.id, Context.context_type == chat.type)
-    )
-    context = result.scalars().first()
-    if not context:
-        context = Context(context_id=chat.id, context_type=chat.type)
-        session.add(context)
-        await session.commit()
-        await session.refresh(context)
-        # Добавление стандартных категорий для нового чата
-        default_categories = [
-            "аванс", "авто", "алкоголь", "аптека", "бензин", "больницы", "дом", "зарплата", "ипотека", "кафе",
-            "коммунальные", "красота", "кредит", "образование", "одежда", "питомцы", "подарки",
-            "продукты", "прочее", "путешествия", "развлечения", "сигареты", "спорт", "транспорт",
-            "участок", "хобби", "хозтовары", "электроника"
-        ]
-        for cat in default_categories:
-            session.add(Category(title=cat, context_id=context.id, is_default=True, is_deleted=False))
-        await session.commit()
+    context, _ = await upsert_context(session, chat)
     return context
 
 async def is_admin(message: types.Message) -> bool:
@@ -127,20 +126,169 @@ async def is_admin(message: types.Message) -> bool:
         # В случае ошибки (например, бот не может получить статус) возвращаем False
         return False
 
+def visible_categories(context_id: int):
+    """
+    Подзапрос категорий, видимых в контексте: собственные строки контекста
+    (включая удаленные) перекрывают шаблонные категории с тем же названием.
+    Удаленные категории нужно отфильтровать по is_deleted.
+    """
+    return (
+        select(Category)
+        .where(or_(Category.context_id == context_id, Category.context_id.is_(None)))
+        .distinct(func.lower(Category.title))
+        .order_by(func.lower(Category.title), Category.context_id.nulls_last())
+        .subquery()
+    )
+
+async def find_category(session: AsyncSession, title: str, context) -> Category | None:
+    """
+    Находит категорию контекста по названию без учета регистра.
+    Собственная строка контекста (даже удаленная) важнее шаблонной.
+    Возвращает None, если такой категории нет ни в контексте, ни в шаблоне.
+    """
+    result = await session.execute(
+        select(Category)
+        .where(or_(Category.context_id == context.id, Category.context_id.is_(None)))
+        .where(func.lower(Category.title) == func.lower(title.strip()))
+        .order_by(Category.context_id.nulls_last())
+        .limit(1)
+    )
+    return result.scalars().first()
+
 async def get_category(session: AsyncSession, title: str, context: Context) -> Category | None:
     """
     Получает категорию (Category) по названию (title) и контексту (context).
     Категория должна быть не удалена.
     Возвращает None, если категория не найдена.
     """
+    category = await find_category(session, title, context)
+    if not category or category.is_deleted:
+        return None
+    return category
+
+async def get_categories_by_titles(session: AsyncSession, titles, context) -> dict[str, Category]:
+    """
+    Находит живые категории контекста сразу для набора названий одним запросом.
+    Названия передаются одним параметром-массивом (= ANY), а не списком IN: у asyncpg
+    не больше 32767 параметров в запросе, а в выписке может быть сколько угодно категорий.
+    Возвращает словарь {нормализованное название: категория}; ненайденных названий в нем нет.
+    """
+    titles = {title.strip().lower() for title in titles}
+    if not titles:
+        return {}
+    categories = aliased(Category, visible_categories(context.id))
+    result = await session.execute(
+        select(categories)
+        .where(func.lower(categories.title) == any_(bindparam("titles", sorted(titles), type_=ARRAY(String))))
+        .where(categories.is_deleted == False)
+    )
+    return {normalize_title(category.title): category for category in result.scalars()}
+
+# Нечеткий поиск выполняется только для коротких названий: число триграмм
+# (и работа по GIN-индексу) растет с длиной строки
+SUGGEST_MAX_TITLE_LENGTH = 64
+
+async def suggest_category(session: AsyncSession, title: str, context) -> Category | None:
+    """
+    Находит ближайшую по триграммному сходству (pg_trgm) живую категорию контекста,
+    например "продукты" для "продуктв". Возвращает None, если похожих категорий нет.
+    Кандидаты отбираются оператором % (порог pg_trgm.similarity_threshold) по GIN-индексу
+    среди категорий всех контекстов; фильтр по контексту и шаблону применяется уже к ним.
+    """
+    title = title.strip().lower()
+    if not title or len(title) > SUGGEST_MAX_TITLE_LENGTH:
+        return None
+    override = aliased(Category)
     result = await session.execute(
         select(Category)
-        .where(Category.title.ilike(title))
-        .where(Category.context_id == context.id)
+        .where(or_(Category.context_id == context.id, Category.context_id.is_(None)))
         .where(Category.is_deleted == False)
+        .where(func.lower(Category.title).op("%")(title))
+        # Шаблонная категория, переопределенная в контексте, не предлагается
+        .where(
+            ~exists().where(
+                Category.context_id.is_(None),
+                override.context_id == context.id,
+                func.lower(override.title) == func.lower(Category.title),
+            )
+        )
+        .order_by(func.similarity(func.lower(Category.title), title).desc(), Category.context_id.nulls_last())
+        .limit(1)
     )
     return result.scalars().first()
 
+async def override_default_category(session: AsyncSession, template: Category, context_id: int) -> Category:
+    """
+    Копирует шаблонную категорию в контекст (copy-on-write), чтобы изменить ее только для этого чата.
+    Операции, дневные агрегаты и бюджет контекста переносятся на копию.
+    """
+    category = Category(title=template.title, context_id=context_id, is_default=True, is_deleted=False)
+    session.add(category)
+    await session.flush()
+    for model in (Operation, DailyTotal, Budget, BudgetSpending):
+        await session.execute(
+            update(model)
+            .where(model.context_id == context_id, model.category_id == template.id)
+            .values(category_id=category.id)
+        )
+    # Новые расходы записываются на копию: лимит проверяется по ее id
+    after_commit(session, lambda: budget_tracker.move_category(context_id, template.id, category.id))
+    return category
+
+async def resolve_user(session, tg_user) -> CachedRef:
+    """
+    Возвращает ссылку на пользователя (User.id) из кэша.
+    При промахе обращается к get_or_create_user и сохраняет результат.
+    """
+    cached = resolver_cache.users.get(tg_user.id)
+    if cached is None:
+        user = await get_or_create_user(session, tg_user)
+        cached = CachedRef(user.id)
+        resolver_cache.users.set(tg_user.id, cached)
+    return cached
+
+async def resolve_existing_user(session, tg_id: int) -> CachedRef | None:
+    """
+    Возвращает ссылку на пользователя (User.id) из кэша, не создавая его.
+    Возвращает None, если пользователь не найден.
+    """
+    cached = resolver_cache.users.get(tg_id)
+    if cached is None:
+        user = await get_user(session, tg_id)
+        if not user:
+            return None
+        cached = CachedRef(user.id)
+        resolver_cache.users.set(tg_id, cached)
+    return cached
+
+async def resolve_context(session, chat) -> CachedContext:
+    """
+    Возвращает контекст чата (id и настройки) из кэша.
+    При промахе обращается к get_or_create_context и сохраняет результат.
+    """
+    key = (chat.id, chat.type)
+    cached = resolver_cache.contexts.get(key)
+    if cached is None:
+        context = await get_or_create_context(session, chat)
+        cached = CachedContext(context.id, context.compact_confirmations, context.purging)
+        resolver_cache.contexts.set(key, cached)
+    return cached
+
+async def resolve_category(session: AsyncSession, title: str, context) -> CachedCategory | None:
+    """
+    Возвращает категорию контекста по названию из кэша.
+    При промахе обращается к get_category; отсутствующие категории не кэшируются.
+    """
+    key = (context.id, normalize_title(title))
+    cached = resolver_cache.categories.get(key)
+    if cached is None:
+        category = await get_category(session, title, context)
+        if not category:
+            return None
+        cached = CachedCategory(category.id, category.title)
+        resolver_cache.categories.set(key, cached)
+    return cached
+
 def get_user_display(user_obj):
     username = user_obj.username
     return f"@{username}" if username else (user_obj.full_name or "Аноним")
\ No newline at end of file
@@ -0,0 +1,60 @@
+import asyncio
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from bot.config import settings
+from bot.utils.logger import logger
+
+
+def create_webhook_app(dp: Dispatcher, bot: Bot, path: str, secret_token: str | None) -> web.Application:
+    """
+    Создает aiohttp-приложение, принимающее обновления от Telegram на указанном пути.
+    Запросы без верного секретного токена отклоняются.
+    """
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret_token).register(app, path=path)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def set_webhook(bot: Bot, allowed_updates: list[str]):
+    """
+    Регистрирует webhook в Telegram.
+    Бот работает в одном экземпляре (см. acquire_instance_lock в bot/services/db.py):
+    при нагрузке обновления раздаются воркерам supervisor.py, а не репликам за балансировщиком.
+    """
+    if not settings.webhook_secret:
+        raise RuntimeError("Для режима webhook нужно задать WEBHOOK_SECRET")
+
+    await bot.set_webhook(
+        url=f"{settings.webhook_base_url.rstrip('/')}{settings.webhook_path}",
+        secret_token=settings.webhook_secret,
+        allowed_updates=allowed_updates,
+    )
+    logger.info(f"Webhook установлен, обновления: {', '.join(allowed_updates)}")
+
+
+async def serve_app(app: web.Application):
+    """
+    Обслуживает aiohttp-приложение на адресе из настроек до остановки.
+    """
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, settings.webhook_host, settings.webhook_port)
+    await site.start()
+    logger.info(f"Webhook-сервер слушает {settings.webhook_host}:{settings.webhook_port}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    """
+    Регистрирует webhook в Telegram и обслуживает входящие обновления до остановки.
+    Тип обновлений ограничен теми, для которых зарегистрированы обработчики.
+    """
+    await set_webhook(bot, dp.resolve_used_update_types())
+    await serve_app(create_webhook_app(dp, bot, settings.webhook_path, settings.webhook_secret))
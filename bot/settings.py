@@ -3,10 +3,16 @@ from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 
 from bot.config import settings
+from bot.middlewares import DbSessionMiddleware, outgoing_limiter
+from bot.services.db import AsyncSessionLocal
 
 bot = Bot(
     token=settings.bot_token,
     default=DefaultBotProperties(parse_mode=ParseMode.HTML)
 )
+# Очередь исходящих сообщений в пределах ограничений Telegram
+bot.session.middleware(outgoing_limiter)
 
 dp = Dispatcher()
+# Одна сессия БД и один коммит на обновление
+dp.update.outer_middleware(DbSessionMiddleware(AsyncSessionLocal))
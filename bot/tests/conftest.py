@@ -0,0 +1,15 @@
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+
+@pytest.fixture
+def make_session_factory():
+    """
+    Фабрика сессий вместо async_sessionmaker: `async with factory() as s` отдает переданный мок сессии.
+    """
+    def make(session):
+        return MagicMock(
+            return_value=AsyncMock(__aenter__=AsyncMock(return_value=session), __aexit__=AsyncMock(return_value=False))
+        )
+    return make
@@ -9,9 +9,8 @@ from bot.handlers.base_commands import get_user_display  # если нужно,
 @patch("bot.handlers.base_commands.menu_inline_keyboard", return_value=MagicMock())
 @patch("bot.handlers.base_commands.get_context", new_callable=AsyncMock)
 @patch("bot.handlers.base_commands.get_or_create_user", new_callable=AsyncMock)
-@patch("bot.handlers.base_commands.AsyncSessionLocal")
 @patch("bot.handlers.base_commands.get_user_display", side_effect=lambda user: user.first_name)
-async def test_start_handler(mock_get_user_display, mock_session_local, mock_get_or_create_user, mock_get_context, mock_menu_keyboard):
+async def test_start_handler(mock_get_user_display, mock_get_or_create_user, mock_get_context, mock_menu_keyboard):
     message = AsyncMock()
     message.from_user.first_name = "Вася"
     message.from_user.id = 123
@@ -21,9 +20,8 @@ async def test_start_handler(mock_get_user_display, mock_session_local, mock_get
     message.answer = AsyncMock()
 
     mock_session = AsyncMock()
-    mock_session_local.return_value.__aenter__.return_value = mock_session
 
-    await base_commands.start_handler(message)
+    await base_commands.start_handler(message, mock_session)
 
     mock_get_or_create_user.assert_awaited_once_with(mock_session, message.from_user)
     mock_get_context.assert_awaited_once_with(mock_session, message.chat)
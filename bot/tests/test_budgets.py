@@ -0,0 +1,197 @@
+from datetime import date, datetime
+from decimal import Decimal
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+import bot.handlers.categories as categories
+import bot.handlers.finance as finance
+from bot.services.budgets import BudgetTracker, add_budget_spending, next_period_start, period_start
+from bot.services.ingest import PendingRecord, insert_operations
+from bot.services.purge import PURGE_REJECTED
+
+
+@pytest.fixture
+def tracker(mocker):
+    tracker = BudgetTracker()
+    mocker.patch("bot.services.budgets.budget_tracker", tracker)
+    return tracker
+
+
+def test_period_start():
+    assert period_start("month", date(2025, 7, 16)) == date(2025, 7, 1)
+    assert period_start("week", date(2025, 7, 16)) == date(2025, 7, 14)
+    assert next_period_start("month", date(2025, 12, 1)) == date(2026, 1, 1)
+    assert next_period_start("week", date(2025, 7, 14)) == date(2025, 7, 21)
+
+
+def test_tracker_reports_crossed_thresholds_once():
+    tracker = BudgetTracker()
+    tracker.set_budget(1, 5, "month", Decimal("1000"), date(2025, 7, 1), Decimal("700"))
+
+    assert tracker.add(1, 5, date(2025, 7, 16), Decimal("50")) is None
+    assert tracker.add(1, 5, date(2025, 7, 16), Decimal("100")) == ("month", 80, Decimal("850"), Decimal("1000"))
+    assert tracker.add(1, 5, date(2025, 7, 16), Decimal("10")) is None
+    # Одна операция перешла оба порога — сообщается старший
+    tracker.add(1, 5, date(2025, 7, 16), Decimal("-200"))
+    assert tracker.add(1, 5, date(2025, 7, 17), Decimal("500"))[:2] == ("month", 100)
+    # Без бюджета — ничего не отслеживается
+    assert tracker.add(1, 6, date(2025, 7, 16), Decimal("5000")) is None
+
+
+def test_tracker_starts_new_period_and_ignores_past():
+    tracker = BudgetTracker()
+    tracker.set_budget(1, 5, "week", Decimal("100"), date(2025, 7, 14), Decimal("90"))
+
+    assert tracker.add(1, 5, date(2025, 7, 10), Decimal("50")) is None
+    assert tracker.spent(1, 5, date(2025, 7, 16)) == Decimal("90")
+    assert tracker.add(1, 5, date(2025, 7, 21), Decimal("10"), today=date(2025, 7, 21)) is None
+    assert tracker.spent(1, 5, date(2025, 7, 21)) == Decimal("10")
+
+
+def test_tracker_ignores_future_periods():
+    tracker = BudgetTracker()
+    tracker.set_budget(1, 5, "month", Decimal("100"), date(2025, 7, 1), Decimal("50"))
+
+    # Импорт выписки с датой следующего месяца не сбрасывает текущий
+    assert tracker.add(1, 5, date(2025, 8, 3), Decimal("500"), today=date(2025, 7, 16)) is None
+    assert tracker.spent(1, 5, date(2025, 7, 16)) == Decimal("50")
+
+
+@pytest.mark.asyncio
+async def test_add_budget_spending_skips_query_without_budgets(tracker):
+    session = AsyncMock()
+
+    assert await add_budget_spending(session, [(1, 5, date(2025, 7, 16), Decimal("100"))]) == []
+    session.execute.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_insert_operations_updates_budget_counter_in_same_transaction(tracker):
+    tracker.set_budget(1, 5, "month", Decimal("1000"), date(2025, 7, 1), Decimal(0))
+    session = AsyncMock()
+    session.execute.return_value = MagicMock(scalars=MagicMock(return_value=MagicMock(all=MagicMock(return_value=[10, 11, 12]))))
+    created_at = datetime(2025, 7, 16, 12, 0)
+    records = [
+        PendingRecord("expense", 2, 1, 5, Decimal("100"), created_at),
+        PendingRecord("expense", 3, 1, 5, Decimal("50"), created_at),
+        PendingRecord("income", 2, 1, 5, Decimal("999"), created_at),
+    ]
+
+    await insert_operations(session, records)
+
+    # INSERT операций, дневные агрегаты и один upsert счетчика бюджета
+    assert session.execute.await_count == 3
+    counter = session.execute.await_args_list[2].args[0]
+    sql = str(counter.compile(dialect=postgresql.dialect()))
+    assert sql.startswith("INSERT INTO budget_spending")
+    assert "budget_spending.total + excluded.total" in sql
+    params = counter.compile(dialect=postgresql.dialect()).params
+    assert params["period_start_m0"] == date(2025, 7, 1)
+    assert params["total_m0"] == Decimal("150")
+    session.commit.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_handle_expense_income_warns_when_budget_crossed(mocker, tracker):
+    message = AsyncMock()
+    message.text = "900 еда"
+    message.from_user = MagicMock(id=1, username="testuser", first_name="Test")
+    message.chat = MagicMock(id=123, type="private")
+    session = AsyncMock()
+    session.in_transaction = MagicMock(return_value=False)
+    mocker.patch("bot.handlers.finance.resolve_user", new=AsyncMock(return_value=MagicMock(id=1)))
+    mocker.patch(
+        "bot.handlers.finance.resolve_context",
+        new=AsyncMock(return_value=MagicMock(id=1, compact_confirmations=False, purging=False)),
+    )
+    mocker.patch("bot.handlers.finance.resolve_category", new=AsyncMock(return_value=MagicMock(id=5, title="еда")))
+    mocker.patch("bot.handlers.finance.insert_batcher.submit", new=AsyncMock(return_value=42))
+    mocker.patch("bot.handlers.finance.check_budget", new=MagicMock(return_value="⚠️ Бюджет «еда»"))
+
+    await finance.handle_expense_income(message, session)
+
+    message.answer.assert_awaited_once()
+    message.reply.assert_awaited_once_with("⚠️ Бюджет «еда»")
+    context_id, category_id, title, _, amount = finance.check_budget.call_args.args
+    assert (context_id, category_id, title, amount) == (1, 5, "еда", Decimal("900"))
+
+
+@pytest.mark.asyncio
+async def test_budget_handler_sets_budget_with_current_spending(mocker, tracker):
+    mocker.patch("bot.handlers.categories.budget_tracker", tracker)
+    message = AsyncMock()
+    message.chat = MagicMock(id=123, type="private")
+    mocker.patch("bot.handlers.categories.resolve_context", new=AsyncMock(return_value=MagicMock(id=1, purging=False)))
+    mocker.patch(
+        "bot.handlers.categories.resolve_category", new=AsyncMock(return_value=MagicMock(id=5, title="кафе"))
+    )
+    session = AsyncMock()
+    session.info = {}
+    session.execute.return_value = MagicMock(scalar=MagicMock(return_value=Decimal("300")))
+
+    await categories.budget_handler(message, MagicMock(args="кафе 1000 week"), session)
+
+    # Бюджет и счетчик, посчитанный по дневному агрегату в том же запросе
+    assert session.execute.await_count == 2
+    sql = str(session.execute.await_args_list[1].args[0].compile(dialect=postgresql.dialect()))
+    assert sql.startswith("INSERT INTO budget_spending")
+    assert "FROM daily_totals" in sql
+    assert "daily_totals.day >= %(day_1)s AND daily_totals.day < %(day_2)s" in sql
+    # Добавки параллельных записей к строке счетчика не затираются
+    assert "SET total = ((excluded.total + budget_spending.total) - coalesce((SELECT" in sql
+    assert "RETURNING budget_spending.total" in sql
+    # Записи операций учитывают бюджет уже до коммита
+    assert tracker.budget(1, 5) == ("week", Decimal("1000"))
+    for callback in session.info["after_commit"]:
+        callback()
+    assert tracker.spent(1, 5, datetime.now(categories.MOSCOW_TZ).date()) == Decimal("300")
+    assert "Уже потрачено: 300" in message.reply.await_args.args[0]
+
+
+@pytest.mark.asyncio
+async def test_budget_handler_restores_budget_when_query_fails(mocker, tracker):
+    mocker.patch("bot.handlers.categories.budget_tracker", tracker)
+    today = datetime.now(categories.MOSCOW_TZ).date()
+    tracker.set_budget(1, 5, "month", Decimal("500"), period_start("month", today), Decimal("70"))
+    message = AsyncMock()
+    message.chat = MagicMock(id=123, type="private")
+    mocker.patch("bot.handlers.categories.resolve_context", new=AsyncMock(return_value=MagicMock(id=1, purging=False)))
+    mocker.patch(
+        "bot.handlers.categories.resolve_category", new=AsyncMock(return_value=MagicMock(id=5, title="кафе"))
+    )
+    session = AsyncMock()
+    session.execute.side_effect = RuntimeError("db")
+
+    with pytest.raises(RuntimeError):
+        await categories.budget_handler(message, MagicMock(args="кафе 1000 week"), session)
+
+    assert tracker.budget(1, 5) == ("month", Decimal("500"))
+    assert tracker.spent(1, 5, today) == Decimal("70")
+
+
+@pytest.mark.asyncio
+async def test_budget_handler_rejects_purging_context(mocker):
+    message = AsyncMock()
+    message.chat = MagicMock(id=123, type="private")
+    mocker.patch("bot.handlers.categories.resolve_context", new=AsyncMock(return_value=MagicMock(id=1, purging=True)))
+    session = AsyncMock()
+
+    await categories.budget_handler(message, MagicMock(args="кафе 1000"), session)
+
+    message.reply.assert_awaited_once_with(PURGE_REJECTED)
+    session.execute.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_budget_handler_rejects_bad_amount(mocker):
+    message = AsyncMock()
+    message.chat = MagicMock(id=123, type="private")
+    mocker.patch("bot.handlers.categories.resolve_context", new=AsyncMock(return_value=MagicMock(id=1)))
+    session = AsyncMock()
+
+    await categories.budget_handler(message, MagicMock(args="кафе много"), session)
+
+    assert message.reply.await_args.args[0] == categories.BUDGET_USAGE
+    session.execute.assert_not_awaited()
@@ -0,0 +1,107 @@
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from bot.services import utils
+from bot.services.cache import LRUCache, ResolverCache, ResultCache, StatsGenerations
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+
+
+def test_lru_cache_expires_entries():
+    cache = LRUCache(maxsize=10, ttl=60)
+    with patch("bot.services.cache.time.monotonic", return_value=0):
+        cache.set("a", 1)
+    with patch("bot.services.cache.time.monotonic", return_value=61):
+        assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_resolver_cache_invalidate_context():
+    cache = ResolverCache(maxsize=10, ttl=60)
+    cache.contexts.set((123, "group"), MagicMock(id=1))
+    cache.categories.set((1, "кафе"), MagicMock(id=10))
+    cache.categories.set((2, "кафе"), MagicMock(id=20))
+
+    cache.invalidate_context(123, "group", 1)
+
+    assert cache.contexts.get((123, "group")) is None
+    assert cache.categories.get((1, "кафе")) is None
+    assert cache.categories.get((2, "кафе")) is not None
+
+
+@pytest.mark.asyncio
+async def test_resolve_category_hits_cache_on_second_call(mocker):
+    mocker.patch("bot.services.utils.resolver_cache", ResolverCache(maxsize=10, ttl=60))
+    get_category_mock = mocker.patch(
+        "bot.services.utils.get_category",
+        new=AsyncMock(return_value=MagicMock(id=5, title="кафе")),
+    )
+    session = AsyncMock()
+    context = MagicMock(id=1)
+
+    first = await utils.resolve_category(session, "Кафе", context)
+    second = await utils.resolve_category(session, "кафе ", context)
+
+    assert first is second
+    assert (second.id, second.title) == (5, "кафе")
+    get_category_mock.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_resolve_category_does_not_cache_missing(mocker):
+    mocker.patch("bot.services.utils.resolver_cache", ResolverCache(maxsize=10, ttl=60))
+    get_category_mock = mocker.patch("bot.services.utils.get_category", new=AsyncMock(return_value=None))
+    session = AsyncMock()
+    context = MagicMock(id=1)
+
+    assert await utils.resolve_category(session, "кафе", context) is None
+    assert await utils.resolve_category(session, "кафе", context) is None
+    assert get_category_mock.await_count == 2
+
+
+def test_stats_generations_change_on_bump():
+    generations = StatsGenerations(maxsize=10)
+    before = generations.current(1, 2)
+    assert generations.current(1, 2) == before
+
+    generations.bump(1, 2)
+    after_user = generations.current(1, 2)
+    assert after_user != before
+    # Изменение данных одного пользователя не затрагивает других
+    other = generations.current(1, 3)
+    generations.bump(1, 2)
+    assert generations.current(1, 3) == other
+
+    # Изменение категорий затрагивает весь контекст
+    generations.bump(1)
+    assert generations.current(1, 3) != other
+
+
+def test_stats_generations_evicted_key_never_matches_old_value():
+    generations = StatsGenerations(maxsize=1)
+    old = generations.current(1, 2)
+    generations.current(5, 6)  # вытесняет ключи контекста 1
+    assert generations.current(1, 2) != old
+
+
+def test_result_cache_counts_hits_and_misses():
+    cache = ResultCache(maxsize=10, ttl=60)
+
+    assert cache.get("key", (1, 1)) is None
+    cache.set("key", (1, 1), "value")
+    assert cache.get("key", (1, 1)) == "value"
+    # Запись другого поколения устарела
+    assert cache.get("key", (1, 2)) is None
+
+    assert cache.stats() == {"hits": 1, "misses": 2, "hit_rate": 1 / 3, "size": 1}
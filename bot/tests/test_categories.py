@@ -7,9 +7,8 @@ import bot.handlers.categories as handlers
 
 @pytest.mark.asyncio
 @patch("bot.handlers.categories.is_admin", new_callable=AsyncMock)
-@patch("bot.handlers.categories.get_async_session")
 @patch("bot.handlers.categories.get_context", new_callable=AsyncMock)
-async def test_add_category_handler_success(get_context_mock, get_async_session_mock, is_admin_mock):
+async def test_add_category_handler_success(get_context_mock, is_admin_mock):
     is_admin_mock.return_value = True
     message = MagicMock()
     message.text = "/add Тест"
@@ -19,13 +18,16 @@ async def test_add_category_handler_success(get_context_mock, get_async_session_
 
     session = MagicMock()
     session.execute = AsyncMock(return_value=MagicMock(scalars=MagicMock(return_value=MagicMock(first=MagicMock(return_value=None)))))
-    get_async_session_mock.return_value.__aenter__.return_value = session
+    session.info = {}
     get_context_mock.return_value = MagicMock(id=1)
     session.commit = AsyncMock()
 
-    await handlers.add_category_handler(message)
+    await handlers.add_category_handler(message, session)
     print(message.reply.call_args_list)
     message.reply.assert_called_with("Категория 'Тест' успешно добавлена!", reply_markup=handlers.menu_inline_keyboard())
+    # Коммит и сброс кэша категорий выполняет DbSessionMiddleware
+    session.commit.assert_not_awaited()
+    assert len(session.info["after_commit"]) == 1
 
 @pytest.mark.asyncio
 @patch("bot.handlers.categories.is_admin", new_callable=AsyncMock)
@@ -37,7 +39,7 @@ async def test_add_category_handler_not_admin(is_admin_mock):
     message.chat.id = 123
     message.chat.type = "group"
 
-    await handlers.add_category_handler(message)
+    await handlers.add_category_handler(message, MagicMock())
     message.reply.assert_called_with("Добавлять категории могут только администраторы.", reply_markup=handlers.menu_inline_keyboard())
 
 @pytest.mark.asyncio
@@ -50,13 +52,12 @@ async def test_delete_category_handler_no_args(is_admin_mock):
     message.chat.id = 123
     message.chat.type = "group"
 
-    await handlers.delete_category_handler(message)
+    await handlers.delete_category_handler(message, MagicMock())
     message.reply.assert_called_with("Укажите название категории, например:\n/del кафе", reply_markup=handlers.menu_inline_keyboard())
 
 @pytest.mark.asyncio
-@patch("bot.handlers.categories.get_async_session")
 @patch("bot.handlers.categories.get_context", new_callable=AsyncMock)
-async def test_list_categories_handler_empty(get_context_mock, get_async_session_mock):
+async def test_list_categories_handler_empty(get_context_mock):
     message = MagicMock()
     message.text = "/categories"
     message.reply = AsyncMock()
@@ -65,8 +66,35 @@ async def test_list_categories_handler_empty(get_context_mock, get_async_session
 
     session = MagicMock()
     session.execute = AsyncMock(return_value=MagicMock(scalars=MagicMock(return_value=MagicMock(all=MagicMock(return_value=[])))))
-    get_async_session_mock.return_value.__aenter__.return_value = session
     get_context_mock.return_value = MagicMock(id=1)
 
-    await handlers.list_categories_handler(message)
+    await handlers.list_categories_handler(message, session)
     message.reply.assert_called_with("В этом чате нет доступных категорий.", reply_markup=handlers.menu_inline_keyboard())
+
+@pytest.mark.asyncio
+@patch("bot.handlers.categories.override_default_category", new_callable=AsyncMock)
+@patch("bot.handlers.categories.find_category", new_callable=AsyncMock)
+@patch("bot.handlers.categories.is_admin", new_callable=AsyncMock)
+@patch("bot.handlers.categories.get_context", new_callable=AsyncMock)
+async def test_delete_template_category_is_copy_on_write(get_context_mock, is_admin_mock, find_mock, override_mock):
+    is_admin_mock.return_value = True
+    message = MagicMock()
+    message.text = "/del кафе"
+    message.reply = AsyncMock()
+    message.chat.type = "group"
+
+    template = MagicMock(context_id=None, is_deleted=False)
+    copy = MagicMock(is_deleted=False)
+    find_mock.return_value = template
+    override_mock.return_value = copy
+    get_context_mock.return_value = MagicMock(id=1)
+    session = MagicMock()
+    session.info = {}
+
+    await handlers.delete_category_handler(message, session)
+
+    # Шаблон общий для всех чатов: удаляется только копия в этом контексте
+    override_mock.assert_awaited_once_with(session, template, 1)
+    assert copy.is_deleted is True
+    assert template.is_deleted is False
+    message.reply.assert_called_with("Категория 'кафе' успешно удалена.", reply_markup=handlers.menu_inline_keyboard())
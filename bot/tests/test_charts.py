@@ -0,0 +1,66 @@
+import asyncio
+from decimal import Decimal
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from bot.handlers import statistics
+from bot.services.cache import ResultCache, StatsGenerations
+from bot.services.charts import ChartQueueFull, ChartRenderer
+from bot.services.stats import CategoryStats
+
+
+@pytest.mark.asyncio
+async def test_chart_renderer_rejects_over_queue_limit(mocker):
+    renderer = ChartRenderer(max_workers=1, max_pending=1)
+    release = asyncio.Event()
+
+    async def slow_render(executor, func, *args):
+        await release.wait()
+        return b"pie", b"bar"
+
+    loop = asyncio.get_running_loop()
+    mocker.patch.object(loop, "run_in_executor", new=slow_render)
+    mocker.patch("bot.services.charts.ProcessPoolExecutor")
+
+    first = asyncio.create_task(renderer.render("Расходы", [("кафе", 1.0)]))
+    await asyncio.sleep(0)
+    assert renderer.pending == 1
+    with pytest.raises(ChartQueueFull):
+        await renderer.render("Расходы", [("кафе", 1.0)])
+
+    release.set()
+    assert await first == (b"pie", b"bar")
+    assert renderer.pending == 0
+
+
+@pytest.mark.asyncio
+async def test_statchart_uses_cache_until_data_changes(mocker):
+    generations = StatsGenerations(maxsize=10)
+    mocker.patch("bot.handlers.statistics.stats_generations", generations)
+    mocker.patch("bot.services.stats.stats_generations", generations)
+    mocker.patch("bot.handlers.statistics.chart_cache", ResultCache(maxsize=10, ttl=60))
+    mocker.patch("bot.services.stats.statcat_cache", ResultCache(maxsize=10, ttl=60))
+    mocker.patch("bot.handlers.statistics.charts_available", return_value=True)
+    mocker.patch("bot.handlers.statistics.resolve_context", new=AsyncMock(return_value=MagicMock(id=1)))
+    mocker.patch("bot.handlers.statistics.resolve_existing_user", new=AsyncMock(return_value=MagicMock(id=2)))
+    stats_mock = mocker.patch(
+        "bot.services.stats.get_category_stats",
+        new=AsyncMock(return_value=CategoryStats([], [("кафе", Decimal("700"))], Decimal(0), Decimal("700"))),
+    )
+    render_mock = mocker.patch("bot.handlers.statistics.chart_renderer.render", new=AsyncMock(return_value=(b"p", b"b")))
+    message = AsyncMock()
+    message.from_user = MagicMock(id=10, username="test_user")
+
+    await statistics.statchart_handler(message, "month", AsyncMock())
+    await statistics.statchart_handler(message, "month", AsyncMock())
+    assert render_mock.await_count == 1
+    assert stats_mock.await_count == 1
+    assert render_mock.await_args[0][1] == [("кафе", 700.0)]
+
+    generations.bump(1, 2)
+    await statistics.statchart_handler(message, "month", AsyncMock())
+    assert render_mock.await_count == 2
+
+    media = message.answer_media_group.await_args[0][0]
+    assert len(media) == 2
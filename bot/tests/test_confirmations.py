@@ -0,0 +1,100 @@
+import asyncio
+from datetime import datetime
+from decimal import Decimal
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+import bot.handlers.finance as finance
+from bot.services.confirmations import ConfirmationCoalescer, SummaryEntry, render_summary
+
+
+def entry(record_id: int, title: str = "кафе") -> SummaryEntry:
+    return SummaryEntry("expense", record_id, Decimal("100"), title, "@user", datetime(2026, 10, 18, 12, 30))
+
+
+@pytest.mark.asyncio
+async def test_coalescer_merges_burst_into_one_message():
+    coalescer = ConfirmationCoalescer(window=60, flush_delay=0.01, max_entries=20)
+    bot = AsyncMock()
+    bot.send_message.return_value = MagicMock(message_id=5)
+
+    for record_id in range(1, 5):
+        await coalescer.add(bot, 10, 1, entry(record_id))
+    await asyncio.sleep(0.05)
+
+    # Одно сообщение и одна правка на всю серию
+    bot.send_message.assert_awaited_once()
+    bot.edit_message_text.assert_awaited_once()
+    text = bot.edit_message_text.await_args[0][0]
+    assert text.splitlines()[1:] == [f"{i}. Расход 100 — кафе, @user, 12:30" for i in range(1, 5)]
+    keyboard = bot.edit_message_text.await_args[1]["reply_markup"]
+    assert [b.callback_data for b in keyboard.inline_keyboard[0]] == [f"delete_expense:{i}" for i in range(1, 5)]
+
+
+@pytest.mark.asyncio
+async def test_coalescer_starts_new_summary_when_full():
+    coalescer = ConfirmationCoalescer(window=60, flush_delay=60, max_entries=2)
+    bot = AsyncMock()
+    bot.send_message.return_value = MagicMock(message_id=5)
+
+    for record_id in range(1, 4):
+        await coalescer.add(bot, 10, 1, entry(record_id))
+
+    assert bot.send_message.await_count == 2
+    await coalescer.stop(bot)
+    bot.edit_message_text.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_mark_deleted_live_summary():
+    coalescer = ConfirmationCoalescer(window=60, flush_delay=60, max_entries=20)
+    bot = AsyncMock()
+    bot.send_message.return_value = MagicMock(message_id=5)
+    await coalescer.add(bot, 10, 1, entry(1))
+    await coalescer.add(bot, 10, 1, entry(2, "такси"))
+
+    text, keyboard = coalescer.mark_deleted(1, MagicMock(message_id=5), "delete_expense:1")
+
+    assert "1. <s>Расход 100 — кафе, @user, 12:30</s>" in text
+    assert [b.text for b in keyboard.inline_keyboard[0]] == ["❌ 2"]
+    await coalescer.stop(bot)
+
+
+def test_mark_deleted_old_message_edits_text():
+    coalescer = ConfirmationCoalescer(window=60, flush_delay=60, max_entries=20)
+    text, keyboard = render_summary([entry(1), entry(2, "такси")])
+    message = MagicMock(message_id=7, html_text=text, reply_markup=keyboard)
+
+    text, keyboard = coalescer.mark_deleted(1, message, "delete_expense:2")
+
+    assert text.splitlines()[2] == "2. <s>Расход 100 — такси, @user, 12:30</s>"
+    assert keyboard == InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="❌ 1", callback_data="delete_expense:1")]
+    ])
+
+
+@pytest.mark.asyncio
+async def test_handle_expense_income_compact_mode(mocker):
+    message = AsyncMock()
+    message.text = "1000 еда"
+    message.from_user = MagicMock(id=1, username="testuser")
+    message.chat = MagicMock(id=123, type="group")
+    session = AsyncMock()
+    session.in_transaction = MagicMock(return_value=False)
+
+    mocker.patch("bot.handlers.finance.resolve_user", new=AsyncMock(return_value=MagicMock(id=1)))
+    mocker.patch(
+        "bot.handlers.finance.resolve_context",
+        new=AsyncMock(return_value=MagicMock(id=3, compact_confirmations=True, purging=False)),
+    )
+    mocker.patch("bot.handlers.finance.resolve_category", new=AsyncMock(return_value=MagicMock(id=1, title="еда")))
+    mocker.patch("bot.handlers.finance.insert_batcher.submit", new=AsyncMock(return_value=42))
+    add_mock = mocker.patch("bot.handlers.finance.confirmation_summaries.add", new=AsyncMock())
+
+    await finance.handle_expense_income(message, session)
+
+    message.answer.assert_not_awaited()
+    chat_id, context_id, added = add_mock.await_args[0][1:]
+    assert (chat_id, context_id, added.record_id, added.title) == (123, 3, 42, "еда")
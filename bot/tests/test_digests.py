@@ -0,0 +1,135 @@
+from datetime import date, datetime
+from decimal import Decimal
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from aiogram.exceptions import TelegramForbiddenError
+from sqlalchemy.dialects import postgresql
+
+import bot.handlers.statistics as statistics
+from bot.middlewares.outgoing import PRIORITY_BACKGROUND, send_priority
+from bot.services.digests import DigestScheduler, digest_period, format_digest
+
+
+def claim_result(rows):
+    return MagicMock(all=MagicMock(return_value=rows))
+
+
+def test_digest_period():
+    # 2025-07-16 — среда
+    assert digest_period("day", date(2025, 7, 16)) == (date(2025, 7, 15), date(2025, 7, 16))
+    assert digest_period("week", date(2025, 7, 16)) == (date(2025, 7, 7), date(2025, 7, 14))
+    assert digest_period("week", date(2025, 7, 14)) == (date(2025, 7, 7), date(2025, 7, 14))
+
+
+def test_format_digest():
+    rows = [("expense", "еда", Decimal("300")), ("expense", "<кафе>", Decimal("200")), ("income", "зарплата", Decimal("1000"))]
+
+    text = format_digest("day", date(2025, 7, 15), date(2025, 7, 16), rows)
+
+    assert text.startswith("📊 Сводка за 15.07.2025")
+    assert text.index("Доход") < text.index("Расход")
+    assert "300 еда\n200 &lt;кафе&gt;\n- - - - - - - - - -\nИтого: 500" in text
+    assert format_digest("day", date(2025, 7, 15), date(2025, 7, 16), []) is None
+
+
+@pytest.mark.asyncio
+async def test_tick_claims_set_wise_and_sends_in_background(make_session_factory):
+    session = AsyncMock()
+    session.execute.side_effect = [
+        # day: две подписки, у второй нет операций за вчера
+        claim_result([
+            (1, -100, "expense", "еда", Decimal("300")),
+            (1, -100, "income", "зарплата", Decimal("1000")),
+            (2, 200, None, None, None),
+        ]),
+        # week: подписок, по которым пора отправлять, нет
+        claim_result([]),
+    ]
+    priorities = []
+    bot = AsyncMock()
+    bot.send_message.side_effect = lambda *args: priorities.append(send_priority.get())
+    scheduler = DigestScheduler(make_session_factory(session), hour=9, batch_size=10)
+
+    sent = await scheduler.tick(bot, datetime(2025, 7, 16, 9, 0))
+
+    assert sent == 1
+    # Один запрос на порцию для всех чатов
+    assert session.execute.await_count == 2
+    params = session.execute.await_args_list[0].args[1]
+    assert params == {"period": "day", "period_start": date(2025, 7, 15), "period_end": date(2025, 7, 16), "limit": 10}
+    bot.send_message.assert_awaited_once()
+    assert bot.send_message.await_args.args[0] == -100
+    assert priorities == [PRIORITY_BACKGROUND]
+
+
+@pytest.mark.asyncio
+async def test_tick_takes_next_batch_and_filters_shard(make_session_factory):
+    session = AsyncMock()
+    session.execute.side_effect = [
+        claim_result([(1, 4, None, None, None), (2, 8, None, None, None)]),
+        claim_result([(3, 12, None, None, None)]),
+        claim_result([]),
+    ]
+    scheduler = DigestScheduler(make_session_factory(session), hour=9, batch_size=2)
+
+    await scheduler.tick(AsyncMock(), datetime(2025, 7, 16, 10, 0), shard=(0, 4))
+
+    calls = session.execute.await_args_list
+    assert [call.args[1]["period"] for call in calls] == ["day", "day", "week"]
+    assert "% :workers" in str(calls[0].args[0])
+    assert calls[0].args[1]["shard"] == 0 and calls[0].args[1]["workers"] == 4
+
+
+@pytest.mark.asyncio
+async def test_tick_before_hour_does_nothing(make_session_factory):
+    session = AsyncMock()
+    scheduler = DigestScheduler(make_session_factory(session), hour=9)
+
+    assert await scheduler.tick(AsyncMock(), datetime(2025, 7, 16, 8, 59)) == 0
+    session.execute.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_tick_unsubscribes_chats_that_blocked_bot(make_session_factory):
+    session = AsyncMock()
+    session.execute.side_effect = [claim_result([(5, 300, "expense", "еда", Decimal("1"))]), MagicMock(), claim_result([])]
+    bot = AsyncMock()
+    bot.send_message.side_effect = TelegramForbiddenError(method=MagicMock(), message="bot was blocked by the user")
+    scheduler = DigestScheduler(make_session_factory(session), hour=9)
+
+    assert await scheduler.tick(bot, datetime(2025, 7, 16, 9, 0)) == 0
+
+    delete = session.execute.await_args_list[1].args[0]
+    assert str(delete).startswith("DELETE FROM digest_subscriptions")
+    assert delete.compile().params["context_id_1"] == [5]
+
+
+@pytest.mark.asyncio
+async def test_digest_handler_subscribes(mocker):
+    message = AsyncMock()
+    message.chat = MagicMock(id=200, type="private")
+    mocker.patch("bot.handlers.statistics.get_context", new=AsyncMock(return_value=MagicMock(id=7)))
+    session = AsyncMock()
+
+    await statistics.digest_handler(message, MagicMock(args="week"), session)
+
+    statement = session.execute.await_args.args[0]
+    sql = str(statement.compile(dialect=postgresql.dialect()))
+    assert sql.startswith("INSERT INTO digest_subscriptions")
+    assert "ON CONFLICT (context_id, period) DO NOTHING" in sql
+    message.reply.assert_awaited_once()
+    assert "прошлую неделю" in message.reply.await_args.args[0]
+
+
+@pytest.mark.asyncio
+async def test_digest_handler_requires_admin_in_group(mocker):
+    message = AsyncMock()
+    message.chat = MagicMock(id=-100, type="group")
+    mocker.patch("bot.handlers.statistics.is_admin", new=AsyncMock(return_value=False))
+    session = AsyncMock()
+
+    await statistics.digest_handler(message, MagicMock(args="day"), session)
+
+    session.execute.assert_not_awaited()
+    message.reply.assert_awaited_once()
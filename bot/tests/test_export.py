@@ -0,0 +1,91 @@
+from datetime import datetime
+from decimal import Decimal
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+import bot.handlers.export as handlers
+from bot.services import export
+
+
+class FakeStreamResult:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def partitions(self):
+        for chunk in self.chunks:
+            yield chunk
+
+
+@pytest.mark.asyncio
+async def test_export_operations_streams_csv_in_chunks():
+    chunks = [
+        [(datetime(2026, 10, 1, 9, 30), "expense", Decimal("100.50"), "кафе")],
+        [(datetime(2026, 10, 2, 18, 0), "income", Decimal("5000"), "зарплата")],
+    ]
+    session = MagicMock()
+    session.stream = AsyncMock(return_value=FakeStreamResult(chunks))
+
+    file, count = await export.export_operations(session, "csv", 1, 2)
+
+    assert count == 2
+    assert session.stream.await_args[1]["execution_options"] == {"yield_per": export.settings.export_chunk_size}
+    file.seek(0)
+    assert file.read().decode("utf-8-sig").splitlines() == [
+        "Дата;Тип;Сумма;Категория",
+        "01.10.2026 09:30;расход;100.50;кафе",
+        "02.10.2026 18:00;доход;5000;зарплата",
+    ]
+    file.close()
+
+
+@pytest.mark.asyncio
+async def test_spooled_input_file_reads_in_chunks():
+    file = export.SpooledTemporaryFile()
+    file.write(b"a" * 10)
+    input_file = export.SpooledInputFile(file, "operations.csv")
+    input_file.chunk_size = 4
+
+    chunks = [chunk async for chunk in input_file.read(None)]
+
+    assert chunks == [b"aaaa", b"aaaa", b"aa"]
+
+
+@pytest.mark.asyncio
+async def test_export_handler_invalid_period():
+    message = AsyncMock()
+    command = MagicMock(args="вчера")
+
+    await handlers.export_handler(message, command, AsyncMock())
+
+    assert message.answer.await_args[0][0].startswith("Для выгрузки операций")
+    message.answer_document.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_export_handler_sends_document(mocker):
+    message = AsyncMock()
+    message.from_user = MagicMock(id=1)
+    command = MagicMock(args="01.10.2026 - 31.10.2026 csv")
+    file = MagicMock()
+    file.__enter__ = MagicMock(return_value=file)
+    file.__exit__ = MagicMock(return_value=False)
+
+    mocker.patch("bot.handlers.export.resolve_context", new=AsyncMock(return_value=MagicMock(id=3)))
+    mocker.patch("bot.handlers.export.resolve_existing_user", new=AsyncMock(return_value=MagicMock(id=4)))
+    export_mock = mocker.patch("bot.handlers.export.export_operations", new=AsyncMock(return_value=(file, 7)))
+
+    session = AsyncMock()
+    session.commit.side_effect = lambda: message.answer_document.assert_not_awaited()
+
+    await handlers.export_handler(message, command, session)
+
+    # Соединение освобождается до загрузки файла в Telegram
+    session.commit.assert_awaited_once()
+    fmt, context_id, user_id, date_from, date_to = export_mock.await_args[0][1:]
+    assert (fmt, context_id, user_id) == ("csv", 3, 4)
+    assert date_from == datetime(2026, 10, 1) and date_to == datetime(2026, 11, 1)
+    document = message.answer_document.await_args[0][0]
+    assert document.filename.endswith(".csv")
+    assert message.answer_document.await_args[1]["caption"] == "Операции c 01.10.2026 по 31.10.2026: 7"
+    file.__exit__.assert_called_once()
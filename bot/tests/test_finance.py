@@ -1,3 +1,4 @@
+from decimal import Decimal
 from unittest.mock import AsyncMock, MagicMock
 
 import pytest
@@ -17,18 +18,19 @@ async def test_handle_expense_income_valid_expense(mocker):
     mock_session = AsyncMock()
     mock_session.add = MagicMock()
     mock_session.commit = AsyncMock()
+    mock_session.in_transaction = MagicMock(return_value=False)
 
-    mocker.patch("bot.handlers.finance.get_or_create_user", new=AsyncMock(return_value=MagicMock(id=1)))
-    mocker.patch("bot.handlers.finance.get_or_create_context", new=AsyncMock(return_value=MagicMock(id=1)))
-    mocker.patch("bot.handlers.finance.get_category", new=AsyncMock(return_value=MagicMock(id=1, title="еда")))
-    mocker.patch("bot.handlers.finance.Expense", autospec=True)
+    mocker.patch("bot.handlers.finance.resolve_user", new=AsyncMock(return_value=MagicMock(id=1)))
+    mocker.patch("bot.handlers.finance.resolve_context", new=AsyncMock(return_value=MagicMock(id=1, compact_confirmations=False, purging=False)))
+    mocker.patch("bot.handlers.finance.resolve_category", new=AsyncMock(return_value=MagicMock(id=1, title="еда")))
+    submit_mock = mocker.patch("bot.handlers.finance.insert_batcher.submit", new=AsyncMock(return_value=42))
     mocker.patch("bot.handlers.finance.datetime", wraps=finance.datetime)
-    mocker.patch("bot.handlers.finance.get_async_session", return_value=AsyncMock(__aenter__=AsyncMock(return_value=mock_session), __aexit__=AsyncMock()))
 
-    await finance.handle_expense_income(message)
+    await finance.handle_expense_income(message, mock_session)
     message.answer.assert_awaited()
-    assert mock_session.add.call_count == 1
-    assert mock_session.commit.await_count == 1
+    assert submit_mock.await_args[0][:5] == ("expense", 1, 1, 1, Decimal("1000"))
+    keyboard = message.answer.call_args[1]["reply_markup"]
+    assert keyboard.inline_keyboard[0][0].callback_data == "delete_expense:42"
 
 @pytest.mark.asyncio
 async def test_handle_expense_income_invalid_format(mocker):
@@ -36,8 +38,7 @@ async def test_handle_expense_income_invalid_format(mocker):
     message.text = "еда 1000"
     message.reply = AsyncMock()
     message.answer = AsyncMock()
-    mocker.patch("bot.handlers.finance.get_async_session", return_value=AsyncMock(__aenter__=AsyncMock(), __aexit__=AsyncMock()))
-    await finance.handle_expense_income(message)
+    await finance.handle_expense_income(message, AsyncMock())
     message.reply.assert_not_awaited()
     message.answer.assert_not_awaited()
 
@@ -50,14 +51,27 @@ async def test_delete_record_callback_not_author(mocker):
     callback.message = AsyncMock()
 
     mock_session = AsyncMock()
-    mock_session.get = AsyncMock(return_value=MagicMock(user_id=1))
+    mock_session.get = AsyncMock(return_value=MagicMock(user_id=1, kind="expense"))
     mock_session.execute = AsyncMock(return_value=MagicMock(scalars=MagicMock(return_value=MagicMock(first=MagicMock(return_value=MagicMock(id=3))))))
 
-    mocker.patch("bot.handlers.finance.get_async_session", return_value=AsyncMock(__aenter__=AsyncMock(return_value=mock_session), __aexit__=AsyncMock()))
 
-    await finance.delete_record_callback(callback)
+    await finance.delete_record_callback(callback, mock_session)
     callback.answer.assert_awaited_with("Вы не можете удалить эту запись.", show_alert=True)
 
+@pytest.mark.asyncio
+async def test_delete_record_callback_kind_mismatch():
+    # id общий для расходов и доходов: кнопка дохода не удаляет расход с тем же id
+    callback = AsyncMock()
+    callback.data = "delete_income:1"
+    callback.from_user = MagicMock(id=1)
+    mock_session = AsyncMock()
+    mock_session.get = AsyncMock(return_value=MagicMock(user_id=1, kind="expense"))
+
+    await finance.delete_record_callback(callback, mock_session)
+
+    callback.answer.assert_awaited_with("Запись уже удалена или не найдена.", show_alert=True)
+    mock_session.delete.assert_not_awaited()
+
 @pytest.mark.asyncio
 async def test_delete_record_callback_success(mocker):
     callback = AsyncMock()
@@ -65,20 +79,22 @@ async def test_delete_record_callback_success(mocker):
     callback.from_user = MagicMock(id=1)
     callback.answer = AsyncMock()
     callback.message = AsyncMock()
+    callback.message.text = "Доход добавлен!"
 
     mock_session = AsyncMock()
-    mock_session.get = AsyncMock(return_value=MagicMock(user_id=1))
+    mock_session.get = AsyncMock(return_value=MagicMock(user_id=1, kind="income"))
     mock_session.execute = AsyncMock(return_value=MagicMock(scalars=MagicMock(return_value=MagicMock(first=MagicMock(return_value=MagicMock(id=1))))))
     mock_session.delete = AsyncMock()
+    mock_session.info = {}
     mock_session.commit = AsyncMock()
 
-    mocker.patch("bot.handlers.finance.get_async_session", return_value=AsyncMock(__aenter__=AsyncMock(return_value=mock_session), __aexit__=AsyncMock()))
 
-    await finance.delete_record_callback(callback)
+    await finance.delete_record_callback(callback, mock_session)
     callback.message.edit_text.assert_awaited_with("Запись удалена.")
     callback.answer.assert_awaited()
     assert mock_session.delete.await_count == 1
-    assert mock_session.commit.await_count == 1
+    # Коммит выполняет DbSessionMiddleware
+    mock_session.commit.assert_not_awaited()
 
 @pytest.mark.asyncio
 async def test_handle_expense_income_valid_income(mocker):
@@ -92,15 +108,131 @@ async def test_handle_expense_income_valid_income(mocker):
     mock_session = AsyncMock()
     mock_session.add = MagicMock()
     mock_session.commit = AsyncMock()
+    mock_session.in_transaction = MagicMock(return_value=False)
 
-    mocker.patch("bot.handlers.finance.get_or_create_user", new=AsyncMock(return_value=MagicMock(id=1)))
-    mocker.patch("bot.handlers.finance.get_or_create_context", new=AsyncMock(return_value=MagicMock(id=1)))
-    mocker.patch("bot.handlers.finance.get_category", new=AsyncMock(return_value=MagicMock(id=1, title="зарплата")))
-    mocker.patch("bot.handlers.finance.Income", autospec=True)
+    mocker.patch("bot.handlers.finance.resolve_user", new=AsyncMock(return_value=MagicMock(id=1)))
+    mocker.patch("bot.handlers.finance.resolve_context", new=AsyncMock(return_value=MagicMock(id=1, compact_confirmations=False, purging=False)))
+    mocker.patch("bot.handlers.finance.resolve_category", new=AsyncMock(return_value=MagicMock(id=1, title="зарплата")))
+    submit_mock = mocker.patch("bot.handlers.finance.insert_batcher.submit", new=AsyncMock(return_value=42))
     mocker.patch("bot.handlers.finance.datetime", wraps=finance.datetime)
-    mocker.patch("bot.handlers.finance.get_async_session", return_value=AsyncMock(__aenter__=AsyncMock(return_value=mock_session), __aexit__=AsyncMock()))
 
-    await finance.handle_expense_income(message)
+    await finance.handle_expense_income(message, mock_session)
     message.answer.assert_awaited()
-    assert mock_session.add.call_count == 1
-    assert mock_session.commit.await_count == 1
+    assert submit_mock.await_args[0][:5] == ("income", 1, 1, 1, Decimal("5000"))
+
+@pytest.mark.asyncio
+async def test_handle_expense_income_suggests_closest_category(mocker):
+    message = AsyncMock()
+    message.text = "250 продуктв"
+    message.from_user = MagicMock(id=1, username="testuser", first_name="Test")
+    message.chat = MagicMock(id=123, type="private")
+
+    mocker.patch("bot.handlers.finance.resolve_user", new=AsyncMock(return_value=MagicMock(id=1)))
+    mocker.patch("bot.handlers.finance.resolve_context", new=AsyncMock(return_value=MagicMock(id=1, purging=False)))
+    mocker.patch("bot.handlers.finance.resolve_category", new=AsyncMock(return_value=None))
+    suggestion = MagicMock(id=17)
+    suggestion.title = "продукты"
+    mocker.patch("bot.handlers.finance.suggest_category", new=AsyncMock(return_value=suggestion))
+    submit_mock = mocker.patch("bot.handlers.finance.insert_batcher.submit", new=AsyncMock())
+
+    await finance.handle_expense_income(message, AsyncMock())
+
+    submit_mock.assert_not_awaited()
+    button = message.reply.call_args[1]["reply_markup"].inline_keyboard[0][0]
+    assert button.text == "Записать в «продукты»"
+    assert button.callback_data == "suggest_expense:17:250"
+
+@pytest.mark.asyncio
+async def test_suggest_category_callback_records_operation(mocker):
+    callback = AsyncMock()
+    callback.data = "suggest_expense:17:250"
+    callback.from_user = MagicMock(id=1, username="testuser", first_name="Test")
+    callback.message = AsyncMock()
+    callback.message.reply_to_message.from_user.id = 1
+
+    mock_session = AsyncMock()
+    mock_session.get = AsyncMock(return_value=MagicMock(title="продукты"))
+    mock_session.in_transaction = MagicMock(return_value=False)
+    mocker.patch("bot.handlers.finance.resolve_user", new=AsyncMock(return_value=MagicMock(id=1)))
+    mocker.patch("bot.handlers.finance.resolve_context", new=AsyncMock(return_value=MagicMock(id=1, purging=False)))
+    mocker.patch("bot.handlers.finance.resolve_category", new=AsyncMock(return_value=MagicMock(id=17, title="продукты")))
+    submit_mock = mocker.patch("bot.handlers.finance.insert_batcher.submit", new=AsyncMock(return_value=42))
+
+    await finance.suggest_category_callback(callback, mock_session)
+
+    assert submit_mock.await_args[0][:5] == ("expense", 1, 1, 17, Decimal("250"))
+    keyboard = callback.message.edit_text.call_args[1]["reply_markup"]
+    assert keyboard.inline_keyboard[0][0].callback_data == "delete_expense:42"
+
+@pytest.mark.asyncio
+async def test_suggest_category_callback_only_for_author(mocker):
+    callback = AsyncMock()
+    callback.data = "suggest_expense:17:250"
+    callback.from_user = MagicMock(id=2)
+    callback.message = AsyncMock()
+    callback.message.reply_to_message.from_user.id = 1
+    submit_mock = mocker.patch("bot.handlers.finance.insert_batcher.submit", new=AsyncMock())
+
+    await finance.suggest_category_callback(callback, AsyncMock())
+
+    submit_mock.assert_not_awaited()
+    callback.answer.assert_awaited_with("Вы не можете выбрать категорию за другого пользователя.", show_alert=True)
+
+@pytest.mark.asyncio
+async def test_handle_expense_income_batch(mocker):
+    message = AsyncMock()
+    message.text = "1000 кафе\n+5000 зарплата\n300 таксии\nпривет"
+    message.from_user = MagicMock(id=1, username="testuser")
+    message.chat = MagicMock(id=123, type="group")
+    session = AsyncMock()
+
+    mocker.patch("bot.handlers.finance.resolve_user", new=AsyncMock(return_value=MagicMock(id=1)))
+    mocker.patch("bot.handlers.finance.resolve_context", new=AsyncMock(return_value=MagicMock(id=3, purging=False)))
+    cafe = MagicMock(id=11)
+    cafe.title = "кафе"
+    salary = MagicMock(id=12)
+    salary.title = "зарплата"
+    titles_mock = mocker.patch(
+        "bot.handlers.finance.get_categories_by_titles",
+        new=AsyncMock(return_value={"кафе": cafe, "зарплата": salary}),
+    )
+    insert_mock = mocker.patch("bot.handlers.finance.insert_operations", new=AsyncMock(return_value=[1, 2]))
+
+    await finance.handle_expense_income(message, session)
+
+    assert titles_mock.await_args[0][1] == {"кафе", "зарплата", "таксии"}
+    records = insert_mock.await_args[0][1]
+    assert [(r.kind, r.category_id, r.amount) for r in records] == [
+        ("expense", 11, Decimal("1000")), ("income", 12, Decimal("5000"))
+    ]
+    # У операций одного сообщения общее время — по нему работает отмена
+    assert records[0].created_at == records[1].created_at
+    session.commit.assert_awaited_once()
+    text = message.reply.await_args[0][0]
+    assert text.splitlines() == [
+        "Записано операций: 2 из 4",
+        "1. Расход 1000 — кафе",
+        "2. Доход 5000 — зарплата",
+        "3. ✖ 300 таксии — категория не найдена",
+        "4. ✖ привет — не распознана",
+    ]
+    button = message.reply.await_args[1]["reply_markup"].inline_keyboard[0][0]
+    timestamp = int(button.callback_data.split(":")[1])
+    assert finance.EPOCH + finance.timedelta(microseconds=timestamp) == records[0].created_at
+
+@pytest.mark.asyncio
+async def test_undo_batch_callback(mocker):
+    callback = AsyncMock()
+    callback.data = "undo_batch:1760790600123456"
+    callback.from_user = MagicMock(id=1)
+    session = AsyncMock()
+    session.info = {}
+
+    mocker.patch("bot.handlers.finance.resolve_existing_user", new=AsyncMock(return_value=MagicMock(id=2)))
+    mocker.patch("bot.handlers.finance.resolve_context", new=AsyncMock(return_value=MagicMock(id=3, purging=False)))
+    delete_mock = mocker.patch("bot.handlers.finance.delete_operations_at", new=AsyncMock(return_value=2))
+
+    await finance.undo_batch_callback(callback, session)
+
+    assert delete_mock.await_args[0][1:] == (3, 2, finance.datetime(2025, 10, 18, 12, 30, 0, 123456))
+    callback.message.edit_text.assert_awaited_with("Отменено операций: 2.")
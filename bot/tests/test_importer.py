@@ -0,0 +1,97 @@
+from datetime import date, datetime
+from decimal import Decimal
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+import bot.handlers.importer as handlers
+from bot.services import importer
+
+
+def test_parse_statement_detects_columns_and_sign():
+    data = (
+        "Дата операции;Сумма;Категория\n"
+        "01.10.2026 09:30;-1 200,50;Кафе\n"
+        "02.10.2026;50000;зарплата\n"
+        "вчера;100;кафе\n"
+    ).encode("cp1251")
+
+    parsed = importer.parse_statement(data)
+
+    assert parsed.rows[0][:4] == ("expense", datetime(2026, 10, 1, 9, 30), Decimal("1200.50"), "Кафе")
+    assert parsed.rows[1][:4] == ("income", datetime(2026, 10, 2), Decimal("50000"), "зарплата")
+    assert parsed.failed == [(["вчера", "100", "кафе"], "неверная дата 'вчера'")]
+
+
+def test_parse_statement_uses_explicit_mapping():
+    data = "When,Value,What,Kind\n2026-10-01,300,такси,расход\n".encode()
+    mapping = importer.parse_mapping("дата=When; сумма=Value; категория=What; тип=Kind")
+
+    parsed = importer.parse_statement(data, mapping)
+
+    assert parsed.rows[0][:4] == ("expense", datetime(2026, 10, 1), Decimal("300"), "такси")
+
+
+def test_parse_statement_requires_columns():
+    with pytest.raises(importer.StatementError):
+        importer.parse_statement("Дата;Сумма\n01.10.2026;100\n".encode())
+
+
+@pytest.mark.asyncio
+async def test_import_operations_copies_rows_and_rolls_up(mocker):
+    cafe = MagicMock(id=11)
+    cafe.title = "кафе"
+    mocker.patch("bot.services.importer.get_categories_by_titles", new=AsyncMock(return_value={"кафе": cafe}))
+    add_totals = mocker.patch("bot.services.importer.add_daily_totals", new=AsyncMock())
+    driver = MagicMock(copy_records_to_table=AsyncMock())
+    connection = MagicMock(get_raw_connection=AsyncMock(return_value=MagicMock(driver_connection=driver)))
+    session = MagicMock(connection=AsyncMock(return_value=connection))
+    rows = [
+        importer.ImportRow("expense", datetime(2026, 10, 1, 9), Decimal("100"), "Кафе", ["a"]),
+        importer.ImportRow("expense", datetime(2026, 10, 1, 20), Decimal("50"), "кафе", ["b"]),
+        importer.ImportRow("expense", datetime(2026, 10, 1), Decimal("10"), "нет такой", ["c"]),
+    ]
+
+    imported, failed = await importer.import_operations(session, rows, 7, MagicMock(id=3))
+
+    assert imported == 2
+    assert failed == [(["c"], "категория 'нет такой' не найдена")]
+    table = driver.copy_records_to_table.await_args
+    assert table[0][0] == "operations"
+    assert table[1]["columns"] == importer.COPY_COLUMNS
+    assert [record[0] for record in table[1]["records"]] == ["expense", "expense"]
+    add_totals.assert_awaited_once_with(session, [("expense", 3, 7, 11, date(2026, 10, 1), Decimal("150"), 2)])
+
+
+@pytest.mark.asyncio
+async def test_import_handler_without_file_shows_help():
+    message = AsyncMock()
+    message.document = None
+    message.reply_to_message = None
+
+    await handlers.import_handler(message, MagicMock(args=None), AsyncMock())
+
+    message.answer.assert_awaited_with(handlers.IMPORT_HELP)
+
+
+@pytest.mark.asyncio
+async def test_import_handler_reports_failed_rows(mocker):
+    message = AsyncMock()
+    message.document = MagicMock(file_size=100)
+
+    async def download(document, destination):
+        destination.write("Дата;Сумма;Категория\n01.10.2026;-100;кафе\nплохая;строка;\n".encode())
+
+    message.bot.download = download
+    mocker.patch("bot.handlers.importer.resolve_user", new=AsyncMock(return_value=MagicMock(id=7)))
+    mocker.patch("bot.handlers.importer.resolve_context", new=AsyncMock(return_value=MagicMock(id=3, purging=False)))
+    import_mock = mocker.patch("bot.handlers.importer.import_operations", new=AsyncMock(return_value=(1, [])))
+    session = AsyncMock()
+
+    await handlers.import_handler(message, MagicMock(args=None), session)
+
+    assert len(import_mock.await_args[0][1]) == 1
+    session.commit.assert_awaited_once()
+    report = message.answer_document.await_args[0][0]
+    assert report.filename == "import_errors.csv"
+    assert message.answer_document.await_args[1]["caption"].startswith("Импортировано операций: 1\n")
@@ -0,0 +1,87 @@
+import asyncio
+from datetime import datetime
+from decimal import Decimal
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from bot.services.ingest import InsertBatcher, delete_operations_at
+
+
+@pytest.mark.asyncio
+async def test_insert_batcher_flushes_burst_in_one_transaction(mocker, make_session_factory):
+    add_daily_totals_mock = mocker.patch("bot.services.ingest.add_daily_totals", new=AsyncMock())
+    session = AsyncMock()
+    session.execute.return_value = MagicMock(
+        scalars=MagicMock(return_value=MagicMock(all=MagicMock(return_value=[10, 20, 11])))
+    )
+    batcher = InsertBatcher(make_session_factory(session), max_batch_size=10, max_latency=0.05)
+    await batcher.start()
+
+    now = datetime(2025, 7, 15, 12, 0)
+    ids = await asyncio.gather(
+        batcher.submit("expense", 1, 1, 1, Decimal("100"), now),
+        batcher.submit("income", 1, 1, 2, Decimal("5000"), now),
+        batcher.submit("expense", 1, 1, 1, Decimal("50"), now),
+    )
+    await batcher.stop()
+
+    assert ids == [10, 20, 11]
+    # Расходы и доходы — один INSERT в одну таблицу
+    assert session.execute.await_count == 1
+    assert [row["kind"] for row in session.execute.await_args[0][1]] == ["expense", "income", "expense"]
+    assert session.commit.await_count == 1
+    # Одна строка агрегата на ключ: два расхода одной категории за день сложены
+    rows = add_daily_totals_mock.await_args[0][1]
+    assert ("expense", 1, 1, 1, now.date(), Decimal("150"), 2) in rows
+    assert ("income", 1, 1, 2, now.date(), Decimal("5000"), 1) in rows
+
+
+@pytest.mark.asyncio
+async def test_insert_batcher_isolates_failing_record(mocker):
+    batcher = InsertBatcher(MagicMock(), max_batch_size=10, max_latency=0.05)
+
+    async def write(batch):
+        if any(record.category_id == 13 for record in batch):
+            raise ValueError("bad category")
+        return {id(record): record.category_id * 10 for record in batch}
+
+    mocker.patch.object(batcher, "_write", side_effect=write)
+    await batcher.start()
+
+    now = datetime(2025, 7, 15, 12, 0)
+    results = await asyncio.gather(
+        batcher.submit("expense", 1, 1, 1, Decimal("100"), now),
+        batcher.submit("expense", 1, 1, 13, Decimal("100"), now),
+        return_exceptions=True,
+    )
+    await batcher.stop()
+
+    assert results[0] == 10
+    assert isinstance(results[1], ValueError)
+
+
+@pytest.mark.asyncio
+async def test_insert_batcher_requires_start():
+    batcher = InsertBatcher(MagicMock())
+    with pytest.raises(RuntimeError):
+        await batcher.submit("expense", 1, 1, 1, Decimal("1"), datetime(2025, 7, 15))
+
+
+@pytest.mark.asyncio
+async def test_delete_operations_at_subtracts_rollup(mocker):
+    add_daily_totals_mock = mocker.patch("bot.services.ingest.add_daily_totals", new=AsyncMock())
+    session = AsyncMock()
+    session.execute.return_value = [("income", 7, Decimal("5000")), ("expense", 3, Decimal("100")), ("expense", 3, Decimal("50"))]
+    created_at = datetime(2026, 10, 18, 12, 30, 0, 123456)
+
+    deleted = await delete_operations_at(session, 1, 2, created_at)
+
+    assert deleted == 3
+    assert session.execute.await_count == 1
+    assert "operations.created_at = " in str(session.execute.await_args[0][0])
+    rows = add_daily_totals_mock.await_args[0][1]
+    assert sorted(rows) == sorted([
+        ("income", 1, 2, 7, created_at.date(), Decimal("-5000"), -1),
+        ("expense", 1, 2, 3, created_at.date(), Decimal("-150"), -2),
+    ])
@@ -0,0 +1,177 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+import pytest_asyncio
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import AnswerCallbackQuery, SendDocument, SendMessage
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from bot.middlewares import DbSessionMiddleware, OutgoingRateLimiter
+from bot.services.db import after_commit
+
+
+def make_limiter(**kwargs):
+    options = dict(global_rate=30, group_rate=20 / 60, private_rate=1, chat_burst=1, max_retries=2)
+    options.update(kwargs)
+    return OutgoingRateLimiter(**options)
+
+
+@pytest.mark.asyncio
+async def test_db_session_middleware_commits_once(make_session_factory):
+    session = AsyncMock()
+    session.info = {}
+
+    async def handler(event, data):
+        assert data["session"] is session
+        return "ok"
+
+    result = await DbSessionMiddleware(make_session_factory(session))(handler, MagicMock(), {})
+
+    assert result == "ok"
+    assert session.commit.await_count == 1
+    session.rollback.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_db_session_middleware_rolls_back_on_error(make_session_factory):
+    session = AsyncMock()
+    session.info = {}
+
+    async def handler(event, data):
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        await DbSessionMiddleware(make_session_factory(session))(handler, MagicMock(), {})
+
+    session.commit.assert_not_awaited()
+    assert session.rollback.await_count == 1
+
+
+@pytest_asyncio.fixture
+async def engine(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'bot.db'}")
+    yield engine
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_after_commit_runs_on_commit_and_not_on_rollback(engine):
+    committed, rolled_back = MagicMock(), MagicMock()
+
+    async def handler(event, data):
+        await data["session"].execute(text("SELECT 1"))
+        after_commit(data["session"], committed)
+
+    async def failing_handler(event, data):
+        await data["session"].execute(text("SELECT 1"))
+        after_commit(data["session"], rolled_back)
+        raise ValueError("boom")
+
+    await DbSessionMiddleware(async_sessionmaker(engine))(handler, MagicMock(), {})
+    with pytest.raises(ValueError):
+        await DbSessionMiddleware(async_sessionmaker(engine))(failing_handler, MagicMock(), {})
+
+    committed.assert_called_once()
+    rolled_back.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_after_commit_runs_on_explicit_commit_before_failed_reply(engine):
+    callback = MagicMock()
+
+    async def handler(event, data):
+        # Как импорт выписки: коммит в обработчике, затем ответ, который не дошел
+        after_commit(data["session"], callback)
+        await data["session"].commit()
+        raise RuntimeError("Telegram недоступен")
+
+    with pytest.raises(RuntimeError):
+        await DbSessionMiddleware(async_sessionmaker(engine))(handler, MagicMock(), {})
+
+    callback.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_limiter_wait_does_not_hold_db_connection(engine):
+    # Группа: одно сообщение сразу, следующее — через 0.2 с
+    limiter = make_limiter(group_rate=5, chat_burst=1)
+    checked_out = []
+
+    async def make_request(bot, method):
+        checked_out.append(engine.pool.checkedout())
+        return True
+
+    async def handler(event, data):
+        await data["session"].execute(text("SELECT 1"))
+        assert engine.pool.checkedout() == 1
+        await limiter(make_request, MagicMock(), SendMessage(chat_id=-100, text="первое"))
+        await limiter(make_request, MagicMock(), SendMessage(chat_id=-100, text="второе"))
+
+    # Пока обработчик ждет очереди, соединение обновления уже в пуле
+    await DbSessionMiddleware(async_sessionmaker(engine))(handler, MagicMock(), {})
+
+    assert checked_out == [0, 0]
+    await limiter.stop()
+
+
+@pytest.mark.asyncio
+async def test_outgoing_limiter_grants_by_priority_and_chat():
+    limiter = make_limiter(global_rate=2)
+    loop = asyncio.get_running_loop()
+    futures = [loop.create_future() for _ in range(4)]
+    # (приоритет, порядок, чат, стоимость, future)
+    limiter._waiters = sorted([
+        (1, 0, -100, 1, futures[0]),
+        (0, 1, -100, 1, futures[1]),
+        (0, 2, -100, 1, futures[2]),
+        (0, 3, -200, 1, futures[3]),
+    ])
+
+    delay = limiter._grant(now=0.0)
+
+    # Подтверждение в группу -100 уходит первым, второе ждет корзину чата,
+    # но не задерживает группу -200; общий лимит (2 в секунду) исчерпан
+    assert [f.done() for f in futures] == [False, True, False, True]
+    assert delay == pytest.approx(0.5)
+    assert limiter.queue_depth == 2
+
+    limiter._grant(now=1.0)
+    assert not futures[0].done() and not futures[2].done()
+    limiter._grant(now=3.0)
+    assert futures[2].done() and not futures[0].done()
+
+
+@pytest.mark.asyncio
+async def test_outgoing_limiter_retries_after_flood_control():
+    limiter = make_limiter(private_rate=1000)
+    method = SendMessage(chat_id=1, text="ok")
+    make_request = AsyncMock(side_effect=[TelegramRetryAfter(method, "Too Many Requests", 0), "sent"])
+
+    assert await limiter(make_request, MagicMock(), method) == "sent"
+    assert make_request.await_count == 2
+    await limiter.stop()
+
+
+@pytest.mark.asyncio
+async def test_outgoing_limiter_gives_up_after_max_retries():
+    limiter = make_limiter(private_rate=1000, max_retries=1)
+    method = SendDocument(chat_id=1, document="file_id")
+    make_request = AsyncMock(side_effect=TelegramRetryAfter(method, "Too Many Requests", 0))
+
+    with pytest.raises(TelegramRetryAfter):
+        await limiter(make_request, MagicMock(), method)
+    assert make_request.await_count == 2
+    await limiter.stop()
+
+
+@pytest.mark.asyncio
+async def test_outgoing_limiter_skips_methods_without_chat():
+    limiter = make_limiter()
+    make_request = AsyncMock(return_value=True)
+
+    await limiter(make_request, MagicMock(), AnswerCallbackQuery(callback_query_id="1"))
+
+    make_request.assert_awaited_once()
+    assert limiter._task is None
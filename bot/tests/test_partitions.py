@@ -0,0 +1,94 @@
+from datetime import date
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from bot.services.partitions import (
+    add_months,
+    archive_partitions,
+    ensure_partitions,
+    partition_name,
+    partitions_ddl,
+)
+
+
+def test_add_months_crosses_year():
+    assert add_months(date(2025, 11, 1), 3) == date(2026, 2, 1)
+    assert add_months(date(2025, 1, 1), -1) == date(2024, 12, 1)
+
+
+def test_partition_name():
+    assert partition_name("operations", date(2025, 7, 1)) == "operations_y2025m07"
+
+
+def test_partitions_ddl():
+    statements = partitions_ddl(date(2025, 12, 1), date(2026, 1, 1))
+    assert statements == [
+        "CREATE TABLE operations_default PARTITION OF operations DEFAULT",
+        "CREATE TABLE operations_y2025m12 PARTITION OF operations FOR VALUES FROM ('2025-12-01') TO ('2026-01-01')",
+        "CREATE TABLE operations_y2026m01 PARTITION OF operations FOR VALUES FROM ('2026-01-01') TO ('2026-02-01')",
+    ]
+
+
+def _session(partitions: list[str], default_months: list[date]):
+    session = AsyncMock()
+
+    async def execute(statement, params=None):
+        sql = str(statement)
+        if "pg_inherits" in sql:
+            table = params["table"]
+            return [(f"{table}_{suffix}",) for suffix in partitions]
+        if "_default" in sql and sql.startswith("SELECT"):
+            return [(month,) for month in default_months]
+        return MagicMock()
+
+    session.execute = AsyncMock(side_effect=execute)
+    return session
+
+
+def _statements(session) -> list[str]:
+    return [str(call.args[0]) for call in session.execute.call_args_list]
+
+
+@pytest.mark.asyncio
+async def test_ensure_partitions_creates_missing_months():
+    session = _session(["default", "y2025m07"], [date(2024, 3, 1)])
+
+    created = await ensure_partitions(session, date(2025, 7, 15), months_ahead=1)
+
+    assert created == ["operations_y2024m03", "operations_y2025m08"]
+    statements = _statements(session)
+    assert (
+        "ALTER TABLE operations ATTACH PARTITION operations_y2024m03 FOR VALUES FROM ('2024-03-01') TO ('2024-04-01')"
+        in statements
+    )
+    # Строки месяца переносятся из секции по умолчанию
+    assert any(s.startswith("WITH moved AS (DELETE FROM operations_default") for s in statements)
+    assert session.commit.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_archive_partitions_detaches_old_months():
+    session = _session(["default", "y2025m04", "y2025m05", "y2025m06", "y2025m07"], [])
+
+    archived = await archive_partitions(session, date(2025, 7, 15), retention_months=2)
+
+    assert archived == ["operations_y2025m04"]
+    statements = _statements(session)
+    assert "ALTER TABLE operations DETACH PARTITION operations_y2025m04" in statements
+    assert "ALTER TABLE operations_y2025m04 SET SCHEMA archive" in statements
+    assert not any("y2025m05" in s for s in statements)
+    rollup_deletes = [
+        call.args[1] for call in session.execute.call_args_list
+        if str(call.args[0]).startswith("DELETE FROM daily_totals")
+    ]
+    assert rollup_deletes == [{"lower": date(2025, 4, 1), "upper": date(2025, 5, 1)}]
+
+
+@pytest.mark.asyncio
+async def test_archive_partitions_drop():
+    session = _session(["y2020m01"], [])
+
+    await archive_partitions(session, date(2025, 7, 15), retention_months=12, drop=True)
+
+    assert "DROP TABLE operations_y2020m01" in _statements(session)
@@ -0,0 +1,88 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+import bot.handlers.categories as categories
+import bot.handlers.finance as finance
+from bot.services.purge import PURGE_DONE, PURGE_REJECTED, ContextPurger
+
+
+@pytest.mark.asyncio
+async def test_purge_deletes_in_batches_and_context_last(make_session_factory):
+    session = AsyncMock()
+    # operations: полная порция, затем остаток; остальные таблицы — по одной неполной
+    session.execute.side_effect = [MagicMock(rowcount=rowcount) for rowcount in (2, 1, 0, 0, 0, 1, 1)]
+    purger = ContextPurger(make_session_factory(session), batch_size=2, progress_interval=0)
+    bot = AsyncMock()
+
+    purger.start(bot, 7, -100, "group", 55)
+    assert purger.is_running(7)
+    await asyncio.gather(*purger._tasks.values())
+
+    statements = [str(call.args[0]) for call in session.execute.await_args_list]
+    assert [s.split()[2] for s in statements] == [
+        "operations", "operations", "daily_totals", "budget_spending", "budgets", "categories", "contexts"
+    ]
+    assert all(call.args[1]["limit"] == 2 for call in session.execute.await_args_list[:-1])
+    # Каждая порция — своя транзакция
+    assert session.commit.await_count == 7
+    edits = [call.args[0] for call in bot.edit_message_text.await_args_list]
+    assert edits == ["Очистка контекста… Удалено операций: 2.", PURGE_DONE]
+    assert not purger.is_running(7)
+
+
+@pytest.mark.asyncio
+async def test_purge_stop_keeps_context_marked(make_session_factory):
+    session = AsyncMock()
+    started = asyncio.Event()
+
+    async def execute(*args):
+        started.set()
+        await asyncio.sleep(10)
+
+    session.execute.side_effect = execute
+    purger = ContextPurger(make_session_factory(session), batch_size=2)
+
+    purger.start(AsyncMock(), 7, -100, "group", None)
+    await started.wait()
+    await purger.stop()
+
+    session.commit.assert_not_awaited()
+    assert not purger.is_running(7)
+
+
+@pytest.mark.asyncio
+@patch("bot.handlers.categories.context_purger")
+@patch("bot.handlers.categories.is_admin", new_callable=AsyncMock)
+async def test_clear_context_handler_marks_and_starts_purge(is_admin_mock, purger_mock):
+    is_admin_mock.return_value = True
+    purger_mock.is_running.return_value = False
+    message = AsyncMock()
+    message.chat = MagicMock(id=-100, type="group")
+    message.from_user = MagicMock(id=1)
+    message.reply.return_value = MagicMock(message_id=55)
+    context = MagicMock(id=7, purging=False)
+    session = AsyncMock()
+    session.execute.return_value = MagicMock(scalars=MagicMock(return_value=MagicMock(first=MagicMock(return_value=context))))
+
+    await categories.clear_context_handler(message, session)
+
+    assert context.purging is True
+    # Пометка видна другим транзакциям до начала удаления
+    session.commit.assert_awaited_once()
+    purger_mock.start.assert_called_once_with(message.bot, 7, -100, "group", 55)
+
+
+@pytest.mark.asyncio
+async def test_handle_expense_income_rejected_while_purging(mocker):
+    message = AsyncMock()
+    message.text = "1000 еда"
+    mocker.patch("bot.handlers.finance.resolve_user", new=AsyncMock(return_value=MagicMock(id=1)))
+    mocker.patch("bot.handlers.finance.resolve_context", new=AsyncMock(return_value=MagicMock(id=1, purging=True)))
+    submit_mock = mocker.patch("bot.handlers.finance.insert_batcher.submit", new=AsyncMock())
+
+    await finance.handle_expense_income(message, AsyncMock())
+
+    message.reply.assert_awaited_once_with(PURGE_REJECTED)
+    submit_mock.assert_not_awaited()
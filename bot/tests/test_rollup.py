@@ -0,0 +1,48 @@
+from datetime import datetime
+from decimal import Decimal
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+import bot.handlers.finance as finance
+from bot.services.rollup import split_period
+
+
+def test_split_period_month_to_now():
+    # Полные дни из агрегата, текущий неполный день — из операций
+    whole_days = split_period(datetime(2025, 7, 1), datetime(2025, 7, 15, 13, 30))
+    assert whole_days == (datetime(2025, 7, 1), datetime(2025, 7, 15))
+
+
+def test_split_period_today_has_no_whole_days():
+    assert split_period(datetime(2025, 7, 15), datetime(2025, 7, 15, 13, 30)) is None
+
+
+def test_split_period_partial_first_day():
+    whole_days = split_period(datetime(2025, 7, 1, 10), datetime(2025, 7, 4))
+    assert whole_days == (datetime(2025, 7, 2), datetime(2025, 7, 4))
+
+
+@pytest.mark.asyncio
+async def test_delete_record_callback_updates_rollup(mocker):
+    callback = AsyncMock()
+    callback.data = "delete_expense:1"
+    callback.from_user = MagicMock(id=1)
+    callback.message.text = "Расход добавлен!"
+
+    record = MagicMock(
+        user_id=1, context_id=2, category_id=3, kind="expense",
+        amount=Decimal("150"), created_at=datetime(2025, 7, 15, 12, 0),
+    )
+    mock_session = AsyncMock()
+    mock_session.get = AsyncMock(return_value=record)
+    mock_session.info = {}
+    mock_session.execute = AsyncMock(return_value=MagicMock(scalars=MagicMock(return_value=MagicMock(first=MagicMock(return_value=MagicMock(id=1))))))
+
+    add_daily_total_mock = mocker.patch("bot.handlers.finance.add_daily_total", new=AsyncMock())
+
+    await finance.delete_record_callback(callback, mock_session)
+
+    add_daily_total_mock.assert_awaited_once_with(
+        mock_session, "expense", 2, 1, 3, datetime(2025, 7, 15).date(), Decimal("-150"), count=-1,
+    )
@@ -0,0 +1,133 @@
+import asyncio
+import multiprocessing
+import time
+from unittest.mock import MagicMock
+
+import pytest
+
+from bot.services.sharding import ChatSequencer, Supervisor, shard_for, update_chat_id
+
+
+def test_update_chat_id_message():
+    raw = {"update_id": 1, "message": {"chat": {"id": -100123}, "from": {"id": 5}}}
+    assert update_chat_id(raw) == -100123
+
+
+def test_update_chat_id_callback_uses_message_chat():
+    raw = {"update_id": 2, "callback_query": {"from": {"id": 5}, "message": {"chat": {"id": -100123}}}}
+    assert update_chat_id(raw) == -100123
+
+
+def test_update_chat_id_falls_back_to_user():
+    raw = {"update_id": 3, "inline_query": {"from": {"id": 5}, "query": ""}}
+    assert update_chat_id(raw) == 5
+
+
+def test_shard_for_is_stable_and_in_range():
+    for chat_id in (-1001234567890, -5, 0, 7, 123456789):
+        shard = shard_for(chat_id, 4)
+        assert 0 <= shard < 4
+        assert shard == shard_for(chat_id, 4)
+
+
+@pytest.mark.asyncio
+async def test_chat_sequencer_keeps_order_within_chat():
+    sequencer = ChatSequencer()
+    events = []
+
+    async def handle(chat_id, n, delay):
+        await asyncio.sleep(delay)
+        events.append((chat_id, n))
+
+    # Первое обновление чата 1 обрабатывается дольше, но второе все равно идет после него
+    await sequencer.submit(1, lambda: handle(1, 1, 0.02))
+    await sequencer.submit(1, lambda: handle(1, 2, 0))
+    await sequencer.submit(2, lambda: handle(2, 1, 0))
+    await sequencer.join()
+
+    assert [n for chat_id, n in events if chat_id == 1] == [1, 2]
+    # Другой чат не ждет медленный чат
+    assert events[0] == (2, 1)
+
+
+@pytest.mark.asyncio
+async def test_chat_sequencer_backlog_of_one_chat_does_not_block_others():
+    sequencer = ChatSequencer(max_in_flight=2)
+    events = []
+    running = 0
+    peak = 0
+
+    async def handle(chat_id, n):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        events.append((chat_id, n))
+
+    # Очередь из пяти обновлений чата 1 занимает один слот, а не все
+    for n in range(5):
+        await sequencer.submit(1, lambda n=n: handle(1, n))
+    for chat_id in (2, 3):
+        await sequencer.submit(chat_id, lambda chat_id=chat_id: handle(chat_id, 0))
+    await sequencer.join()
+
+    assert events.index((2, 0)) < events.index((1, 1))
+    assert events.index((3, 0)) < events.index((1, 2))
+    assert [n for chat_id, n in events if chat_id == 1] == list(range(5))
+    assert peak == 2
+
+
+@pytest.mark.asyncio
+async def test_chat_sequencer_submit_waits_when_pending_limit_reached():
+    sequencer = ChatSequencer(max_in_flight=1, max_pending=2)
+    release = asyncio.Event()
+
+    await sequencer.submit(1, release.wait)
+    await sequencer.submit(2, release.wait)
+    third = asyncio.create_task(sequencer.submit(3, release.wait))
+    await asyncio.sleep(0)
+    assert not third.done()
+
+    release.set()
+    await third
+    await sequencer.join()
+
+
+@pytest.fixture
+def killed_worker():
+    # Настоящий процесс, убитый извне, вместо воркера бота
+    process = multiprocessing.get_context("spawn").Process(target=time.sleep, args=(60,))
+    process.start()
+    process.kill()
+    process.join()
+    return process
+
+
+@pytest.mark.asyncio
+async def test_supervisor_restarts_dead_worker_with_full_queue(mocker, killed_worker):
+    supervisor = Supervisor(1, queue_size=1, put_timeout=0.05)
+    supervisor._processes[0] = killed_worker
+    supervisor._queues[0].put({"update_id": 0})
+    restarted = MagicMock(is_alive=MagicMock(return_value=True))
+    # Новый воркер разбирает очередь, оставшуюся от упавшего
+    restarted.start.side_effect = lambda: supervisor._queues[0].get()
+    mocker.patch.object(supervisor, "_spawn", return_value=restarted)
+
+    raw = {"update_id": 1, "message": {"chat": {"id": 5}}}
+    await asyncio.wait_for(supervisor.dispatch(raw), timeout=5)
+
+    restarted.start.assert_called_once()
+    assert supervisor._processes[0] is restarted
+    assert supervisor._queues[0].get(timeout=1) == raw
+
+
+def test_supervisor_stop_does_not_hang_on_dead_worker(killed_worker):
+    supervisor = Supervisor(1, queue_size=1, put_timeout=0.05)
+    supervisor._processes[0] = killed_worker
+    supervisor._queues[0].put({"update_id": 0})
+
+    started = time.monotonic()
+    supervisor.stop()
+
+    assert time.monotonic() - started < 5
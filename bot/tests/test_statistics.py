@@ -1,49 +1,162 @@
-from datetime import UTC
+from datetime import datetime, timedelta
 from unittest.mock import AsyncMock, patch, MagicMock, PropertyMock
 
 import pytest
+from aiogram.types import CallbackQuery
 
 from bot.handlers import statistics
+from bot.services import stats
+from bot.services.cache import ResultCache, StatsGenerations
+from bot.services.stats import OperationCursor, OperationsPage
 
 
 @pytest.mark.asyncio
-@patch("bot.handlers.statistics.get_async_session")
-@patch("bot.handlers.statistics.get_or_create_context", new_callable=AsyncMock)
-@patch("bot.handlers.statistics.get_user", new_callable=AsyncMock)
-@patch("bot.handlers.statistics.menu_inline_keyboard")
-async def test_statdetail_handler_success(menu_kb_mock, get_user_mock, get_context_mock, get_async_session_mock):
-    # Подготовка данных
-    now = statistics.datetime.now(UTC)
-    menu_kb_mock.return_value = MagicMock()
+@patch("bot.handlers.statistics.resolve_context", new_callable=AsyncMock)
+@patch("bot.handlers.statistics.resolve_existing_user", new_callable=AsyncMock)
+async def test_statdetail_handler_first_page(get_user_mock, get_context_mock):
+    now = datetime(2026, 10, 18, 12, 30, 15, 123456)
 
     # Создаем моки
     mock_message = AsyncMock()
     type(mock_message).chat = PropertyMock(return_value=MagicMock())
 
-    callback = AsyncMock()
+    callback = AsyncMock(spec=CallbackQuery)
     type(callback).message = PropertyMock(return_value=mock_message)
     type(callback).from_user = PropertyMock(return_value=MagicMock(id=1, username="test_user"))
 
-    # Настраиваем моки для сессии БД
+    # Настраиваем моки для сессии БД: 31 строка — на странице 30, есть следующая
     session = AsyncMock()
-    session.execute.side_effect = [
-        MagicMock(all=lambda: [(now, 1000, "Зарплата")]),  # Доходы
-        MagicMock(all=lambda: [(now, 500, "Еда")]),        # Расходы
-    ]
+    rows = [("income", 1, now, 1000, "Зарплата")] + [("expense", i, now, 500, "Еда") for i in range(2, 32)]
+    session.execute.return_value = MagicMock(all=lambda: rows)
 
-    # Настраиваем контекстный менеджер сессии
-    get_async_session_mock.return_value.__aenter__.return_value = session
     get_context_mock.return_value = MagicMock(id=1)
     get_user_mock.return_value = MagicMock(id=1)
 
-    # Вызываем тестируемую функцию
-    await statistics.statdetail_handler(callback, None)
+    await statistics.statdetail_handler(callback, "week", session)
 
-    # Проверяем результаты
     mock_message.answer.assert_called_once()
-    call_args = mock_message.answer.call_args[0][0]
-    assert "Зарплата" in call_args
-    assert "Еда" in call_args
-    assert "1000" in call_args
-    assert "500" in call_args
-    menu_kb_mock.assert_called_once()
\ No newline at end of file
+    text = mock_message.answer.call_args[0][0]
+    assert "18.10.2026 - 12:30 | 🟢 +1000 • Зарплата" in text
+    assert text.count("• Еда") == 29
+    # Одна страница — один запрос
+    assert session.execute.await_count == 1
+
+    navigation = mock_message.answer.call_args[1]["reply_markup"].inline_keyboard[0]
+    assert [button.text for button in navigation] == ["Далее »"]
+    data = navigation[0].callback_data
+    assert len(data.encode()) <= 64
+    prefix, owner_id, date_from, span, direction, offset, record_id = data.split(":")
+    assert (prefix, int(owner_id, 36), direction, int(record_id, 36)) == ("sdu", 1, "n", 30)
+    date_from = statistics.EPOCH + timedelta(seconds=int(date_from, 36))
+    assert date_from + timedelta(microseconds=int(offset, 36)) == now
+
+
+@pytest.mark.asyncio
+@patch("bot.handlers.statistics.get_operations_page", new_callable=AsyncMock)
+@patch("bot.handlers.statistics.resolve_context", new_callable=AsyncMock)
+@patch("bot.handlers.statistics.resolve_existing_user", new_callable=AsyncMock)
+async def test_statdetail_page_callback_decodes_cursor(get_user_mock, get_context_mock, page_mock):
+    get_context_mock.return_value = MagicMock(id=1)
+    get_user_mock.return_value = MagicMock(id=2)
+    created_at = datetime(2026, 10, 3, 8, 0, 0, 42)
+    page_mock.return_value = OperationsPage([("income", 5, created_at, 10, "аванс")], has_prev=True, has_next=True)
+    date_from, date_to = datetime(2026, 10, 1), datetime(2026, 11, 1)
+    button = statistics._page_button("Далее »", "p", 1, date_from, date_to, ("expense", 77, created_at))
+    # Самые длинные значения укладываются в лимит Telegram
+    longest = statistics._page_button("Далее »", "n", 2**52, date_from, date_to, ("expense", 2**63 - 1, created_at))
+    assert len(longest.callback_data.encode()) <= 64
+
+    callback = AsyncMock()
+    callback.data = button.callback_data
+    callback.from_user = MagicMock(id=1, username="test_user")
+
+    await statistics.statdetail_page_callback(callback, AsyncMock())
+
+    args = page_mock.await_args[0]
+    assert args[3:6] == (date_from, date_to, OperationCursor(created_at, 77))
+    assert args[6] is True  # назад
+    text = callback.message.edit_text.call_args[0][0]
+    assert "c 01.10.2026 по 31.10.2026" in text
+    navigation = callback.message.edit_text.call_args[1]["reply_markup"].inline_keyboard[0]
+    assert [b.text for b in navigation] == ["« Назад", "Далее »"]
+
+
+@pytest.mark.asyncio
+@patch("bot.handlers.statistics.get_operations_page", new_callable=AsyncMock)
+async def test_statdetail_page_callback_rejects_other_user(page_mock):
+    callback = AsyncMock()
+    callback.data = "sdu:1:t3dzk0:1lev4:n:2dw46cga:25"
+    callback.from_user = MagicMock(id=2, username="other_user")
+
+    await statistics.statdetail_page_callback(callback, AsyncMock())
+
+    page_mock.assert_not_awaited()
+    callback.message.edit_text.assert_not_awaited()
+    assert callback.answer.await_args.kwargs["show_alert"] is True
+
+
+@pytest.mark.asyncio
+async def test_operations_page_is_one_keyset_scan():
+    session = AsyncMock()
+    session.execute.return_value = MagicMock(all=lambda: [])
+    cursor = OperationCursor(datetime(2026, 10, 1), 9)
+
+    await stats.get_operations_page(session, 1, 2, datetime(2026, 10, 1), datetime(2026, 11, 1), cursor, limit=30)
+
+    sql = str(session.execute.await_args[0][0].compile())
+    assert "(operations.created_at, operations.id) >" in sql
+    assert "UNION" not in sql
+    assert "ORDER BY operations.created_at, operations.id" in sql
+
+
+@pytest.mark.asyncio
+@patch("bot.services.stats.statcat_cache", new_callable=lambda: ResultCache(maxsize=10, ttl=60))
+@patch("bot.handlers.statistics.resolve_context", new_callable=AsyncMock)
+@patch("bot.handlers.statistics.resolve_existing_user", new_callable=AsyncMock)
+async def test_statcat_handler_single_query(get_user_mock, get_context_mock, cache):
+    message = AsyncMock()
+    message.from_user = MagicMock(id=1, username="test_user")
+
+    session = AsyncMock()
+    session.execute.return_value = MagicMock(all=lambda: [
+        ("expense", "кафе", 700, 1000),
+        ("expense", "такси", 300, 1000),
+        ("income", "зарплата", 5000, 5000),
+    ])
+    get_context_mock.return_value = MagicMock(id=1)
+    get_user_mock.return_value = MagicMock(id=1)
+
+    await statistics.statcat_handler(message, "day", session)
+
+    assert session.execute.await_count == 1
+    text = message.answer.call_args[0][0]
+    assert "5000 зарплата" in text
+    assert "700 кафе\n300 такси" in text
+    assert "Итого: 1000" in text
+
+
+@pytest.mark.asyncio
+@patch("bot.services.stats.stats_generations", new_callable=lambda: StatsGenerations(maxsize=10))
+@patch("bot.services.stats.statcat_cache", new_callable=lambda: ResultCache(maxsize=10, ttl=60))
+@patch("bot.services.stats.get_category_stats", new_callable=AsyncMock)
+async def test_category_stats_cached_until_data_changes(stats_mock, cache, generations):
+    date_from = datetime(2026, 10, 1)
+    date_to = datetime(2026, 11, 1)
+
+    await stats.get_category_stats_cached(AsyncMock(), 1, 2, date_from, date_to, "за месяц")
+    await stats.get_category_stats_cached(AsyncMock(), 1, 2, date_from, date_to, "за месяц")
+    assert stats_mock.await_count == 1
+
+    # Другой пользователь того же контекста и другой период кэшируются отдельно
+    await stats.get_category_stats_cached(AsyncMock(), 1, 3, date_from, date_to, "за месяц")
+    await stats.get_category_stats_cached(AsyncMock(), 1, 2, date_from, date_to + timedelta(days=1), "за период")
+    assert stats_mock.await_count == 3
+
+    # Новая операция пользователя и изменение категорий контекста сбрасывают результат
+    generations.bump(1, 2)
+    await stats.get_category_stats_cached(AsyncMock(), 1, 2, date_from, date_to, "за месяц")
+    generations.bump(1)
+    await stats.get_category_stats_cached(AsyncMock(), 1, 3, date_from, date_to, "за месяц")
+    assert stats_mock.await_count == 5
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 5
@@ -0,0 +1,146 @@
+from datetime import date
+from decimal import Decimal
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from bot.services import utils
+from bot.services.budgets import BudgetTracker
+
+
+def compiled(statement) -> str:
+    return str(statement.compile(dialect=postgresql.dialect()))
+
+
+@pytest.mark.asyncio
+async def test_get_or_create_user_is_single_upsert():
+    user = MagicMock(id=7)
+    session = AsyncMock()
+    session.scalars.return_value = MagicMock(one=MagicMock(return_value=user))
+    tg_user = MagicMock(id=123, username="new_name", first_name="Вася")
+
+    assert await utils.get_or_create_user(session, tg_user) is user
+
+    assert session.scalars.await_count == 1
+    sql = compiled(session.scalars.await_args[0][0])
+    assert "ON CONFLICT (tg_id) DO UPDATE SET username = excluded.username, first_name = excluded.first_name" in sql
+    assert "RETURNING" in sql
+    session.commit.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_get_context_does_not_copy_default_categories():
+    chat = MagicMock(id=-100123, type="group")
+    context = MagicMock(id=1)
+    session = AsyncMock()
+    session.add = MagicMock()
+
+    for inserted in (False, True):
+        session.execute.return_value = MagicMock(one=MagicMock(return_value=(context, inserted)))
+        assert await utils.get_context(session, chat) is context
+    session.add.assert_not_called()
+
+    sql = compiled(session.execute.await_args[0][0])
+    assert "ON CONFLICT (context_id, context_type) DO UPDATE" in sql
+
+
+@pytest.mark.asyncio
+async def test_get_category_prefers_context_override_of_template():
+    session = AsyncMock()
+    deleted = MagicMock(is_deleted=True)
+    session.execute.return_value = MagicMock(scalars=MagicMock(return_value=MagicMock(first=MagicMock(return_value=deleted))))
+
+    # Удаленное в чате переопределение скрывает шаблонную категорию
+    assert await utils.get_category(session, " Кафе ", MagicMock(id=1)) is None
+
+    sql = compiled(session.execute.await_args[0][0])
+    assert "categories.context_id IS NULL" in sql
+    assert "ORDER BY categories.context_id NULLS LAST" in sql
+
+
+@pytest.mark.asyncio
+async def test_override_default_category_repoints_context_rows():
+    session = AsyncMock()
+    session.add = MagicMock()
+    session.info = {}
+    template = MagicMock(id=5, title="кафе")
+
+    category = await utils.override_default_category(session, template, 1)
+
+    assert category.context_id == 1 and category.title == "кафе" and category.is_default
+    session.flush.assert_awaited_once()
+    tables = [compiled(call[0][0]).split()[1] for call in session.execute.await_args_list]
+    assert tables == ["operations", "daily_totals", "budgets", "budget_spending"]
+
+
+@pytest.mark.asyncio
+async def test_override_default_category_moves_budget_in_memory(mocker):
+    tracker = BudgetTracker()
+    mocker.patch("bot.services.utils.budget_tracker", tracker)
+    tracker.set_budget(1, 5, "month", Decimal("1000"), date(2025, 7, 1), Decimal("700"))
+    session = AsyncMock()
+    session.add = MagicMock(side_effect=lambda category: setattr(category, "id", 42))
+    session.info = {}
+
+    await utils.override_default_category(session, MagicMock(id=5, title="кафе"), 1)
+    # До коммита лимит остается на шаблонной категории
+    assert tracker.budget(1, 42) is None
+    for callback in session.info["after_commit"]:
+        callback()
+
+    assert tracker.budget(1, 5) is None
+    assert tracker.budget(1, 42) == ("month", Decimal("1000"))
+    # Расход по копии пересекает порог бюджета
+    assert tracker.add(1, 42, date(2025, 7, 16), Decimal("100"))[:2] == ("month", 80)
+
+
+@pytest.mark.asyncio
+async def test_suggest_category_uses_trigram_similarity():
+    session = AsyncMock()
+    suggestion = MagicMock()
+    session.execute.return_value = MagicMock(scalars=MagicMock(return_value=MagicMock(first=MagicMock(return_value=suggestion))))
+
+    assert await utils.suggest_category(session, " Продуктв ", MagicMock(id=1)) is suggestion
+
+    sql = compiled(session.execute.await_args[0][0])
+    assert "lower(categories.title) %% %(lower_1)s" in sql
+    assert "ORDER BY similarity(lower(categories.title)" in sql
+    assert "LIMIT" in sql
+
+
+@pytest.mark.asyncio
+async def test_suggest_category_skips_long_titles():
+    session = AsyncMock()
+    assert await utils.suggest_category(session, "x" * 65, MagicMock(id=1)) is None
+    session.execute.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_get_categories_by_titles_is_one_query():
+    session = AsyncMock()
+    cafe = MagicMock()
+    cafe.title = "Кафе"
+    session.execute.return_value = MagicMock(scalars=MagicMock(return_value=[cafe]))
+
+    categories = await utils.get_categories_by_titles(session, ["кафе ", "КАФЕ", "такси"], MagicMock(id=1))
+
+    assert categories == {"кафе": cafe}
+    assert session.execute.await_count == 1
+    sql = compiled(session.execute.await_args[0][0])
+    assert "DISTINCT ON (lower(categories.title))" in sql
+    assert "lower(anon_1.title) = ANY (%(titles)s::VARCHAR[])" in sql
+
+
+@pytest.mark.asyncio
+async def test_get_categories_by_titles_binds_titles_as_one_array():
+    session = AsyncMock()
+    session.execute.return_value = MagicMock(scalars=MagicMock(return_value=[]))
+    titles = [f"категория {i}" for i in range(40000)]
+
+    await utils.get_categories_by_titles(session, titles, MagicMock(id=1))
+
+    # Больше лимита asyncpg в 32767 параметров, но в запросе один параметр-массив
+    params = session.execute.await_args[0][0].compile(dialect=postgresql.dialect()).params
+    assert len(params) < 10
+    assert len(params["titles"]) == 40000
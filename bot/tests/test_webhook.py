@@ -0,0 +1,84 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+import pytest_asyncio
+from aiogram import Bot, Dispatcher, F, Router
+from aiogram.types import Message
+from aiohttp.test_utils import TestClient, TestServer
+
+from bot.services.db import acquire_instance_lock
+from bot.services.webhook import create_webhook_app
+
+SECRET = "test-secret"
+
+
+def fake_update(update_id: int, text: str) -> dict:
+    """Обновление в том виде, в котором его присылает Telegram."""
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 1752580800,
+            "chat": {"id": 456, "type": "private"},
+            "from": {"id": 123, "is_bot": False, "first_name": "Вася"},
+            "text": text,
+        },
+    }
+
+
+@pytest_asyncio.fixture
+async def webhook_client():
+    received = asyncio.Queue()
+    router = Router()
+
+    @router.message(F.text)
+    async def on_text(message: Message):
+        await received.put(message.text)
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    bot = Bot("123456:ABCdefGhIJKlmnoPQRstuVWXyz")
+    app = create_webhook_app(dp, bot, "/webhook", SECRET)
+
+    async with TestClient(TestServer(app)) as client:
+        yield client, received
+    await bot.session.close()
+
+
+@pytest.mark.asyncio
+async def test_webhook_dispatches_update(webhook_client):
+    client, received = webhook_client
+    response = await client.post(
+        "/webhook",
+        json=fake_update(1, "1000 кафе"),
+        headers={"X-Telegram-Bot-Api-Secret-Token": SECRET},
+    )
+    assert response.status == 200
+    assert await asyncio.wait_for(received.get(), timeout=1) == "1000 кафе"
+
+
+@pytest.mark.asyncio
+async def test_webhook_rejects_wrong_secret(webhook_client):
+    client, received = webhook_client
+    response = await client.post(
+        "/webhook",
+        json=fake_update(2, "1000 кафе"),
+        headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"},
+    )
+    assert response.status == 401
+    assert received.empty()
+
+
+@pytest.mark.asyncio
+async def test_second_instance_is_not_started(mocker):
+    connection = AsyncMock()
+    connection.execute.return_value = MagicMock(scalar=MagicMock(return_value=False))
+    mocker.patch("bot.services.db.engine", MagicMock(connect=AsyncMock(return_value=connection)))
+    mocker.patch("bot.services.db.settings", MagicMock(database_url="postgresql+asyncpg://u:p@db/bot"))
+
+    with pytest.raises(RuntimeError):
+        await acquire_instance_lock()
+
+    assert "pg_try_advisory_lock" in str(connection.execute.await_args.args[0])
+    connection.close.assert_awaited_once()
@@ -1,6 +1,16 @@
 import asyncio
 
+from bot.config import settings
 from bot.handlers import all_handlers
+from bot.middlewares import outgoing_limiter
+from bot.services.budgets import budget_tracker
+from bot.services.charts import chart_renderer
+from bot.services.confirmations import confirmation_summaries
+from bot.services.db import AsyncSessionLocal, acquire_instance_lock
+from bot.services.digests import digest_scheduler
+from bot.services.ingest import insert_batcher
+from bot.services.purge import context_purger
+from bot.services.webhook import run_webhook
 from bot.settings import bot, dp
 from bot.utils.logger import logger
 
@@ -8,8 +18,32 @@ for router in all_handlers:
     dp.include_router(router)
 
 async def main():
+    # Состояние бота хранится в памяти процесса: второй экземпляр не запускается
+    instance_lock = await acquire_instance_lock()
     logger.info("Бот запущен")
-    await dp.start_polling(bot)
+    # Бюджеты и расходы по ним за текущий период — для проверки лимитов без запросов
+    async with AsyncSessionLocal() as session:
+        await budget_tracker.load(session)
+    await insert_batcher.start()
+    # Очистки контекстов, прерванные прошлой остановкой
+    await context_purger.resume(bot)
+    digest_scheduler.start(bot)
+    try:
+        if settings.webhook_base_url:
+            await run_webhook(dp, bot)
+        else:
+            # allowed_updates вычисляется по зарегистрированным обработчикам
+            await dp.start_polling(bot)
+    finally:
+        # Дописываем в базу операции, накопленные в очереди
+        await insert_batcher.stop()
+        await context_purger.stop()
+        await digest_scheduler.stop()
+        await asyncio.to_thread(chart_renderer.shutdown)
+        await confirmation_summaries.stop(bot)
+        await outgoing_limiter.stop()
+        if instance_lock is not None:
+            await instance_lock.close()
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,96 @@
+import argparse
+import asyncio
+import sys
+from datetime import date
+
+from bot.config import settings
+from bot.services.db import AsyncSessionLocal, engine
+from bot.services.partitions import archive_partitions, ensure_partitions
+from bot.services.rollup import rebuild_daily_totals, verify_daily_totals
+from bot.utils.logger import logger
+
+
+async def rollup_rebuild(args):
+    """
+    Пересчитывает дневные агрегаты (daily_totals) из исходных операций.
+    """
+    async with AsyncSessionLocal() as session:
+        rows = await rebuild_daily_totals(session, args.context_id)
+    logger.info(f"daily_totals пересчитан: {rows} строк")
+    return 0
+
+
+async def rollup_verify(args):
+    """
+    Сверяет дневные агрегаты (daily_totals) с исходными операциями.
+    Возвращает ненулевой код выхода, если найдены расхождения.
+    """
+    async with AsyncSessionLocal() as session:
+        mismatches = await verify_daily_totals(session, args.context_id, args.limit)
+    if not mismatches:
+        print("daily_totals совпадает с историей операций")
+        return 0
+    print("context_id | user_id | day | category_id | kind | total (rollup/raw) | count (rollup/raw)")
+    for context_id, user_id, day, category_id, kind, stored_total, raw_total, stored_count, raw_count in mismatches:
+        print(
+            f"{context_id} | {user_id} | {day} | {category_id} | {kind} | "
+            f"{stored_total}/{raw_total} | {stored_count}/{raw_count}"
+        )
+    print(f"Найдены расхождения (показано не более {args.limit}). Исправление: python manage.py rollup rebuild")
+    return 1
+
+
+async def partitions_maintain(args):
+    """
+    Создает месячные секции operations наперед и переносит в архив секции старше срока хранения.
+    Запускается по расписанию (например, раз в сутки из cron).
+    """
+    today = date.today()
+    async with AsyncSessionLocal() as session:
+        created = await ensure_partitions(session, today, args.months_ahead)
+        archived = []
+        if args.retention_months is not None:
+            archived = await archive_partitions(session, today, args.retention_months, args.drop)
+    logger.info(f"Секций создано: {len(created)}, отсоединено: {len(archived)}")
+    return 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Служебные команды бота")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    rollup = commands.add_parser("rollup", help="Дневные агрегаты статистики")
+    rollup_commands = rollup.add_subparsers(dest="action", required=True)
+
+    rebuild = rollup_commands.add_parser("rebuild", help="Пересчитать агрегаты из истории")
+    rebuild.add_argument("--context-id", type=int, help="Только для одного контекста (contexts.id)")
+    rebuild.set_defaults(func=rollup_rebuild)
+
+    verify = rollup_commands.add_parser("verify", help="Сверить агрегаты с историей")
+    verify.add_argument("--context-id", type=int, help="Только для одного контекста (contexts.id)")
+    verify.add_argument("--limit", type=int, default=20, help="Сколько расхождений показать")
+    verify.set_defaults(func=rollup_verify)
+
+    partitions = commands.add_parser("partitions", help="Месячные секции operations")
+    partitions_commands = partitions.add_subparsers(dest="action", required=True)
+
+    maintain = partitions_commands.add_parser("maintain", help="Создать секции наперед и архивировать старые")
+    maintain.add_argument("--months-ahead", type=int, default=settings.partition_months_ahead,
+                          help="На сколько месяцев вперед создавать секции")
+    maintain.add_argument("--retention-months", type=int, default=settings.partition_retention_months,
+                          help="Сколько месяцев хранить операции (по умолчанию — без ограничения)")
+    maintain.add_argument("--drop", action="store_true", help="Удалять старые секции вместо переноса в схему archive")
+    maintain.set_defaults(func=partitions_maintain)
+
+    return parser.parse_args()
+
+
+async def main(args):
+    try:
+        return await args.func(args)
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
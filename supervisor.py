@@ -0,0 +1,44 @@
+import argparse
+import asyncio
+import os
+
+from bot.config import settings
+from bot.handlers import all_handlers
+from bot.services.db import acquire_instance_lock
+from bot.services.sharding import Supervisor
+from bot.services.webhook import serve_app, set_webhook
+from bot.settings import bot, dp
+from bot.utils.logger import logger
+
+for router in all_handlers:
+    dp.include_router(router)
+
+async def main(workers: int):
+    """
+    Многопроцессный запуск: supervisor получает обновления и раздает их воркерам по chat.id.
+    """
+    # Воркеры делят чаты между собой; второй supervisor или main.py с той же базой не запускается
+    instance_lock = await acquire_instance_lock()
+    supervisor = Supervisor(workers, queue_size=settings.shard_queue_size)
+    supervisor.start()
+    allowed_updates = dp.resolve_used_update_types()
+    try:
+        if settings.webhook_base_url:
+            await set_webhook(bot, allowed_updates)
+            await serve_app(supervisor.create_webhook_app(settings.webhook_path, settings.webhook_secret))
+        else:
+            await supervisor.poll(bot, allowed_updates)
+    finally:
+        await bot.session.close()
+        await asyncio.to_thread(supervisor.stop)
+        if instance_lock is not None:
+            await instance_lock.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Запуск бота в нескольких процессах")
+    parser.add_argument("--workers", type=int, default=settings.shard_workers or os.cpu_count())
+    args = parser.parse_args()
+    try:
+        asyncio.run(main(args.workers))
+    except KeyboardInterrupt:
+        logger.info("Бот остановлен вручную")